@@ -1,12 +1,15 @@
 import os
-import psutil
 
+import click
 from flask import Flask, render_template, jsonify
 from flask_login import LoginManager
 
-from module.datastore import datastore
-from module.auth import User, auth, create_admin_user, get_total_files_num
-from module.util import DATABASE_PATH, db
+from module.datastore import datastore, start_archive_job
+from module.auth import User, auth, create_admin_user, migrate_user_groups, get_total_files_num
+from module.util import DATABASE_PATH, db, get_manifest_path
+from module.manifest_index import manifest_indexer
+from module.ingest import IngestError, ingest
+from module import shared_index
 
 if not os.path.exists(DATABASE_PATH):
     os.makedirs(DATABASE_PATH)
@@ -20,6 +23,8 @@ app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(DATABASE_PATH,
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'os3N95B6Z9cs'
 app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024
+# werkzeug's default of 1000 multipart parts would refuse a 1000-file upload
+app.config['MAX_FORM_PARTS'] = 10000
 
 db.init_app(app)
 
@@ -38,6 +43,79 @@ def load_user(user_id):
         return None
 
 
+def init_database():
+    """create missing tables, move legacy group membership over and make sure the admin exists"""
+    db.create_all()
+    migrate_user_groups()
+    create_admin_user()
+
+
+@app.cli.command('init-db')
+def init_db():
+    """Create or upgrade the database; run once before starting the server."""
+    init_database()
+
+
+@app.cli.command('migrate-groups')
+def migrate_groups():
+    """Move group membership out of the legacy user_groups column."""
+    db.create_all()
+    migrate_user_groups()
+
+
+@app.cli.command('rebuild-shared-index')
+def rebuild_shared_index():
+    """Rebuild the shared files index from every user's metadata."""
+    db.create_all()
+
+    for user in User.query.all():
+        shared_index.rebuild_user(user)
+        print(f'Indexed shared files of {user.username}')
+
+
+@app.cli.command('index-manifests')
+def index_manifests():
+    """Index the contents of every archive not indexed yet, for every user."""
+    db.create_all()
+
+    for user in User.query.all():
+        repo_path = os.path.join(user.store_path, 'repo')
+        if not os.path.exists(repo_path):
+            continue
+
+        count = manifest_indexer.index_repository(get_manifest_path(user), repo_path)
+        print(f'Indexed {count} archive(s) of {user.username}')
+
+
+@app.cli.command('ingest')
+@click.argument('username')
+@click.argument('archive', type=click.Path(exists=True, dir_okay=False))
+@click.option('--path', default='/', help='Directory of the tree to unpack into.')
+@click.option('--permissions', default=740, type=int, help='Permissions of every ingested entry.')
+def ingest_archive(username, archive, path, permissions):
+    """Unpack a tar or zip into a user's tree and take one archive of it."""
+    db.create_all()
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.ClickException(f'No user named {username}')
+
+    with open(archive, 'rb') as f:
+        try:
+            result = ingest(user, f, os.path.basename(archive), dest=path, permissions=permissions)
+        except IngestError as e:
+            raise click.ClickException(str(e))
+
+    for skipped in result['skipped']:
+        print(f'Skipped {skipped}: something else is in its place')
+    print(f"Ingested {result['count']} file(s), {result['added']} new, into {path}")
+
+    if result['count']:
+        job = start_archive_job(user)
+        job.wait()
+        print(f'Archive {job.state}' + (f': {job.error}' if job.error else ''))
+
+
 @app.route('/')
 def home():
     return render_template('home.html', files_num=get_total_files_num())
@@ -50,6 +128,9 @@ def system_perf():
 
 @app.route('/system_stats')
 def generate_sys_stats():
+    # only this page needs it, so it is not imported at startup
+    import psutil
+
     cpu_usage = psutil.cpu_percent()
     disk_usage = psutil.disk_usage('/')
     total = f"{disk_usage.total / (1024**3):.2f}"
@@ -90,7 +171,6 @@ def generate_sys_stats():
 
 if __name__ == '__main__':
     with app.app_context():
-        db.create_all()
-        create_admin_user()
+        init_database()
 
     app.run(host='0.0.0.0', port=8000)
@@ -4,9 +4,12 @@ from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, SelectField, SubmitField, BooleanField
 from wtforms.validators import InputRequired, Length, EqualTo, Optional
 from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
-from module.util import DATABASE_PATH, db, auth_logger, octal_to_dict, get_metadb_path, convert_to_bytes
-from module.metadata import UserMetadata
+from module.util import DATABASE_PATH, db, auth_logger, octal_to_dict, get_metadb_path, get_user_tree_path, convert_to_bytes
+from module.metadata import UserMetadata, Viewer
+from module.content_index import content_indexer
 
 import hashlib
 import time
@@ -20,6 +23,55 @@ def gen_quota_selections(quotas):
     return [(0, 'None')] + [(convert_to_bytes(size), size) for size in quotas]
 
 
+class Group(db.Model):
+    __tablename__ = 'groups'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False, unique=True)
+
+
+class GroupMember(db.Model):
+    __tablename__ = 'group_members'
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_group_members_user', 'user_id', 'group_id'),
+    )
+
+
+# group name -> id of committed groups; groups are never renamed or deleted, so entries stay valid
+_group_ids = {}
+
+
+@event.listens_for(Session, 'after_commit')
+def _remember_group_ids(session):
+    _group_ids.update(session.info.pop('group_ids', {}))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_group_ids(session):
+    session.info.pop('group_ids', None)
+
+
+def get_group_id(name, create=False):
+    """return the id of group NAME, creating the group if CREATE is set"""
+    if name in _group_ids:
+        return _group_ids[name]
+
+    group = Group.query.filter_by(name=name).first()
+    if not group and create:
+        group = Group(name=name)
+        db.session.add(group)
+        db.session.flush()
+
+    if not group:
+        return None
+
+    # the group may have been created in this transaction, so it is only cached once that commits
+    db.session.info.setdefault('group_ids', {})[name] = group.id
+    return group.id
+
+
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
     id = db.Column(db.Integer, primary_key=True)
@@ -52,6 +104,43 @@ class User(db.Model, UserMixin):
             self.flags = 0
         return (self.flags & flag) > 0
 
+    def group_names(self):
+        return [name for (name,) in db.session.query(Group.name).join(
+            GroupMember, GroupMember.group_id == Group.id
+        ).filter(GroupMember.user_id == self.id).order_by(Group.id)]
+
+    def group_bits(self):
+        """return the user's groups as a bitset of group ids, cached on the instance"""
+        if getattr(self, '_group_bits', None) is None:
+            bits = 0
+            for (group_id,) in db.session.query(GroupMember.group_id).filter_by(user_id=self.id):
+                bits |= 1 << group_id
+            self._group_bits = bits
+
+        return self._group_bits
+
+    def in_group(self, name):
+        group_id = get_group_id(name)
+        return group_id is not None and (self.group_bits() >> group_id) & 1 == 1
+
+    def join_group(self, name):
+        group_id = get_group_id(name, create=True)
+        if not GroupMember.query.filter_by(group_id=group_id, user_id=self.id).first():
+            db.session.add(GroupMember(group_id=group_id, user_id=self.id))
+        self._sync_groups()
+
+    def leave_group(self, name):
+        group_id = get_group_id(name)
+        if group_id is not None:
+            GroupMember.query.filter_by(group_id=group_id, user_id=self.id).delete()
+        self._sync_groups()
+
+    def _sync_groups(self):
+        # drop the cached bitset and keep the legacy comma separated column current
+        db.session.flush()
+        self._group_bits = None
+        self.user_groups = ','.join(self.group_names())
+
 
 class RegisterForm(FlaskForm):
     username = StringField(validators=[InputRequired(),
@@ -88,8 +177,12 @@ def get_user_by_id(user_id):
     return User.query.filter_by(id=user_id).first()
 
 
+def get_viewer(user):
+    """return the permission context metadata queries filter on for USER"""
+    return Viewer(user.id, user.group_names(), user.has_flag(User.ADMIN))
+
+
 def evaluate_permission(user, file, perm):
-    user_groups = user.user_groups.split(',')
     file_perms = file['permissions']
     file_owner = file['owner']
     file_group = file['file_group']
@@ -110,7 +203,7 @@ def evaluate_permission(user, file, perm):
     if perms_dict['all'][perm]:
         return True
 
-    if file_group in user_groups:
+    if user.in_group(file_group):
         if perms_dict['group'][perm]:
             return True
 
@@ -143,6 +236,9 @@ def login():
                     login_user(user)
                     auth_logger.info(f'User logged in: {user.username}')
 
+                    # catch up on anything uploaded before the indexer last ran
+                    content_indexer.schedule(get_metadb_path(user), get_user_tree_path(user))
+
                     return redirect(url_for('/store.file_viewer'))
                 else:
                     auth_logger.warn(f'Login attempted for disabled account: {user.username}')
@@ -197,7 +293,7 @@ def account_manager():
                            form=form,
                            users_list=list_users(),
                            hidden_status=current_user.has_flag(User.HIDDEN),
-                           groups_list=current_user.user_groups.split(','))
+                           groups_list=current_user.group_names())
 
 
 @auth.route('/create', methods=['GET', 'POST'])
@@ -226,6 +322,10 @@ def create_user():
                     store_path=store_path,
                     user_groups=f'{form.username.data},users')
         db.session.add(user)
+        db.session.flush()
+
+        user.join_group(user.username)
+        user.join_group('users')
 
         if form.hidden.data:
             user.set_flag(User.HIDDEN)
@@ -245,17 +345,15 @@ def create_user():
 @login_required
 def add_group():
     group = request.json.get('group')
-    groups = current_user.user_groups.split(',')
 
     if group is None:
         flash('No group found', 'error')
         return jsonify({'error': 'Group not found'}), 404
 
-    if group not in groups:
+    if not current_user.in_group(group):
         if group.isalpha():
             flash(f'Added {current_user.username} to group: {group}', 'success')
-            groups += [group]
-            current_user.user_groups = ','.join(groups)
+            current_user.join_group(group)
             db.session.commit()
         else:
             flash(f'Could not add {group} to groups, invalid character', 'error')
@@ -269,7 +367,6 @@ def add_group():
 @login_required
 def remove_group():
     group = request.json.get('group')
-    groups = current_user.user_groups.split(',')
 
     print(group)
 
@@ -277,8 +374,8 @@ def remove_group():
         flash('No group found', 'error')
         return jsonify({'error': 'Group not found'}), 404
 
-    if group in groups:
-        current_user.user_groups = ','.join([g for g in groups if g != group])
+    if current_user.in_group(group):
+        current_user.leave_group(group)
         db.session.commit()
         flash(f'Removed {current_user.username} from group: {group}', 'success')
     else:
@@ -326,13 +423,19 @@ def enable_user(userid):
 @login_required
 def delete_user(userid):
     if current_user.has_flag(User.ADMIN):
+        # module.shared_index imports this module, so import it late
+        from module.shared_index import remove_user
+
         user = get_user_by_id(userid)
         store_path = user.store_path
 
+        # ids are reused, so a later account must not inherit these memberships
+        GroupMember.query.filter_by(user_id=user.id).delete()
+        user._group_bits = None
         User.query.filter(User.id == user.id).delete()
+        # commits the rows above together with the user's shared index entries
+        remove_user(user)
         shutil.rmtree(store_path)
-
-        db.session.commit()
         flash(f'Account <{user.username}> deleted successfully.', 'success')
 
     return redirect(request.referrer)
@@ -360,11 +463,29 @@ def create_admin_user():
         admin_user.set_flag(User.ADMIN)
         admin_user.set_flag(User.HIDDEN)
         db.session.add(admin_user)
+        db.session.flush()
+
+        admin_user.join_group('admin')
         db.session.commit()
 
         auth_logger.info(f'Admin user created: {admin_user.username}')
 
 
+def migrate_user_groups():
+    """populate group membership from the legacy `user_groups` column for users without any"""
+    members = {user_id for (user_id,) in db.session.query(GroupMember.user_id).distinct()}
+
+    for user in User.query.all():
+        if user.id in members or not user.user_groups:
+            continue
+
+        for name in user.user_groups.split(','):
+            if name:
+                user.join_group(name)
+
+    db.session.commit()
+
+
 @auth.route('/list-users')
 @login_required
 def list_users():
@@ -0,0 +1,141 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from module.util import store_logger
+from module.metadata import UserMetadata
+
+TEXT_EXTENSIONS = [
+    'txt', 'text', 'md', 'markdown', 'rst', 'org', 'log', 'csv', 'tsv',
+    'json', 'yaml', 'yml', 'toml', 'ini', 'cfg', 'conf', 'xml', 'html', 'htm', 'css',
+    'py', 'js', 'ts', 'c', 'h', 'cpp', 'hpp', 'java', 'go', 'rs', 'rb', 'php', 'sh', 'sql', 'tex'
+]
+
+# only the head of large files is indexed
+MAX_INDEXED_BYTES = 1 * 1024 * 1024
+
+BATCH_SIZE = 64
+
+# fraction of wall time the indexer may spend working; it sleeps for the rest
+CPU_BUDGET = float(os.getenv('CONTENT_INDEX_CPU_BUDGET', '0.25'))
+WORKERS = int(os.getenv('CONTENT_INDEX_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+
+
+def extract_text(path, max_bytes=MAX_INDEXED_BYTES):
+    """return the first MAX_BYTES of PATH as text, or None if it is unreadable or binary"""
+    try:
+        with open(path, 'rb') as f:
+            data = f.read(max_bytes)
+    except OSError:
+        return None
+
+    if b'\x00' in data[:8192]:
+        return None
+
+    return data.decode('utf-8', errors='replace')
+
+
+def read_content(path, max_bytes=MAX_INDEXED_BYTES):
+    """return (st_mtime_ns, text) of PATH, the mtime taken before reading so a concurrent edit is seen next time"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return None, None
+
+    return mtime, extract_text(path, max_bytes)
+
+
+def file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ContentIndexer:
+    """Index the content of text-like files in the background.
+
+    Users are queued with `schedule`; a single daemon thread drains the queue,
+    extracting text in a process pool one batch at a time and writing each
+    batch to the user's metadata database in one transaction.
+    """
+
+    def __init__(self, cpu_budget=CPU_BUDGET, workers=WORKERS, batch_size=BATCH_SIZE):
+        self.cpu_budget = cpu_budget
+        self.workers = workers
+        self.batch_size = batch_size
+
+        self.queue = queue.Queue()
+        self.scheduled = set()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.pool = None
+
+    def schedule(self, db_path, tree_path):
+        """queue the metadata database DB_PATH, whose files live under TREE_PATH, for indexing"""
+        with self.lock:
+            if db_path in self.scheduled:
+                return
+
+            self.scheduled.add(db_path)
+            self.queue.put((db_path, tree_path))
+
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='content-indexer', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            db_path, tree_path = self.queue.get()
+
+            with self.lock:
+                self.scheduled.discard(db_path)
+
+            try:
+                self.index_user(db_path, tree_path)
+            except Exception as e:
+                store_logger.error(f'Content indexing failed for {db_path}: {e}')
+
+    def _get_pool(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+        return self.pool
+
+    def _throttle(self, elapsed):
+        if 0 < self.cpu_budget < 1:
+            time.sleep(elapsed * (1 / self.cpu_budget - 1))
+
+    def index_user(self, db_path, tree_path):
+        """index every pending file of one user, batch by batch"""
+        metadata = UserMetadata(db_path)
+        indexed = 0
+
+        # a file rewritten with the same size is only told apart by its mtime
+        stale = [file_id for file_id, path, filename, mtime in metadata.get_indexed_content(TEXT_EXTENSIONS)
+                 if file_mtime(os.path.join(tree_path, path.strip('/'), filename)) != mtime]
+        metadata.expire_content(stale)
+
+        while True:
+            batch = metadata.get_unindexed_content(TEXT_EXTENSIONS, limit=self.batch_size)
+            if not batch:
+                break
+
+            start = time.monotonic()
+
+            paths = [os.path.join(tree_path, path.strip('/'), filename) for _, path, filename, _ in batch]
+            contents = self._get_pool().map(read_content, paths)
+
+            metadata.store_content([(file_id, size, mtime, body)
+                                    for (file_id, _, _, size), (mtime, body) in zip(batch, contents)])
+            indexed += len(batch)
+
+            self._throttle(time.monotonic() - start)
+
+        if indexed:
+            store_logger.info(f'Indexed content of {indexed} file(s) in {db_path}')
+
+
+content_indexer = ContentIndexer()
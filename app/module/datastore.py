@@ -1,22 +1,30 @@
 import os
-import subprocess
-import time
 import datetime
 import shutil
 
-from flask import Blueprint, request, jsonify, send_from_directory, render_template, url_for, redirect, flash
+from flask import Blueprint, Response, current_app, request, jsonify, send_from_directory, render_template, url_for, redirect, flash
 from flask_login import login_required, current_user
 from flask_wtf import FlaskForm
 from wtforms import SelectField, SubmitField, StringField
 from wtforms.validators import InputRequired, Length, Regexp
 from werkzeug.utils import secure_filename
 
-from module.auth import list_users, get_user_by_id, evaluate_read_permission, evaluate_write_permission, evaluate_exec_permission
-from module.util import db, borg_api, store_logger, convert_from_bytes, octal_to_string, get_repo_path, get_mount_path, get_metadb_path, get_user_tree_path, get_stage_path
+from module.auth import list_users, get_user_by_id, get_viewer, evaluate_read_permission, evaluate_write_permission, evaluate_exec_permission
+from module.util import db, borg_api, store_logger, convert_to_bytes, convert_from_bytes, octal_to_string, get_repo_path, get_metadb_path, get_user_tree_path, get_stage_path, get_manifest_path
 from module.metadata import UserMetadata
+from module.content_index import content_indexer
+from module.manifest_index import ManifestIndex, manifest_indexer, parse_cursor, tree_dir, tree_member
+from module.jobs import start_job, get_job
+from module.ingest import IngestError, ingest
+from module.exports import EXPORT_FORMATS, ExportError, export_archive, export_tree
+from module.diffs import MAX_DIFF_BYTES, MAX_DIFF_FILES, get_diff_pool, live_file_diffs, read_archived, scan_tree, tree_changes, unified_file_diff
+from module import shared_index
 
 datastore = Blueprint('/store', __name__)
 
+# seconds an archive create waits for another borg command to release the repository
+ARCHIVE_LOCK_WAIT = int(os.getenv('ARCHIVE_LOCK_WAIT', 300))
+
 
 class SharedFilesForm(FlaskForm):
     owner = SelectField('Owner:', coerce=int,
@@ -41,18 +49,15 @@ class NewFolderForm(FlaskForm):
     submit = SubmitField('Create Folder')
 
 
-def get_user_stats(user):
+def get_user_stats(user, borg_stats=None):
+    """storage statistics of USER, reusing BORG_STATS from `borg info` when the caller has them"""
     metadata = UserMetadata(get_metadb_path(user))
-    borg_stats = borg_api.info(get_repo_path(user), json=True)
+    if borg_stats is None:
+        borg_stats = borg_api.info(get_repo_path(user), json=True)
     tree_path = get_user_tree_path(user)
 
     repo_size = borg_stats['cache']['stats']['unique_csize']
-    stage_size = 0
-
-    for path, dirs, files in os.walk(tree_path):
-        for f in files:
-            fp = os.path.join(path, f)
-            stage_size += os.stat(fp).st_size
+    stage_size = get_tree_size(tree_path)
 
     if not user.quota == 0:
         percent_used = repo_size / user.quota * 100
@@ -73,29 +78,57 @@ def get_user_stats(user):
     return stats
 
 
-def create_archive(user):
-    """create a new archive for USER."""
-    original_cwd = os.getcwd()
-    os.chdir(user.store_path)
+def get_tree_size(tree_path):
+    size = 0
+
+    for path, dirs, files in os.walk(tree_path):
+        for f in files:
+            size += os.stat(os.path.join(path, f)).st_size
+
+    return size
+
+
+def start_archive_job(user):
+    """create a new archive for USER in the background and return the job tracking it
 
+    Every archive is taken this way. borg waits up to ARCHIVE_LOCK_WAIT
+    seconds for the repository lock, so a create that starts while another
+    one or an indexing pass holds it runs after them instead of failing.
+    """
     borg_unmount(user)
 
-    current_time = datetime.datetime.now()
     repo_path = get_repo_path(user)
+    archive = datetime.datetime.now().strftime(f"{repo_path}::%Y-%m-%d_%H:%M:%S")
+    manifest_path = get_manifest_path(user)
+    app = current_app._get_current_object()
+    user_id = user.id
+
+    def finish(job, borg_job):
+        try:
+            borg_job.result(0)
+        except Exception:
+            return
+
+        with app.app_context():
+            owner = get_user_by_id(user_id)
+            owner.archive_state = archive
+            db.session.commit()
+            store_logger.info(f'User {owner.username} created a new archive: {archive}')
 
-    user.archive_state = current_time.strftime(f"{repo_path}::%Y-%m-%d_%H:%M:%S")
-    borg_api.create(user.archive_state, 'stage')
+        manifest_indexer.schedule(manifest_path, repo_path)
 
-    db.session.commit()
-    os.chdir(original_cwd)
+    return start_job(user.id, 'create', 'create', archive,
+                     os.path.join(user.store_path, '.', 'stage'),
+                     total_bytes=get_tree_size(get_stage_path(user)), on_done=finish,
+                     lock_wait=ARCHIVE_LOCK_WAIT)
 
-    store_logger.info(f'User {user.username} created a new archive: {user.archive_state}')
 
+def get_archives(user):
+    return borg_api.list(get_repo_path(user), json=True)['archives']
 
-def find_archive_by_id(id):
-    archives = list_archives()
 
-    for archive in archives:
+def find_archive_by_id(user, id):
+    for archive in get_archives(user):
         if archive['id'] == id:
             return archive
 
@@ -131,7 +164,7 @@ def create_folder(folder_name, folder_perms, path):
 
     os.makedirs(abs_dir)
 
-    metadata.add_file(
+    file_id = metadata.add_file(
         filename=folder_name,
         owner=current_user.id,
         file_group=current_user.username,
@@ -141,16 +174,13 @@ def create_folder(folder_name, folder_perms, path):
         path=parent_path
     )
 
+    if file_id:
+        shared_index.sync_file(current_user, file_id)
+
     store_logger.info(f'User {current_user.username} created folder: {abs_dir}')
     flash('Folder created successfully', 'success')
 
 
-@login_required
-def filter_permitted_files(files):
-    return [file for file in files
-            if evaluate_read_permission(current_user, file)]
-
-
 @datastore.route('/retrieve/<user>')
 @login_required
 def retrieve_user_store(user):
@@ -161,13 +191,12 @@ def retrieve_user_store(user):
     req_path = request.args.get('path', '/')
     current_path = metadata._sanitize_path(req_path)
 
-    files = metadata.get_files(current_path)
+    files = metadata.get_files(current_path, viewer=get_viewer(current_user))
     dirs_raw = metadata.list_subdirectories(current_path)
 
-    folder_names_in_files = set()
-    for file in files:
-        if file['is_directory']:
-            folder_names_in_files.add(file['name'])
+    # includes directories the viewer cannot read, so they are not
+    # re-added below as synthetic entries
+    folder_names_in_files = metadata.get_directory_names(current_path)
 
     for dirname, fullpath in dirs_raw:
         if dirname not in folder_names_in_files:
@@ -188,50 +217,156 @@ def retrieve_user_store(user):
 
     files.sort(key=lambda x: (not x['is_directory'], x['name'].lower()))
 
-    files_avail = filter_permitted_files(files)
+    return {'files': files, 'path': current_path}
+
+
+@datastore.route('/search')
+@login_required
+def search_files():
+    user_id = request.args.get('user_id', current_user.id)
+    user = get_user_by_id(user_id)
+
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    try:
+        min_size = request.args.get('min_size')
+        max_size = request.args.get('max_size')
+        date_from = request.args.get('from')
+        date_to = request.args.get('to')
+        cursor = request.args.get('cursor')
+
+        search_args = {
+            'query': request.args.get('q', '').strip(),
+            'content': request.args.get('content', '').strip(),
+            'extension': request.args.get('ext', '').strip(),
+            'min_size': convert_to_bytes(min_size) if min_size else None,
+            'max_size': convert_to_bytes(max_size) if max_size else None,
+            'date_from': datetime.datetime.fromisoformat(date_from) if date_from else None,
+            'date_to': datetime.datetime.fromisoformat(date_to) if date_to else None,
+            'cursor': int(cursor) if cursor else None,
+            'limit': min(max(int(request.args.get('limit', 50)), 1), 500)
+        }
+    except ValueError as e:
+        return jsonify({'error': f'Invalid search parameter: {e}'}), 400
+
+    metadata = UserMetadata(get_metadb_path(user))
 
-    return {'files': files_avail, 'path': current_path}
+    return jsonify(metadata.search_files(viewer=get_viewer(current_user), **search_args))
 
 
 @datastore.route('/archive-list')
 @login_required
 def list_archives():
-    repo_path = get_repo_path(current_user)
-    return borg_api.list(repo_path, json=True)['archives']
+    return get_archives(current_user)
+
+
+@datastore.route('/stats')
+@login_required
+def user_stats():
+    return jsonify(get_user_stats(current_user))
 
 
 @datastore.route('/diff/<archive>', methods=['GET'])
 @login_required
 def get_diff(archive):
-    original_cwd = os.getcwd()
-    os.chdir(current_user.store_path)
+    """page through what changed between ARCHIVE and the live tree; hunks come from get_diff_hunks"""
+    try:
+        cursor = request.args.get('cursor') or None
+        limit = min(max(int(request.args.get('limit', 200)), 1), 1000)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid pagination parameter: {e}'}), 400
 
-    mount_path = get_mount_path(current_user)
-    repo_path = get_repo_path(current_user)
+    user = current_user._get_current_object()
+    index = ManifestIndex(get_manifest_path(user))
+    archived = index.get_tree(archive)
+
+    if archived is None:
+        manifest_indexer.schedule(get_manifest_path(user), get_repo_path(user))
+        return jsonify({'error': 'Archive not indexed yet'}), 404
+
+    live = scan_tree(get_user_tree_path(user))
+    page = tree_changes(archived, live, cursor=cursor, limit=limit)
+    page['archive'] = archive
 
-    mount_archive = find_archive_by_id(archive)['archive']
+    return jsonify(page)
 
-    if not mount_archive:
+
+@datastore.route('/diff/<archive>/files', methods=['GET'])
+@login_required
+def get_diff_hunks(archive):
+    """unified diffs of the requested files between ARCHIVE and the live tree"""
+    user = current_user._get_current_object()
+    metadata = UserMetadata(get_metadb_path(user))
+    paths = [metadata._sanitize_path(path) for path in request.args.getlist('path')]
+
+    if not paths or '/' in paths:
+        return jsonify({'error': 'No file path given'}), 400
+    if len(paths) > MAX_DIFF_FILES:
+        return jsonify({'error': f'At most {MAX_DIFF_FILES} files per request'}), 400
+
+    archive_name = resolve_archive(user, archive)
+    if not archive_name:
         return jsonify({'error': 'Archive does not exist'}), 400
 
-    borg_unmount(current_user)
+    files = live_file_diffs(get_repo_path(user), archive_name, get_user_tree_path(user), paths)
+    return jsonify({'archive': archive, 'files': files})
 
-    borg_api.mount(f"{repo_path}::{mount_archive}", mount_path)
 
-    while not os.path.ismount(mount_path):
-        print(f"Waiting for mount at {mount_path}...")
-        time.sleep(.01)
+def resolve_archive(user, archive_id):
+    """return the name of USER's archive ARCHIVE_ID, from the manifest index if it is indexed"""
+    archive = ManifestIndex(get_manifest_path(user)).get_archive(archive_id)
+    if archive is not None:
+        return archive['name']
 
-    result = subprocess.Popen(
-        ['git', 'diff', '--no-index', "stage/tree", "mount/stage/tree"],
-        stdout=subprocess.PIPE,
-        text=True
-    )
-    output, error = result.communicate()
+    archive = find_archive_by_id(user, archive_id)
+    return archive['name'] if archive else None
 
-    os.chdir(original_cwd)
-    borg_unmount(current_user)
-    return jsonify({"diff": output})
+
+@datastore.route('/diff/<old>/<new>', methods=['GET'])
+@login_required
+def get_archive_diff(old, new):
+    """page through what changed between archives OLD and NEW, from the manifest index"""
+    try:
+        cursor = request.args.get('cursor') or None
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid pagination parameter: {e}'}), 400
+
+    user = current_user._get_current_object()
+    page = ManifestIndex(get_manifest_path(user)).get_changes(old, new, cursor=cursor, limit=limit)
+
+    if page is None:
+        if not resolve_archive(user, old) or not resolve_archive(user, new):
+            return jsonify({'error': 'Archive does not exist'}), 400
+        manifest_indexer.schedule(get_manifest_path(user), get_repo_path(user))
+        return jsonify({'error': 'Archive not indexed yet'}), 404
+
+    return jsonify(page)
+
+
+@datastore.route('/diff/<old>/<new>/file', methods=['GET'])
+@login_required
+def get_archive_file_diff(old, new):
+    user = current_user._get_current_object()
+    metadata = UserMetadata(get_metadb_path(user))
+    path = metadata._sanitize_path(request.args.get('path', ''))
+
+    if path == '/':
+        return jsonify({'error': 'No file path given'}), 400
+
+    old_name = resolve_archive(user, old)
+    new_name = resolve_archive(user, new)
+
+    if not old_name or not new_name:
+        return jsonify({'error': 'Archive does not exist'}), 400
+
+    repo_path = get_repo_path(user)
+    member = tree_member(os.path.dirname(path), os.path.basename(path))
+    # a file missing from one side extracts as empty, which diffs as added or removed
+    old_data, new_data = get_diff_pool().map(read_archived, [repo_path] * 2, [old_name, new_name], [member] * 2)
+
+    return jsonify(unified_file_diff(path, old_data, new_data, MAX_DIFF_BYTES))
 
 
 @datastore.route('/restore/<archive>', methods=['POST'])
@@ -239,20 +374,69 @@ def get_diff(archive):
 def restore_archive(archive):
     stage_path = get_stage_path(current_user)
     repo_path = get_repo_path(current_user)
-    archive_name = find_archive_by_id(archive)['archive']
+    restore_from = find_archive_by_id(current_user, archive)
+
+    if not restore_from:
+        return jsonify({'error': 'Archive does not exist'}), 400
+
+    archive_name = restore_from['archive']
 
     borg_unmount(current_user)
 
-    shutil.rmtree(stage_path)
+    # extract next to the stage and swap it in once borg is done, so a failed or
+    # cancelled restore leaves the current files alone
+    restore_path = os.path.join(current_user.store_path, 'restore')
+    shutil.rmtree(restore_path, ignore_errors=True)
+    os.makedirs(restore_path)
+
+    app = current_app._get_current_object()
+    user_id = current_user.id
+
+    def finish(job, borg_job):
+        try:
+            borg_job.result(0)
+        except Exception:
+            shutil.rmtree(restore_path, ignore_errors=True)
+            return
+
+        shutil.rmtree(stage_path, ignore_errors=True)
+        os.rename(os.path.join(restore_path, 'stage'), stage_path)
+        shutil.rmtree(restore_path, ignore_errors=True)
+
+        with app.app_context():
+            user = get_user_by_id(user_id)
+            store_logger.info(f'User {user.username} restored archive to version: {archive_name}')
+            shared_index.rebuild_user(user)
+            content_indexer.schedule(get_metadb_path(user), get_user_tree_path(user))
 
-    original_cwd = os.getcwd()
-    os.chdir(current_user.store_path)
-    borg_api.extract(f"{repo_path}::{archive_name}", "stage")
-    os.chdir(original_cwd)
+    # extract writes relative to its cwd, which is set in a borgapi worker process
+    job = start_job(current_user.id, 'extract', 'extract', f"{repo_path}::{archive_name}", "stage",
+                    cwd=restore_path, on_done=finish)
 
-    store_logger.info(f'User {current_user.username} restored archive to version: {archive_name}')
+    return jsonify({"message": "Restore started", "job": job.id}), 202
 
-    return jsonify({"message": "Archive restored successfully"}), 200
+
+@datastore.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = get_job(job_id, current_user.id)
+    if not job:
+        return jsonify({'error': 'Job does not exist'}), 404
+
+    return jsonify(job.snapshot())
+
+
+@datastore.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    job = get_job(job_id, current_user.id)
+    if not job:
+        return jsonify({'error': 'Job does not exist'}), 404
+
+    if not job.cancel():
+        return jsonify({'error': 'Job already finished'}), 409
+
+    return jsonify({'message': 'Cancellation requested'}), 202
 
 
 @datastore.route('/add', methods=['POST'])
@@ -276,6 +460,7 @@ def add_file():
         os.makedirs(abs_dir)
 
     uploaded = []
+    entries = []
 
     for file in files:
         if file.filename == '':
@@ -285,32 +470,57 @@ def add_file():
         filepath = os.path.join(abs_dir, filename)
         file.save(filepath)
 
-        file_size = os.path.getsize(filepath)
-
-        metadata.add_file(
-            filename=filename,
-            owner=current_user.id,
-            file_group=file_group,
-            size=file_size,
-            is_directory=False,
-            permissions=permissions,
-            path=upload_path
-        )
-
+        entries.append((upload_path, filename, os.path.getsize(filepath), False))
         uploaded.append(filename)
         store_logger.info(
             f'User {current_user.username} uploaded file: {filename} to {upload_path}'
         )
 
+    job = None
     if uploaded:
-        current_user.num_files += len(uploaded)
+        # one transaction for every part of the request; re-uploaded files get their new size
+        added = metadata.add_files(entries, current_user.id, file_group, permissions)
+        shared_index.sync_files(current_user, metadata.get_file_ids(upload_path, uploaded))
+
+        current_user.num_files += added
         db.session.commit()
-        create_archive(current_user)
+        job = start_archive_job(current_user)
+        content_indexer.schedule(get_metadb_path(current_user), base_path)
 
     return jsonify({
         'message': f"Uploaded {len(uploaded)} file(s) successfully",
         'count': len(uploaded),
-        'files': uploaded
+        'files': uploaded,
+        'job': job.id if job else None
+    }), 201
+
+
+@datastore.route('/ingest', methods=['POST'])
+@login_required
+def ingest_file():
+    """unpack an uploaded tar or zip into the tree, registering it in one transaction and one archive"""
+    upload = request.files.get('archive')
+    if not upload or upload.filename == '':
+        return jsonify({'error': 'No archive provided'}), 400
+
+    try:
+        permissions = int(request.form.get('permissions', 740))
+    except ValueError:
+        return jsonify({'error': 'Invalid permissions'}), 400
+
+    try:
+        result = ingest(current_user, upload.stream, upload.filename,
+                        dest=request.form.get('path', '/'), permissions=permissions,
+                        file_group=request.form.get('file-group', current_user.username))
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+
+    job = start_archive_job(current_user) if result['count'] else None
+
+    return jsonify({
+        'message': f"Ingested {result['count']} file(s) successfully",
+        **result,
+        'job': job.id if job else None
     }), 201
 
 
@@ -329,41 +539,40 @@ def delete_files():
     current_path = metadata._sanitize_path(raw_path)
 
     base_tree = get_user_tree_path(user)
-    deleted_count = 0
 
-    for file_id in file_ids:
-        file_data = metadata.get_file_by_id(file_id)
+    # every id is resolved and permission checked in one query
+    writable, denied = metadata.get_files_for_write(file_ids, get_viewer(current_user))
 
-        if not evaluate_write_permission(current_user, file_data.__dict__):
-            flash(f'No write permission granted for {file_data.filename}', 'error')
-            continue
+    for file_data in denied:
+        flash(f'No write permission granted for {file_data.filename}', 'error')
 
-        abs_target = os.path.join(base_tree, current_path.strip('/'), file_data.filename)
+    for file_data in writable:
+        abs_target = os.path.join(base_tree, file_data.path.strip('/'), file_data.filename)
 
         if os.path.isdir(abs_target):
             shutil.rmtree(abs_target)
         elif os.path.isfile(abs_target):
             os.remove(abs_target)
-        else:
-            continue
 
-        metadata.remove_file(file_id)
-        deleted_count += 1
+    # the rows go in one transaction, descendants of folders included
+    removed_files = metadata.remove_files(writable)
+    shared_index.remove_files(user, writable)
+    deleted_count = len(writable)
 
     # Update user stats and archive once after the batch
     if deleted_count > 0:
-        user.num_files = max(0, user.num_files - deleted_count)
+        user.num_files = max(0, user.num_files - removed_files)
         db.session.commit()
-        create_archive(user)
+        job = start_archive_job(user)
 
         flash(f'{deleted_count} files successfuly deleted.', 'success')
         if deleted_count < len(file_ids):
-            flash(f'{len(file_ids - deleted_count)} files could not be deleted.', 'error')
+            flash(f'{len(file_ids) - deleted_count} files could not be deleted.', 'error')
     else:
         flash('Could not complete operation, no files deleted.', 'error')
 
     store_logger.info(f'User {current_user.username} deleted {deleted_count} item(s) from {current_path}')
-    return jsonify({'message': f'Deleted {deleted_count} item(s)'}), 200
+    return jsonify({'message': f'Deleted {deleted_count} item(s)', 'job': job.id if deleted_count else None}), 200
 
 
 @datastore.route('/download')
@@ -381,17 +590,112 @@ def download_file():
         return jsonify({'error': 'File not found'}), 404
 
     file_name, file_path = file_data
+
+    archive_id = request.args.get('archive')
+    if archive_id:
+        return download_archived_file(user, metadata.get_file_by_id(file_id), archive_id)
+
     if file_path == '/':
         file_path = get_user_tree_path(user)
     else:
         file_path = os.path.join(get_user_tree_path(user), file_path.lstrip('/'))
-        print(file_path)
 
     store_logger.info(f'User {current_user.username} downloaded file: <store:{user.username}>{file_path}')
 
     return send_from_directory(file_path, file_name, as_attachment=True)
 
 
+def download_archived_file(user, file, archive_id):
+    """send FILE of USER as it was in archive ARCHIVE_ID"""
+    if not evaluate_read_permission(current_user, file.__dict__):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    member = tree_member(file.path, file.filename)
+    item = ManifestIndex(get_manifest_path(user)).get_item(archive_id, member)
+    if item is None or item['type'] != '-':
+        return jsonify({'error': 'File not found in archive'}), 404
+
+    store_logger.info(f'User {current_user.username} downloaded file: '
+                      f'<archive:{user.username}:{item["archive"]}>{member}')
+
+    # streamed from borg as it is extracted, so memory stays flat whatever the file size
+    chunks = borg_api.iter_extract(f"{get_repo_path(user)}::{item['archive']}", member)
+    response = Response(chunks, mimetype='application/octet-stream')
+    response.headers['Content-Length'] = str(item['size'])
+    response.headers.set('Content-Disposition', 'attachment', filename=file.filename)
+
+    return response
+
+
+@datastore.route('/export')
+@login_required
+def export_store():
+    """stream USER's live tree, or one of their archives, as a tarball"""
+    user = get_user_by_id(request.args.get('user_id', current_user.id))
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    if user.id != current_user.id and not get_viewer(current_user).is_admin:
+        return jsonify({'error': 'Permission denied'}), 403
+
+    fmt = request.args.get('format', 'tar')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f"Unknown format, expected one of {', '.join(EXPORT_FORMATS)}"}), 400
+
+    archive_id = request.args.get('archive')
+    try:
+        if archive_id:
+            archive = ManifestIndex(get_manifest_path(user)).get_archive(archive_id)
+            if archive is None:
+                archive = next((a for a in get_archives(user) if a['id'] == archive_id), None)
+            if archive is None:
+                return jsonify({'error': 'Archive does not exist'}), 404
+
+            chunks = export_archive(get_repo_path(user), archive['name'], fmt)
+            filename = f"{user.username}-{archive['name']}.{fmt}"
+        else:
+            chunks = export_tree(get_user_tree_path(user), fmt)
+            filename = f"{user.username}-{datetime.datetime.now():%Y-%m-%dT%H%M%S}.{fmt}"
+    except ExportError as e:
+        return jsonify({'error': str(e)}), 400
+
+    store_logger.info(f'User {current_user.username} exported <store:{user.username}> '
+                      f'{"archive " + archive_id if archive_id else "tree"} as {fmt}')
+
+    # written to the response as it is produced; nothing is staged on disk or held in memory
+    response = Response(chunks, mimetype=EXPORT_FORMATS[fmt])
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+
+    return response
+
+
+@datastore.route('/history')
+@login_required
+def file_history():
+    user = get_user_by_id(request.args.get('user_id', current_user.id))
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+
+    metadata = UserMetadata(get_metadb_path(user))
+    file_id = request.args.get('file_id')
+    file = metadata.get_file_by_id(file_id)
+
+    if not file:
+        return jsonify({'error': 'File not found'}), 404
+
+    if not evaluate_read_permission(current_user, file.__dict__):
+        return jsonify({'error': 'Permission denied'}), 403
+
+    # history follows the path, so a renamed file starts over under its new name
+    versions = ManifestIndex(get_manifest_path(user)).get_history(tree_member(file.path, file.filename))
+
+    for version in versions:
+        version['download_url'] = url_for('/store.download_file', user_id=user.id, file_id=file.id,
+                                          archive=version['archive_id'])
+
+    return jsonify({'file_id': file.id, 'name': file.filename, 'path': file.path, 'versions': versions})
+
+
 @datastore.route('/rename', methods=['POST'])
 @login_required
 def rename_file():
@@ -428,6 +732,8 @@ def rename_file():
 
     os.rename(current_file, new_file)
     metadata.rename_file(new_name, file_data.path, file_id)
+    shared_index.sync_file(user, file_id)
+    content_indexer.schedule(get_metadb_path(user), get_user_tree_path(user))
 
     store_logger.info(f'User {current_user.username} renamed file: {current_file} to: {new_file}')
 
@@ -453,6 +759,7 @@ def set_file_group():
 
     if evaluate_exec_permission(current_user, file_data.__dict__):
         metadata.set_file_group(file_id, group)
+        shared_index.sync_file(user, file_id)
         flash(f'File group has been changed to {group} for file: {file_data.filename}', 'success')
         return jsonify({'success': 'File group changed successfully'}), 200
     else:
@@ -482,6 +789,7 @@ def set_file_perms():
 
     if evaluate_exec_permission(current_user, file_data.__dict__):
         metadata.set_file_perms(file_id, perms)
+        shared_index.sync_file(user, file_id)
         flash(f'File permissions have been changed to {perms} for file: {file_data.filename}', 'success')
         return jsonify({'success': 'File permissions changed successfully'}), 200
     else:
@@ -489,6 +797,19 @@ def set_file_perms():
         return jsonify({'error': 'Permission not granted'}), 403
 
 
+@datastore.route('/shared-with-me')
+@login_required
+def shared_with_me():
+    try:
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid pagination parameter: {e}'}), 400
+
+    return jsonify(shared_index.list_shared_with(current_user, cursor=cursor, limit=limit))
+
+
 @datastore.route('/shared-files')
 @login_required
 def get_shared_fs():
@@ -513,15 +834,51 @@ def get_shared_fs():
     )
 
 
+def list_archived_files(user, archive_id):
+    """list a directory of USER's archive ARCHIVE_ID from the manifest index, paged like search"""
+    try:
+        cursor = request.args.get('cursor')
+        cursor = parse_cursor(cursor) if cursor else None
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError as e:
+        return jsonify({'error': f'Invalid pagination parameter: {e}'}), 400
+
+    metadata = UserMetadata(get_metadb_path(user))
+    path = metadata._sanitize_path(request.args.get('path', '/'))
+    index = ManifestIndex(get_manifest_path(user))
+    listing = index.list_directory(archive_id, tree_dir(path), viewer=get_viewer(current_user),
+                                   owner=user.id, group=user.username, cursor=cursor, limit=limit)
+
+    if listing is None:
+        # new archives are indexed in the background; catch up in case this one was missed
+        manifest_indexer.schedule(get_manifest_path(user), get_repo_path(user))
+        return jsonify({'error': 'Archive not indexed yet'}), 404
+
+    listing['path'] = path
+    return jsonify(listing)
+
+
 @datastore.route('/files', methods=['GET', 'POST'])
 @login_required
 def file_viewer():
+    archive_id = request.args.get('archive')
+    if archive_id:
+        user = get_user_by_id(request.args.get('user_id', current_user.id))
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+
+        return list_archived_files(user, archive_id)
+
     get_metadb_path(current_user)
     data = retrieve_user_store(current_user)
     file_list = data.get('files', [])
     dir_list = data.get('dirs', [])
     current_path = data.get('path', '/')
-    archive_list = list_archives()
+
+    # one repository open for both commands instead of a lock and key derivation each
+    with borg_api.session(get_repo_path(current_user)):
+        archive_list = get_archives(current_user)
+        borg_stats = borg_api.info(get_repo_path(current_user), json=True)
 
     for file in file_list:
         file['size'] = convert_from_bytes(file['size'])
@@ -546,7 +903,7 @@ def file_viewer():
         dir_list=dir_list,
         current_path=current_path,
         archive_list=archive_list,
-        fs_stats=get_user_stats(current_user),
+        fs_stats=get_user_stats(current_user, borg_stats),
         shareform=shareform,
         folderform=folderform
     )
@@ -0,0 +1,153 @@
+import os
+import stat
+import difflib
+import threading
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from module.util import borg_api
+from module.manifest_index import TREE_PREFIX
+
+# only the head of large files is diffed
+MAX_DIFF_BYTES = int(os.getenv('DIFF_MAX_FILE_BYTES', 1 * 1024 * 1024))
+# files of one request whose hunks are computed at the same time
+DIFF_WORKERS = int(os.getenv('DIFF_WORKERS', 4))
+# files one request may ask hunks for
+MAX_DIFF_FILES = 50
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_diff_pool():
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=DIFF_WORKERS, thread_name_prefix='diff')
+
+    return _pool
+
+
+def scan_tree(tree_path):
+    """return {path: (type, size, mtime)} of everything in the live tree at TREE_PATH, stated like the manifest index"""
+    tree = {}
+
+    for root, dirs, files in os.walk(tree_path):
+        for name in dirs + files:
+            full_path = os.path.join(root, name)
+            st = os.lstat(full_path)
+            mtime = datetime.fromtimestamp(st.st_mtime_ns / 1e9, timezone.utc)
+            path = '/' + os.path.relpath(full_path, tree_path)
+            tree[path] = (stat.filemode(st.st_mode)[0], st.st_size, mtime.replace(tzinfo=None).isoformat())
+
+    return tree
+
+
+def tree_changes(archived, live, cursor=None, limit=50):
+    """return one page of what changed from the ARCHIVED tree to the LIVE one, ordered by path
+
+    Both are {path: (type, size, mtime)}. Like rsync's quick check, a file
+    whose size and mtime are unchanged is taken to be unchanged, so no
+    content is read; directories are only reported when added or removed.
+    """
+    changes = []
+
+    for path in sorted(archived.keys() | live.keys()):
+        if cursor is not None and path <= cursor:
+            continue
+
+        old, new = archived.get(path), live.get(path)
+
+        if old is None:
+            status, size_delta = 'added', 0 if new[0] == 'd' else new[1]
+        elif new is None:
+            status, size_delta = 'removed', 0 if old[0] == 'd' else -old[1]
+        elif old[0] != new[0]:
+            status, size_delta = 'modified', 0
+        elif old[0] != 'd' and (old[1], old[2]) != (new[1], new[2]):
+            status, size_delta = 'modified', new[1] - old[1]
+        else:
+            continue
+
+        changes.append({'path': path, 'status': status, 'size_delta': size_delta,
+                        'is_directory': (new or old)[0] == 'd'})
+        if len(changes) > limit:
+            break
+
+    next_cursor = changes[limit - 1]['path'] if len(changes) > limit else None
+
+    return {'changes': changes[:limit], 'next_cursor': next_cursor}
+
+
+def read_live(tree_path, path, max_bytes=MAX_DIFF_BYTES):
+    """return the first MAX_BYTES + 1 bytes of the live tree's file PATH, empty if there is no such file"""
+    try:
+        with open(os.path.join(tree_path, path.lstrip('/')), 'rb') as f:
+            return f.read(max_bytes + 1)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return b''
+
+
+def read_archived(repo_path, archive, member, max_bytes=MAX_DIFF_BYTES):
+    """return the first MAX_BYTES + 1 bytes of MEMBER in ARCHIVE, stopping borg after that"""
+    data = bytearray()
+
+    with closing(borg_api.iter_extract(f'{repo_path}::{archive}', member)) as chunks:
+        for chunk in chunks:
+            data += chunk
+            if len(data) > max_bytes:
+                break
+
+    return bytes(data)
+
+
+def is_binary(data):
+    return b'\x00' in data[:8192]
+
+
+def unified_file_diff(path, old, new, max_bytes=MAX_DIFF_BYTES):
+    """return the unified diff of one file between contents OLD and NEW
+
+    The diff is in git's format, so Diff2Html can draw it. Files with a NUL
+    byte in their head are reported as binary without hunks, and only the
+    first MAX_BYTES of each side are compared; a marker line ends the diff
+    of a file cut short.
+    """
+    truncated = len(old) > max_bytes or len(new) > max_bytes
+    old, new = old[:max_bytes], new[:max_bytes]
+    header = f'diff --git a{path} b{path}\n'
+
+    if is_binary(old) or is_binary(new):
+        diff = header + f'Binary files a{path} and b{path} differ\n'
+        return {'path': path, 'binary': True, 'truncated': truncated, 'diff': diff}
+
+    lines = difflib.unified_diff(
+        old.decode('utf-8', errors='replace').splitlines(keepends=True),
+        new.decode('utf-8', errors='replace').splitlines(keepends=True),
+        fromfile='a' + path,
+        tofile='b' + path
+    )
+    diff = ''.join(line if line.endswith('\n') else line + '\n\\ No newline at end of file\n' for line in lines)
+
+    if not diff:
+        return {'path': path, 'binary': False, 'truncated': truncated, 'diff': ''}
+    if truncated:
+        diff += f'\\ Truncated: only the first {max_bytes} bytes were compared\n'
+
+    return {'path': path, 'binary': False, 'truncated': truncated, 'diff': header + diff}
+
+
+def live_file_diffs(repo_path, archive, tree_path, paths, max_bytes=MAX_DIFF_BYTES):
+    """return the unified diffs of PATHS between ARCHIVE and the live tree at TREE_PATH
+
+    Each file is read and diffed on the diff pool, so hunks of many files
+    are computed side by side; the results keep the order of PATHS.
+    """
+    def diff_one(path):
+        member = TREE_PREFIX + path
+        old = read_archived(repo_path, archive, member, max_bytes)
+        return unified_file_diff(path, old, read_live(tree_path, path, max_bytes), max_bytes)
+
+    return list(get_diff_pool().map(diff_one, paths))
@@ -0,0 +1,128 @@
+import os
+import stat
+import tarfile
+import zlib
+from contextlib import closing
+
+from module.util import borg_api
+from module.manifest_index import TREE_PREFIX
+
+CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'tar': 'application/x-tar',
+    'tar.gz': 'application/gzip',
+    'tar.zst': 'application/zstd',
+}
+
+
+class ExportError(Exception):
+    pass
+
+
+def get_compressor(fmt):
+    """return an object with compress() and flush() for export format FMT, None for plain tar"""
+    if fmt == 'tar.gz':
+        return zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    if fmt == 'tar.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ExportError('tar.zst exports need the zstandard package')
+
+        return zstandard.ZstdCompressor().compressobj()
+
+    return None
+
+
+def compress_stream(chunks, fmt):
+    """return CHUNKS compressed for export format FMT; an unusable format raises before anything is read"""
+    return _compressed(chunks, get_compressor(fmt))
+
+
+def _compressed(chunks, compressor):
+    with closing(chunks):
+        if compressor is None:
+            yield from chunks
+            return
+
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+
+        yield compressor.flush()
+
+
+def _tar_info(full_path, arcname, st):
+    info = tarfile.TarInfo(arcname)
+    info.mode = stat.S_IMODE(st.st_mode)
+    info.mtime = int(st.st_mtime)
+
+    if stat.S_ISDIR(st.st_mode):
+        info.type = tarfile.DIRTYPE
+    elif stat.S_ISLNK(st.st_mode):
+        info.type = tarfile.SYMTYPE
+        info.linkname = os.readlink(full_path)
+    else:
+        info.size = st.st_size
+
+    return info
+
+
+def iter_tree_tar(tree_path, chunk_size=CHUNK_SIZE):
+    """yield a tarball of the live tree at TREE_PATH, laid out like borg's export of an archive
+
+    Headers and file contents are produced one block at a time, so a large
+    file never has to fit in memory. A file that shrinks while it is read is
+    padded with zeros to the size its header announced.
+    """
+    for root, dirs, files in os.walk(tree_path):
+        dirs.sort()
+
+        # links to directories are listed in DIRS but never walked into
+        names = sorted(files + [name for name in dirs if os.path.islink(os.path.join(root, name))])
+
+        for full_path in [root] + [os.path.join(root, name) for name in names]:
+            st = os.lstat(full_path)
+            relpath = os.path.relpath(full_path, tree_path)
+            arcname = TREE_PREFIX if relpath == '.' else f'{TREE_PREFIX}/{relpath}'
+            info = _tar_info(full_path, arcname, st)
+
+            if not info.isreg():
+                yield info.tobuf(tarfile.PAX_FORMAT)
+                continue
+
+            try:
+                f = open(full_path, 'rb')
+            except FileNotFoundError:
+                # removed since the tree was walked
+                continue
+
+            yield info.tobuf(tarfile.PAX_FORMAT)
+
+            with f:
+                remaining = info.size
+                while remaining:
+                    data = f.read(min(chunk_size, remaining))
+                    if not data:
+                        data = b'\0' * min(chunk_size, remaining)
+                    remaining -= len(data)
+                    yield data
+
+            padding = -info.size % tarfile.BLOCKSIZE
+            if padding:
+                yield b'\0' * padding
+
+    yield b'\0' * (2 * tarfile.BLOCKSIZE)
+
+
+def export_tree(tree_path, fmt):
+    """yield the live tree at TREE_PATH as a tarball in export format FMT"""
+    return compress_stream(iter_tree_tar(tree_path), fmt)
+
+
+def export_archive(repo_path, archive, fmt):
+    """yield the tree of ARCHIVE as a tarball in export format FMT, as borg writes it"""
+    return compress_stream(borg_api.iter_export_tar(f'{repo_path}::{archive}', TREE_PREFIX), fmt)
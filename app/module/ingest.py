@@ -0,0 +1,140 @@
+import os
+import shutil
+import tarfile
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+from module.util import db, store_logger, get_metadb_path, get_user_tree_path
+from module.metadata import UserMetadata
+from module.content_index import content_indexer
+from module import shared_index
+
+COPY_BUFFER = 1024 * 1024
+
+
+class IngestError(Exception):
+    pass
+
+
+def member_parts(name):
+    """return the path components of archive member NAME, made safe like uploaded filenames, or None to skip it"""
+    parts = []
+
+    for part in name.replace('\\', '/').split('/'):
+        if part in ('', '.'):
+            continue
+        if part == '..':
+            return None
+
+        part = secure_filename(part)
+        if not part:
+            return None
+        parts.append(part)
+
+    return parts or None
+
+
+def iter_members(fileobj, name):
+    """yield (parts, is_directory, reader) for every directory and regular file of the tar or zip FILEOBJ
+
+    Tarballs, compressed or not, are read in a single forward pass, so they
+    can come straight from a request body; tarfile's stream mode is only used
+    when FILEOBJ cannot seek, since it decompresses in small records and is
+    much slower. Zip files need FILEOBJ to be seekable. Links, devices and
+    unsafe names are skipped.
+    """
+    try:
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    parts = member_parts(info.filename)
+                    if parts is None:
+                        continue
+                    if info.is_dir():
+                        yield parts, True, None
+                    else:
+                        with archive.open(info) as reader:
+                            yield parts, False, reader
+            return
+
+        mode = 'r:*' if fileobj.seekable() else 'r|*'
+        with tarfile.open(fileobj=fileobj, mode=mode) as archive:
+            for member in archive:
+                parts = member_parts(member.name)
+                if parts is None or not (member.isdir() or member.isreg()):
+                    continue
+                yield parts, member.isdir(), archive.extractfile(member) if member.isreg() else None
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError):
+        raise IngestError('Not a readable tar or zip archive')
+
+
+def unpack(fileobj, name, tree_path, dest='/'):
+    """unpack the tar or zip FILEOBJ into directory DEST of the live tree at TREE_PATH
+
+    Returns the (path, filename, size, is_directory) entries to register,
+    with every directory leading to them, and the members that could not be
+    written because something of another type is in their place.
+    """
+    entries = {}
+    skipped = []
+    dest_parts = [part for part in dest.strip('/').split('/') if part]
+
+    def add_directories(parts):
+        for i in range(len(parts)):
+            entries.setdefault(('/' + '/'.join(parts[:i]), parts[i]), (0, True))
+
+    add_directories(dest_parts)
+
+    for parts, is_directory, reader in iter_members(fileobj, name):
+        parts = dest_parts + parts
+        target = os.path.join(tree_path, *parts)
+
+        try:
+            if is_directory:
+                os.makedirs(target, exist_ok=True)
+                add_directories(parts)
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as out:
+                shutil.copyfileobj(reader, out, COPY_BUFFER)
+        except (FileExistsError, IsADirectoryError, NotADirectoryError):
+            skipped.append('/' + '/'.join(parts))
+            continue
+
+        add_directories(parts[:-1])
+        entries[('/' + '/'.join(parts[:-1]), parts[-1])] = (os.path.getsize(target), False)
+
+    return [(path, filename, size, is_directory) for (path, filename), (size, is_directory) in entries.items()], skipped
+
+
+def ingest(user, fileobj, name, dest='/', permissions=740, file_group=None):
+    """unpack the tar or zip FILEOBJ into USER's tree at DEST and register everything in it at once
+
+    All rows go into the metadata database in one transaction, and only
+    the archive's rows are then mirrored into the shared index, so the rest
+    of the tree is never read again. Taking the archive of the new tree is
+    left to the caller.
+    """
+    metadata = UserMetadata(get_metadb_path(user))
+    dest = metadata._sanitize_path(dest)
+    tree_path = get_user_tree_path(user)
+
+    entries, skipped = unpack(fileobj, name, tree_path, dest)
+    added = metadata.add_files(entries, user.id, file_group or user.username, permissions)
+
+    user.num_files += added
+    db.session.commit()
+
+    filenames = {}
+    for path, filename, size, is_directory in entries:
+        filenames.setdefault(path, []).append(filename)
+    shared_index.sync_files(user, [id for path, names in filenames.items()
+                                   for id in metadata.get_file_ids(path, names)])
+    content_indexer.schedule(get_metadb_path(user), tree_path)
+
+    files = sum(1 for entry in entries if not entry[3])
+    store_logger.info(f'User {user.username} ingested {files} file(s) from {name} into {dest}')
+
+    return {'count': files, 'added': added, 'skipped': skipped}
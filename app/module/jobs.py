@@ -0,0 +1,179 @@
+import re
+import json
+import time
+import uuid
+import threading
+
+from borgapi import JobCancelled
+
+from module.util import borg_api, store_logger
+
+# finished jobs stay around this long so late pollers still get the outcome
+JOB_TTL = 10 * 60
+
+PERCENT_RE = re.compile(r'(\d+(?:\.\d+)?)%')
+
+
+class Job:
+    """A borg command running for one user, with its latest progress.
+
+    Progress is parsed from the command's stderr as it is written: json
+    `archive_progress` lines for create, and "Extracting: 12.3%" style
+    percentages for extract.
+    """
+
+    def __init__(self, owner, kind, total_bytes=None):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.kind = kind
+        self.total_bytes = total_bytes
+        self.started = time.monotonic()
+        self.finished = None
+
+        self.state = 'running'
+        self.error = None
+        self.files = 0
+        self.bytes = 0
+        self.percent = None
+        self.path = None
+
+        self.borg_job = None
+        self.done = threading.Event()
+        self._pending = ''
+
+    def on_output(self, stream, text):
+        if stream != 'stderr':
+            return
+
+        self._pending += text
+        *lines, self._pending = re.split(r'[\r\n]', self._pending)
+
+        for line in lines:
+            self._parse(line.strip())
+
+    def _parse(self, line):
+        if not line:
+            return False
+
+        if line.startswith('{'):
+            try:
+                data = json.loads(line)
+            except ValueError:
+                return False
+
+            if data.get('type') == 'archive_progress' and not data.get('finished'):
+                self.files = data.get('nfiles', self.files)
+                self.bytes = data.get('original_size', self.bytes)
+                self.path = data.get('path', self.path)
+                if self.total_bytes:
+                    self.percent = min(100.0, self.bytes / self.total_bytes * 100)
+                return True
+
+            if data.get('type') == 'progress_percent' and not data.get('finished'):
+                if data.get('total'):
+                    self.percent = data['current'] / data['total'] * 100
+                    return True
+            return False
+
+        match = PERCENT_RE.search(line)
+        if match:
+            self.percent = float(match.group(1))
+            return True
+
+        return False
+
+    def eta(self):
+        """seconds left, estimated from the rate so far, or None if unknown"""
+        if self.state != 'running' or not self.percent:
+            return None
+
+        elapsed = time.monotonic() - self.started
+        return round(elapsed * (100 - self.percent) / self.percent, 1)
+
+    def snapshot(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'cancellable': self.state == 'running',
+            'error': self.error,
+            'files': self.files,
+            'bytes': self.bytes,
+            'total_bytes': self.total_bytes,
+            'percent': round(self.percent, 1) if self.percent is not None else None,
+            'eta': self.eta(),
+            'path': self.path
+        }
+
+    def _done(self, borg_job):
+        try:
+            borg_job.result(0)
+            self.state = 'done'
+            self.percent = 100.0
+        except JobCancelled:
+            self.state = 'cancelled'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+
+        self.finished = time.monotonic()
+        self.done.set()
+
+    def wait(self, timeout=None):
+        """block until the job has finished and its outcome is set; return whether it has"""
+        return self.done.wait(timeout)
+
+    def cancel(self):
+        return self.borg_job.cancel() if self.borg_job else False
+
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _prune():
+    now = time.monotonic()
+
+    for job_id, job in list(_jobs.items()):
+        if job.finished is not None and now - job.finished > JOB_TTL:
+            del _jobs[job_id]
+
+
+def start_job(owner, kind, command, *args, total_bytes=None, on_done=None, cwd=None, **options):
+    """run borg COMMAND for user id OWNER in the background and return its tracked Job
+
+    The command runs in a borgapi worker process whichever executor is
+    configured, so cancelling the job stops borg even once it is running.
+    ON_DONE is called with the Job and the finished BorgJob from the worker thread,
+    before the job reports its outcome.
+    """
+    job = Job(owner, kind, total_bytes)
+
+    with _jobs_lock:
+        _prune()
+        _jobs[job.id] = job
+
+    def finished(borg_job):
+        if on_done is not None:
+            try:
+                on_done(job, borg_job)
+            except Exception as e:
+                store_logger.error(f'Finishing {kind} job {job.id} failed: {e}')
+        job._done(borg_job)
+
+    job.borg_job = borg_api.submit(command, *args, on_output=job.on_output, cwd=cwd, isolated=True,
+                                   progress=True, log_json=True, **options)
+    job.borg_job.add_done_callback(finished)
+
+    return job
+
+
+def get_job(job_id, owner):
+    """return the Job JOB_ID if it belongs to user id OWNER, otherwise None"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+
+    if job is None or job.owner != owner:
+        return None
+
+    return job
@@ -0,0 +1,506 @@
+import queue
+import sqlite3
+import posixpath
+import tempfile
+import threading
+from contextlib import closing
+from itertools import islice
+
+from sqlalchemy import bindparam, create_engine, text
+
+from module.util import borg_api, store_logger
+
+BATCH_SIZE = 1000
+
+# where the live tree sits inside an archive, and the metadata database describing it
+TREE_PREFIX = 'stage/tree'
+METADB_MEMBER = 'stage/_meta.db'
+
+# bumped when the layout changes; older indexes are dropped and rebuilt
+MANIFEST_VERSION = 2
+
+# Archive contents, one database per user, outside the staged tree so it is
+# never archived itself. Consecutive archives mostly hold the same files, so
+# only changes are stored: an `entries` row is one version of a path, present
+# in every archive from `since_seq` up to, but not including, `until_seq`
+# (NULL while the newest indexed archive still has it). Owner, group and
+# permissions come from the metadata database archived alongside the tree;
+# directory sizes are the total of everything below them.
+MANIFEST_DDL = [
+    """CREATE TABLE IF NOT EXISTS archives (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        id TEXT NOT NULL UNIQUE,
+        name TEXT NOT NULL,
+        start TEXT NOT NULL,
+        item_count INTEGER NOT NULL DEFAULT 0,
+        total_size INTEGER NOT NULL DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS paths (
+        id INTEGER PRIMARY KEY,
+        dir TEXT NOT NULL,
+        name TEXT NOT NULL,
+        UNIQUE (dir, name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS entries (
+        path_id INTEGER NOT NULL,
+        since_seq INTEGER NOT NULL,
+        until_seq INTEGER,
+        type TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime TEXT,
+        digest TEXT,
+        owner INTEGER,
+        file_group TEXT,
+        permissions INTEGER,
+        PRIMARY KEY (path_id, since_seq)
+    ) WITHOUT ROWID""",
+    """CREATE INDEX IF NOT EXISTS ix_entries_current ON entries (path_id) WHERE until_seq IS NULL""",
+]
+
+# versions of a path present in archive :seq
+PRESENT_AT = "e.since_seq <= :seq AND (e.until_seq IS NULL OR e.until_seq > :seq)"
+
+# mirrors metadata.readable_by; items the archived metadata has no row for are
+# treated like the synthetic folders of the live view: the owner's, mode 744
+READABLE_BY = (
+    "(:is_admin OR COALESCE(e.owner, :owner) = :viewer_id"
+    " OR (COALESCE(e.permissions, 744) % 10) & 4 != 0"
+    " OR (COALESCE(e.file_group, :group) IN :groups AND ((COALESCE(e.permissions, 744) / 10) % 10) & 4 != 0))"
+)
+
+
+def split_path(path):
+    path = path.strip('/')
+    return posixpath.dirname(path), posixpath.basename(path)
+
+
+def tree_dir(path):
+    """return the archived directory holding the live tree's PATH, e.g. /docs -> stage/tree/docs"""
+    path = posixpath.normpath('/' + (path or '').strip('/'))
+    return TREE_PREFIX if path == '/' else TREE_PREFIX + path
+
+
+def tree_member(path, filename):
+    """return the archived path of the live tree's file FILENAME in directory PATH"""
+    return tree_dir(path) + '/' + filename.strip('/')
+
+
+def read_archived_access(repo_path, archive_name):
+    """yield (dir, name, owner, file_group, permissions) of every file the archive's metadata database lists
+
+    The database is streamed from borg into a temporary file, never held in memory.
+    """
+    with tempfile.NamedTemporaryFile(suffix='.db') as f:
+        try:
+            with closing(borg_api.iter_extract(f'{repo_path}::{archive_name}', METADB_MEMBER)) as chunks:
+                for chunk in chunks:
+                    f.write(chunk)
+        except Exception as e:
+            store_logger.warning(f'No metadata in archive {archive_name} of {repo_path}: {e}')
+            return
+
+        if not f.tell():
+            return
+        f.flush()
+
+        with closing(sqlite3.connect(f.name)) as conn:
+            rows = conn.execute("SELECT path, filename, owner, file_group, permissions FROM files")
+            for path, filename, owner, file_group, permissions in rows:
+                yield tree_dir(path), filename.strip('/'), owner, file_group, permissions
+
+
+def parse_cursor(cursor):
+    """return the (kind, name) of a directory listing's `next_cursor`; raises ValueError if it is malformed"""
+    kind, sep, name = cursor.partition(':')
+    if not sep or kind not in ('0', '1'):
+        raise ValueError('malformed cursor')
+
+    return int(kind), name
+
+
+class ManifestIndex:
+    """what every archive of one repository contains, queryable without borg"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.engine = create_engine(f"sqlite:///{db_path}", echo=False)
+
+        with self.engine.begin() as conn:
+            version = conn.execute(text("PRAGMA user_version")).scalar()
+            if version != MANIFEST_VERSION:
+                # the indexer rebuilds whatever is dropped here on its next run
+                for table in ('entries', 'paths', 'archives'):
+                    conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+                conn.execute(text(f"PRAGMA user_version = {MANIFEST_VERSION}"))
+
+            for statement in MANIFEST_DDL:
+                conn.execute(text(statement))
+
+    def get_archives(self):
+        """return every indexed archive, newest first"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT seq, id, name, start, item_count, total_size FROM archives ORDER BY seq DESC"
+            )).mappings().all()
+
+        return [dict(row) for row in rows]
+
+    def get_archive(self, archive_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT seq, id, name, start, item_count, total_size FROM archives WHERE id = :id"
+            ), {'id': archive_id}).mappings().first()
+
+        return dict(row) if row else None
+
+    def list_directory(self, archive_id, path='', viewer=None, owner=None, group=None,
+                       cursor=None, limit=50):
+        """list the items directly under archived directory PATH in archive ARCHIVE_ID
+
+        Directories come first, then files, each by name, and pages are keyed
+        like the live search: pass the returned `next_cursor`, parsed with
+        `parse_cursor`, as CURSOR for the next one. Only items VIEWER may read are returned; OWNER and GROUP
+        stand in for items the archived metadata does not describe. Returns
+        None if the archive is not indexed.
+        """
+        archive = self.get_archive(archive_id)
+        if archive is None:
+            return None
+
+        params = {'dir': path.strip('/'), 'seq': archive['seq'], 'limit': limit + 1,
+                  'owner': owner, 'group': group, 'kind': -1, 'name': ''}
+        where = [f"p.dir = :dir AND {PRESENT_AT}"]
+
+        if viewer is not None:
+            where.append(READABLE_BY)
+            params.update(is_admin=viewer.is_admin, viewer_id=viewer.user_id, groups=list(viewer.groups))
+        if cursor:
+            kind, name = cursor
+            params.update(kind=kind, name=name)
+            where.append("(e.type != 'd', p.name) > (:kind, :name)")
+
+        query = text(
+            "SELECT p.name, e.type, e.size, e.mtime, e.digest, e.owner, e.file_group, e.permissions "
+            "FROM entries e JOIN paths p ON p.id = e.path_id "
+            f"WHERE {' AND '.join(where)} ORDER BY e.type != 'd', p.name LIMIT :limit"
+        )
+        if viewer is not None:
+            query = query.bindparams(bindparam('groups', expanding=True))
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(query, params).mappings().all()
+
+        files = [{
+            'id': None,
+            'name': row['name'],
+            'owner': owner if row['owner'] is None else row['owner'],
+            'file_group': group if row['file_group'] is None else row['file_group'],
+            'size': row['size'],
+            'is_directory': row['type'] == 'd',
+            'permissions': 744 if row['permissions'] is None else row['permissions'],
+            'mtime': row['mtime'],
+            'digest': row['digest']
+        } for row in rows[:limit]]
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = files[-1]
+            next_cursor = f"{0 if last['is_directory'] else 1}:{last['name']}"
+
+        return {'archive': archive, 'files': files, 'next_cursor': next_cursor}
+
+    def get_item(self, archive_id, path):
+        """return type, size, mtime and digest of archived PATH in archive ARCHIVE_ID, or None"""
+        archive = self.get_archive(archive_id)
+        if archive is None:
+            return None
+
+        dir, name = split_path(path)
+
+        with self.engine.connect() as conn:
+            row = conn.execute(text(
+                "SELECT e.type, e.size, e.mtime, e.digest FROM entries e JOIN paths p ON p.id = e.path_id "
+                f"WHERE p.dir = :dir AND p.name = :name AND {PRESENT_AT}"
+            ), {'dir': dir, 'name': name, 'seq': archive['seq']}).mappings().first()
+
+        return dict(row, archive=archive['name']) if row else None
+
+    def get_tree(self, archive_id):
+        """return {live tree path: (type, size, mtime)} of everything under the tree in archive ARCHIVE_ID, or None"""
+        archive = self.get_archive(archive_id)
+        if archive is None:
+            return None
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT p.dir, p.name, e.type, e.size, e.mtime FROM entries e JOIN paths p ON p.id = e.path_id "
+                f"WHERE (p.dir = :prefix OR p.dir LIKE :prefix || '/%') AND {PRESENT_AT}"
+            ), {'prefix': TREE_PREFIX, 'seq': archive['seq']})
+
+            return {
+                posixpath.join(dir[len(TREE_PREFIX):] or '/', name): (type, size, mtime)
+                for dir, name, type, size, mtime in rows
+            }
+
+    def get_changes(self, old_id, new_id, cursor=None, limit=50):
+        """return one page of what changed from archive OLD_ID to archive NEW_ID, ordered by live tree path
+
+        Both archives are compared in SQL and paths whose version is the same
+        in both are left out by the query, so pages are always full and borg
+        is never asked. Files are modified if their type or content
+        changed and otherwise only had their metadata changed; directories
+        are reported when added, removed or given other access. Pass the
+        returned `next_cursor` as CURSOR for the next page. Returns None if
+        either archive is not indexed.
+        """
+        old, new = self.get_archive(old_id), self.get_archive(new_id)
+        if old is None or new is None:
+            return None
+
+        params = {'prefix': TREE_PREFIX, 'old': old['seq'], 'new': new['seq'], 'limit': limit + 1,
+                  'cursor': '' if cursor is None else TREE_PREFIX + '/' + cursor.strip('/')}
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT p.dir || '/' || p.name AS path,"
+                "       o.type AS old_type, o.size AS old_size, o.digest AS old_digest,"
+                "       n.type AS new_type, n.size AS new_size, n.digest AS new_digest "
+                "FROM paths p "
+                "LEFT JOIN entries o ON o.path_id = p.id"
+                "     AND o.since_seq <= :old AND (o.until_seq IS NULL OR o.until_seq > :old) "
+                "LEFT JOIN entries n ON n.path_id = p.id"
+                "     AND n.since_seq <= :new AND (n.until_seq IS NULL OR n.until_seq > :new) "
+                "WHERE (p.dir = :prefix OR p.dir LIKE :prefix || '/%') AND o.since_seq IS NOT n.since_seq"
+                " AND NOT (o.type IS 'd' AND n.type IS 'd' AND o.owner IS n.owner"
+                "          AND o.file_group IS n.file_group AND o.permissions IS n.permissions)"
+                " AND p.dir || '/' || p.name > :cursor "
+                "ORDER BY p.dir || '/' || p.name LIMIT :limit"
+            ), params).mappings().all()
+
+        changes = []
+        for row in rows[:limit]:
+            is_directory = (row['new_type'] or row['old_type']) == 'd'
+
+            if row['old_type'] is None:
+                status, size_delta = 'added', 0 if is_directory else row['new_size']
+            elif row['new_type'] is None:
+                status, size_delta = 'removed', 0 if is_directory else -row['old_size']
+            elif row['old_type'] != row['new_type'] or row['old_digest'] != row['new_digest']:
+                status, size_delta = 'modified', 0 if is_directory else row['new_size'] - row['old_size']
+            else:
+                status, size_delta = 'metadata', 0
+
+            changes.append({'path': row['path'][len(TREE_PREFIX):], 'status': status,
+                            'size_delta': size_delta, 'is_directory': is_directory})
+
+        next_cursor = changes[-1]['path'] if len(rows) > limit else None
+
+        return {'changes': changes, 'next_cursor': next_cursor}
+
+    def get_history(self, path):
+        """return the versions of archived PATH whose content differs from the one before, oldest first
+
+        Content is compared by chunk digest, so versions that only changed
+        owner or permissions are folded into the one they follow. Each version
+        names the first archive holding it.
+        """
+        dir, name = split_path(path)
+
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT archive_id, archive, start, type, size, mtime, digest FROM ("
+                "    SELECT a.id AS archive_id, a.name AS archive, a.start, e.since_seq,"
+                "           e.type, e.size, e.mtime, e.digest,"
+                "           LAG(e.digest) OVER w AS previous_digest, LAG(e.type) OVER w AS previous_type,"
+                "           ROW_NUMBER() OVER w AS n"
+                "    FROM entries e JOIN paths p ON p.id = e.path_id"
+                "    JOIN archives a ON a.seq = ("
+                "        SELECT min(seq) FROM archives WHERE seq >= e.since_seq"
+                "        AND (e.until_seq IS NULL OR seq < e.until_seq)"
+                "    )"
+                "    WHERE p.dir = :dir AND p.name = :name"
+                "    WINDOW w AS (ORDER BY e.since_seq)"
+                ") WHERE n = 1 OR digest IS NOT previous_digest OR type IS NOT previous_type "
+                "ORDER BY since_seq"
+            ), {'dir': dir, 'name': name}).mappings().all()
+
+        return [dict(row) for row in rows]
+
+    def latest_start(self):
+        with self.engine.connect() as conn:
+            return conn.execute(text("SELECT start FROM archives ORDER BY seq DESC LIMIT 1")).scalar()
+
+    def forget_archives(self, keep_ids):
+        """drop archives that are no longer in the repository, and versions only they held"""
+        with self.engine.begin() as conn:
+            ids = [id for (id,) in conn.execute(text("SELECT id FROM archives"))]
+            gone = [{'id': id} for id in ids if id not in keep_ids]
+            if not gone:
+                return
+
+            conn.execute(text("DELETE FROM archives WHERE id = :id"), gone)
+            conn.execute(text(
+                "DELETE FROM entries WHERE until_seq IS NOT NULL AND NOT EXISTS ("
+                "    SELECT 1 FROM archives a WHERE a.seq >= entries.since_seq AND a.seq < entries.until_seq"
+                ")"
+            ))
+            conn.execute(text(
+                "DELETE FROM paths WHERE NOT EXISTS (SELECT 1 FROM entries WHERE path_id = paths.id)"
+            ))
+
+    def reset(self):
+        with self.engine.begin() as conn:
+            for table in ('entries', 'paths', 'archives'):
+                conn.execute(text(f"DELETE FROM {table}"))
+
+    def add_archive(self, archive, items, access=()):
+        """index ARCHIVE, a dict with id, name and start, from ITEMS as yielded by `BorgAPI.iter_items`
+
+        ACCESS yields (dir, name, owner, file_group, permissions) for the items
+        the archived metadata describes. Must be called in archive order. The
+        items are staged in a temporary table batch by batch, then compared
+        with the newest indexed archive in SQL, so memory stays flat however
+        many files the archive holds; only the running size of each directory
+        is kept. The whole archive is added in one transaction.
+        """
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE TEMP TABLE IF NOT EXISTS incoming ("
+                "    dir TEXT NOT NULL, name TEXT NOT NULL, type TEXT NOT NULL,"
+                "    size INTEGER NOT NULL, mtime TEXT, digest TEXT,"
+                "    owner INTEGER, file_group TEXT, permissions INTEGER, PRIMARY KEY (dir, name)"
+                ")"
+            ))
+            conn.execute(text("DELETE FROM incoming"))
+
+            count = total = 0
+            dir_sizes = {}
+            items = iter(items)
+            while batch := list(islice(items, BATCH_SIZE)):
+                rows = []
+                for item in batch:
+                    dir, name = split_path(item['path'])
+                    rows.append({'dir': dir, 'name': name, 'type': item['type'], 'size': item['size'] or 0,
+                                 'mtime': item['mtime'], 'digest': item['chunk_digest']})
+
+                    if item['type'] != 'd' and item['size']:
+                        total += item['size']
+                        while dir:
+                            dir_sizes[dir] = dir_sizes.get(dir, 0) + item['size']
+                            dir = posixpath.dirname(dir)
+                conn.execute(text(
+                    "INSERT OR REPLACE INTO incoming (dir, name, type, size, mtime, digest) "
+                    "VALUES (:dir, :name, :type, :size, :mtime, :digest)"
+                ), rows)
+                count += len(rows)
+
+            sizes = [{'dir': posixpath.dirname(path), 'name': posixpath.basename(path), 'size': size}
+                     for path, size in dir_sizes.items()]
+            if sizes:
+                conn.execute(text(
+                    "UPDATE incoming SET size = :size WHERE dir = :dir AND name = :name AND type = 'd'"
+                ), sizes)
+
+            access = iter(access)
+            while batch := list(islice(access, BATCH_SIZE)):
+                conn.execute(text(
+                    "UPDATE incoming SET owner = :owner, file_group = :file_group, permissions = :permissions "
+                    "WHERE dir = :dir AND name = :name"
+                ), [{'dir': dir, 'name': name, 'owner': owner, 'file_group': file_group,
+                     'permissions': permissions}
+                    for dir, name, owner, file_group, permissions in batch])
+
+            seq = conn.execute(text(
+                "INSERT INTO archives (id, name, start, item_count, total_size) "
+                "VALUES (:id, :name, :start, :count, :total)"
+            ), {'id': archive['id'], 'name': archive['name'], 'start': archive['start'],
+                'count': count, 'total': total}).lastrowid
+
+            conn.execute(text("INSERT OR IGNORE INTO paths (dir, name) SELECT dir, name FROM incoming"))
+            # close versions that changed or disappeared since the previous archive ...
+            conn.execute(text(
+                "UPDATE entries SET until_seq = :seq WHERE until_seq IS NULL AND NOT EXISTS ("
+                "    SELECT 1 FROM incoming i JOIN paths p ON p.dir = i.dir AND p.name = i.name"
+                "    WHERE p.id = entries.path_id AND i.type = entries.type AND i.size = entries.size"
+                "    AND i.mtime IS entries.mtime AND i.digest IS entries.digest AND i.owner IS entries.owner"
+                "    AND i.file_group IS entries.file_group AND i.permissions IS entries.permissions"
+                ")"
+            ), {'seq': seq})
+            # ... and open one for every path that has no current version left
+            conn.execute(text(
+                "INSERT INTO entries (path_id, since_seq, type, size, mtime, digest, owner, file_group, permissions) "
+                "SELECT p.id, :seq, i.type, i.size, i.mtime, i.digest, i.owner, i.file_group, i.permissions "
+                "FROM incoming i JOIN paths p ON p.dir = i.dir AND p.name = i.name "
+                "WHERE NOT EXISTS (SELECT 1 FROM entries e WHERE e.path_id = p.id AND e.until_seq IS NULL)"
+            ), {'seq': seq})
+            conn.execute(text("DELETE FROM incoming"))
+
+        return count
+
+
+class ManifestIndexer:
+    """Index the contents of new archives in the background.
+
+    Repositories are queued with `schedule`, typically right after an archive
+    was created; a single daemon thread drains the queue and indexes every
+    archive of the repository that is not indexed yet, oldest first, so the
+    same call also backfills repositories that predate the index.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.scheduled = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def schedule(self, index_path, repo_path):
+        """queue the repository REPO_PATH, indexed into INDEX_PATH, for indexing"""
+        with self.lock:
+            if index_path in self.scheduled:
+                return
+
+            self.scheduled.add(index_path)
+            self.queue.put((index_path, repo_path))
+
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='manifest-indexer', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            index_path, repo_path = self.queue.get()
+
+            with self.lock:
+                self.scheduled.discard(index_path)
+
+            try:
+                self.index_repository(index_path, repo_path)
+            except Exception as e:
+                store_logger.error(f'Manifest indexing failed for {repo_path}: {e}')
+
+    def index_repository(self, index_path, repo_path):
+        """index every archive of REPO_PATH missing from INDEX_PATH and return how many there were"""
+        index = ManifestIndex(index_path)
+        archives = sorted(borg_api.list(repo_path, json=True)['archives'], key=lambda a: a['start'])
+
+        index.forget_archives({archive['id'] for archive in archives})
+        indexed = {archive['id'] for archive in index.get_archives()}
+        pending = [archive for archive in archives if archive['id'] not in indexed]
+
+        # versions are stored as deltas in archive order, so an archive older
+        # than the newest indexed one means starting over
+        latest = index.latest_start()
+        if pending and latest is not None and pending[0]['start'] < latest:
+            index.reset()
+            pending = archives
+
+        for archive in pending:
+            access = read_archived_access(repo_path, archive['name'])
+            with closing(borg_api.iter_items(f"{repo_path}::{archive['name']}")) as items, closing(access):
+                count = index.add_archive(archive, items, access)
+            store_logger.info(f'Indexed {count} item(s) of archive {archive["name"]} in {repo_path}')
+
+        return len(pending)
+
+
+manifest_indexer = ManifestIndexer()
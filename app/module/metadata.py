@@ -1,12 +1,15 @@
 import os
+from collections import namedtuple
 
-from sqlalchemy import Column, Integer, String, Boolean, UniqueConstraint, TIMESTAMP, create_engine, func, or_
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Column, Integer, String, Boolean, UniqueConstraint, Index, TIMESTAMP, bindparam, create_engine, func, and_, or_, true, select, text, literal_column
+from sqlalchemy.orm import declarative_base, sessionmaker
 from sqlalchemy.exc import IntegrityError
 
 Base = declarative_base()
 
+# who is looking at a listing: rows they cannot read are filtered in SQL
+Viewer = namedtuple('Viewer', ['user_id', 'groups', 'is_admin'])
+
 
 def normalized_path(path, filename):
     path = path.rstrip('/')
@@ -15,6 +18,18 @@ def normalized_path(path, filename):
     return path + '/' + filename
 
 
+def file_extension(filename):
+    """return the lowercased extension of FILENAME without the dot, or ''"""
+    _, ext = os.path.splitext(filename or '')
+    return ext[1:].lower()
+
+
+def fts_match_expression(query):
+    """turn free text QUERY into an FTS5 prefix match on every term"""
+    terms = [t.replace('"', '""') for t in query.split()]
+    return ' '.join(f'"{t}"*' for t in terms if t)
+
+
 class File(Base):
     __tablename__ = 'files'
 
@@ -27,19 +42,139 @@ class File(Base):
     is_directory = Column(Boolean, nullable=False)
     permissions = Column(Integer, default=740)
     upload_date = Column(TIMESTAMP, default=func.now())
+    extension = Column(String, nullable=False, default='')
 
     __table_args__ = (
         UniqueConstraint('filename', 'path', 'owner', name='_filename_path_owner_uc'),
+        Index('ix_files_size', 'size'),
+        Index('ix_files_upload_date', 'upload_date'),
+        Index('ix_files_extension', 'extension'),
+        Index('ix_files_path', 'path'),
     )
 
 
+def readable_by(viewer):
+    """SQL predicate matching the files VIEWER may read, mirroring auth.evaluate_permission"""
+    if viewer is None or viewer.is_admin:
+        return true()
+
+    return or_(
+        File.owner == viewer.user_id,
+        File.permissions.op('%')(10).op('&')(4) != 0,
+        and_(
+            File.file_group.in_(list(viewer.groups)),
+            (File.permissions // 10).op('%')(10).op('&')(4) != 0
+        )
+    )
+
+
+def writable_by(viewer):
+    """SQL predicate matching the files VIEWER may write, mirroring auth.evaluate_permission"""
+    if viewer is None or viewer.is_admin:
+        return true()
+
+    return or_(
+        File.owner == viewer.user_id,
+        File.permissions.op('%')(10).op('&')(2) != 0,
+        and_(
+            File.file_group.in_(list(viewer.groups)),
+            (File.permissions // 10).op('%')(10).op('&')(2) != 0
+        )
+    )
+
+
+class ContentState(Base):
+    __tablename__ = 'content_state'
+
+    file_id = Column(Integer, primary_key=True)
+    size = Column(Integer, nullable=False)
+    # st_mtime_ns of the file when it was read; an edit that keeps the size still changes it
+    mtime = Column(Integer)
+    indexed_at = Column(TIMESTAMP, default=func.now())
+
+
+# Filename full-text index. It is an external-content FTS5 table over
+# `files`, kept in sync by triggers so every insert, delete and rename
+# updates it in the same transaction as the row itself.
+SEARCH_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
+        filename, content='files', content_rowid='id', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_ai AFTER INSERT ON files BEGIN
+        INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_ad AFTER DELETE ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_fts_au AFTER UPDATE OF filename ON files BEGIN
+        INSERT INTO files_fts(files_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+        INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename);
+    END""",
+]
+
+# File content index, filled in the background by module.content_index.
+# Rows are keyed by file id, so a rename keeps its entry; deleting a file
+# or changing its extension drops the entry and lets the indexer decide again.
+CONTENT_INDEX_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS content_fts USING fts5(body)""",
+    """CREATE TRIGGER IF NOT EXISTS files_content_ad AFTER DELETE ON files BEGIN
+        DELETE FROM content_fts WHERE rowid = old.id;
+        DELETE FROM content_state WHERE file_id = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS files_content_au AFTER UPDATE OF extension ON files
+    WHEN old.extension != new.extension BEGIN
+        DELETE FROM content_fts WHERE rowid = old.id;
+        DELETE FROM content_state WHERE file_id = old.id;
+    END""",
+]
+
+
 class UserMetadata:
     def __init__(self, db_path):
         self.db_path = db_path
         self.engine = create_engine(f"sqlite:///{db_path}", echo=False)
+        self._migrate_extension_column()
+        self._migrate_content_mtime_column()
         Base.metadata.create_all(self.engine)
+        self._init_search_index()
         self.Session = sessionmaker(bind=self.engine)
 
+    def _migrate_extension_column(self):
+        """add and backfill `files.extension` on databases created before it existed"""
+        with self.engine.begin() as conn:
+            columns = [row[1] for row in conn.execute(text("PRAGMA table_info(files)"))]
+            if not columns or 'extension' in columns:
+                return
+
+            conn.execute(text("ALTER TABLE files ADD COLUMN extension VARCHAR NOT NULL DEFAULT ''"))
+            rows = conn.execute(text("SELECT id, filename FROM files")).all()
+            updates = [{'id': id, 'ext': file_extension(name)} for id, name in rows if file_extension(name)]
+            if updates:
+                conn.execute(text("UPDATE files SET extension = :ext WHERE id = :id"), updates)
+
+    def _migrate_content_mtime_column(self):
+        """add `content_state.mtime` on databases created before it existed; rows without one are reindexed once"""
+        with self.engine.begin() as conn:
+            columns = [row[1] for row in conn.execute(text("PRAGMA table_info(content_state)"))]
+            if columns and 'mtime' not in columns:
+                conn.execute(text("ALTER TABLE content_state ADD COLUMN mtime INTEGER"))
+
+    def _init_search_index(self):
+        """create the range indexes and filename FTS index, building them for existing rows"""
+        with self.engine.begin() as conn:
+            for index in File.__table__.indexes:
+                index.create(conn, checkfirst=True)
+
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'")
+            ).first()
+
+            for statement in SEARCH_INDEX_DDL + CONTENT_INDEX_DDL:
+                conn.execute(text(statement))
+
+            if not exists:
+                conn.execute(text("INSERT INTO files_fts(files_fts) VALUES ('rebuild')"))
+
     def _sanitize_path(self, path):
         if not path:
             return '/'
@@ -57,39 +192,96 @@ class UserMetadata:
             file_group=file_group,
             size=size,
             is_directory=is_directory,
-            permissions=permissions
+            permissions=permissions,
+            extension='' if is_directory else file_extension(filename)
         )
 
         try:
             session.add(new_file)
             session.commit()
+            return new_file.id
         except IntegrityError:
             session.rollback()
+            return None
         finally:
             session.close()
 
-    def remove_file(self, file_id):
-        session = self.Session()
-
-        try:
-            file_to_remove = session.query(File).filter(File.id == file_id).first()
-            if file_to_remove:
-                if file_to_remove.is_directory:
-                    similar_path = file_to_remove.path.rstrip('/') + '/' + file_to_remove.filename + '/%'
-                    subdir_path = file_to_remove.path.rstrip('/') + '/' + file_to_remove.filename
-                    print(similar_path)
-
-                    subdir_files = session.query(File).filter(
-                        (File.path == subdir_path) | (File.path.like(similar_path))
-                    ).all()
-
-                    for file in subdir_files:
-                        session.delete(file)
-
-                session.delete(file_to_remove)
-                session.commit()
-        finally:
-            session.close()
+    def add_files(self, entries, owner, file_group, permissions=740):
+        """register ENTRIES, a list of (path, filename, size, is_directory), in one transaction.
+
+        Files already registered at the same place get their size updated;
+        existing directories are left as they are. Returns the number of files,
+        not counting directories, that were not registered before, as the
+        insert itself reports them rather than by counting the table.
+        """
+        if not entries:
+            return 0
+
+        rows = [{
+            'filename': filename,
+            'path': self._sanitize_path(path),
+            'size': size,
+            'owner': owner,
+            'file_group': file_group,
+            'is_directory': is_directory,
+            'permissions': permissions,
+            'extension': '' if is_directory else file_extension(filename)
+        } for path, filename, size, is_directory in entries]
+
+        insert = text(
+            "INSERT INTO files (filename, path, size, owner, file_group, is_directory, permissions, "
+            "upload_date, extension) "
+            "VALUES (:filename, :path, :size, :owner, :file_group, :is_directory, :permissions, "
+            "CURRENT_TIMESTAMP, :extension) "
+            "ON CONFLICT (filename, path, owner) DO NOTHING"
+        )
+        directories = [row for row in rows if row['is_directory']]
+        files = [row for row in rows if not row['is_directory']]
+        added = 0
+
+        with self.engine.begin() as conn:
+            if directories:
+                conn.execute(insert, directories)
+            if files:
+                # rows skipped as already registered are not counted
+                added = conn.execute(insert, files).rowcount
+                conn.execute(text(
+                    "UPDATE files SET size = :size "
+                    "WHERE filename = :filename AND path = :path AND owner = :owner "
+                    "AND NOT is_directory AND size != :size"
+                ), files)
+
+        return added
+
+    def remove_files(self, files):
+        """delete FILES, and everything below the directories among them, in one transaction.
+
+        Descendants are found by ranges over the indexed path column rather
+        than loaded one by one. One count over the union of those ranges and
+        the selected ids is taken first, so a selected folder inside another
+        is not counted twice. Returns the number of files, not counting
+        directories, that were removed.
+        """
+        if not files:
+            return 0
+
+        params = {'ids': [file.id for file in files]}
+        where = ['id IN :ids']
+
+        for i, file in enumerate(file for file in files if file.is_directory):
+            params[f'dir{i}'] = normalized_path(file.path, file.filename)
+            where.append(f"path = :dir{i} OR (path >= :dir{i} || '/' AND path < :dir{i} || '0')")
+
+        where = ' OR '.join(where)
+        ids = bindparam('ids', expanding=True)
+
+        with self.engine.begin() as conn:
+            removed = conn.execute(
+                text(f"SELECT count(*) FROM files WHERE NOT is_directory AND ({where})").bindparams(ids), params
+            ).scalar()
+            conn.execute(text(f"DELETE FROM files WHERE {where}").bindparams(ids), params)
+
+        return removed
 
     def rename_file(self, new_name, new_path, file_id):
         sanitized_path = self._sanitize_path(new_path)
@@ -100,6 +292,8 @@ class UserMetadata:
             if file_to_rename:
                 file_to_rename.filename = new_name
                 file_to_rename.path = sanitized_path
+                if not file_to_rename.is_directory:
+                    file_to_rename.extension = file_extension(new_name)
                 session.commit()
         finally:
             session.close()
@@ -126,12 +320,14 @@ class UserMetadata:
         finally:
             session.close()
 
-    def get_files(self, path):
+    def get_files(self, path, viewer=None):
         sanitized_path = self._sanitize_path(path)
         session = self.Session()
 
         try:
-            files = session.query(File).filter(File.path == sanitized_path).order_by(File.upload_date.desc()).all()
+            files = session.query(File).filter(
+                File.path == sanitized_path, readable_by(viewer)
+            ).order_by(File.upload_date.desc()).all()
             return [{
                 'id': file.id,
                 'name': file.filename,
@@ -144,6 +340,19 @@ class UserMetadata:
         finally:
             session.close()
 
+    def get_directory_names(self, path):
+        """return the names of every directory row directly under PATH, readable or not"""
+        sanitized_path = self._sanitize_path(path)
+        session = self.Session()
+
+        try:
+            rows = session.query(File.filename).filter(
+                File.path == sanitized_path, File.is_directory.is_(True)
+            ).all()
+            return {name for (name,) in rows}
+        finally:
+            session.close()
+
     def get_file_by_id(self, id):
         session = self.Session()
 
@@ -153,6 +362,40 @@ class UserMetadata:
         finally:
             session.close()
 
+    def get_files_by_ids(self, ids):
+        """return the files with ids IDS in one query; unknown ids are left out"""
+        session = self.Session()
+
+        try:
+            return session.query(File).filter(File.id.in_(list(ids))).all()
+        finally:
+            session.close()
+
+    def get_files_for_write(self, ids, viewer):
+        """return (writable, denied), the files among IDS that VIEWER may or may not write, in one query"""
+        session = self.Session()
+
+        try:
+            rows = session.query(File, writable_by(viewer).label('writable')).filter(
+                File.id.in_(list(ids))
+            ).all()
+        finally:
+            session.close()
+
+        return [file for file, ok in rows if ok], [file for file, ok in rows if not ok]
+
+    def get_file_ids(self, path, filenames):
+        """return the ids of FILENAMES in directory PATH"""
+        session = self.Session()
+
+        try:
+            return [id for id, in session.query(File.id).filter(
+                File.path == self._sanitize_path(path),
+                File.filename.in_(list(filenames))
+            )]
+        finally:
+            session.close()
+
     def list_subdirectories(self, path):
         path = self._sanitize_path(path).rstrip('/')
         like = f"{path}/%" if path else "/%"
@@ -196,6 +439,18 @@ class UserMetadata:
 
         return total_size
 
+    def get_files_readable_by_others(self):
+        """return every file whose group or world permission digit grants read"""
+        session = self.Session()
+
+        try:
+            return session.query(File).filter(or_(
+                File.permissions.op('%')(10).op('&')(4) != 0,
+                (File.permissions // 10).op('%')(10).op('&')(4) != 0
+            )).all()
+        finally:
+            session.close()
+
     def get_file_path_by_id(self, file_id):
         session = self.Session()
 
@@ -213,3 +468,130 @@ class UserMetadata:
             return len(file_data)
         finally:
             session.close()
+
+    def search_files(self, query=None, extension=None, min_size=None, max_size=None,
+                     date_from=None, date_to=None, cursor=None, limit=50, content=None, viewer=None):
+        """search files by name, extension, size range, upload date range and content.
+
+        Results are ordered newest id first and paged by keyset: pass the
+        returned `next_cursor` as CURSOR to fetch the following page. Only
+        files VIEWER may read are returned, so pages are always full.
+        """
+        session = self.Session()
+
+        try:
+            files = session.query(File).filter(readable_by(viewer))
+
+            if query:
+                match = fts_match_expression(query)
+                if match:
+                    matching_ids = select(literal_column('rowid')).select_from(
+                        text('files_fts')
+                    ).where(text('files_fts MATCH :match'))
+                    files = files.filter(File.id.in_(matching_ids)).params(match=match)
+
+            if content:
+                content_match = fts_match_expression(content)
+                if content_match:
+                    matching_ids = select(literal_column('rowid')).select_from(
+                        text('content_fts')
+                    ).where(text('content_fts MATCH :content_match'))
+                    files = files.filter(File.id.in_(matching_ids)).params(content_match=content_match)
+
+            if extension:
+                files = files.filter(File.extension == extension.lstrip('.').lower())
+            if min_size is not None:
+                files = files.filter(File.size >= min_size)
+            if max_size is not None:
+                files = files.filter(File.size <= max_size)
+            if date_from is not None:
+                files = files.filter(File.upload_date >= date_from)
+            if date_to is not None:
+                files = files.filter(File.upload_date <= date_to)
+            if cursor is not None:
+                files = files.filter(File.id < cursor)
+
+            rows = files.order_by(File.id.desc()).limit(limit + 1).all()
+            next_cursor = rows[limit - 1].id if len(rows) > limit else None
+
+            return {
+                'files': [{
+                    'id': file.id,
+                    'name': file.filename,
+                    'path': file.path,
+                    'owner': file.owner,
+                    'file_group': file.file_group,
+                    'size': file.size,
+                    'is_directory': file.is_directory,
+                    'permissions': file.permissions,
+                    'upload_date': file.upload_date.isoformat() if file.upload_date else None
+                } for file in rows[:limit]],
+                'next_cursor': next_cursor
+            }
+        finally:
+            session.close()
+
+    def get_unindexed_content(self, extensions, limit=64):
+        """return up to LIMIT (id, path, filename, size) rows with EXTENSIONS whose content is not indexed"""
+        session = self.Session()
+
+        try:
+            return session.query(File.id, File.path, File.filename, File.size).outerjoin(
+                ContentState, ContentState.file_id == File.id
+            ).filter(
+                File.is_directory.is_(False),
+                File.extension.in_(extensions),
+                or_(ContentState.file_id.is_(None), ContentState.size != File.size)
+            ).limit(limit).all()
+        finally:
+            session.close()
+
+    def get_indexed_content(self, extensions):
+        """return (id, path, filename, mtime) of every file with EXTENSIONS whose content was indexed"""
+        session = self.Session()
+
+        try:
+            return session.query(File.id, File.path, File.filename, ContentState.mtime).join(
+                ContentState, ContentState.file_id == File.id
+            ).filter(
+                File.is_directory.is_(False),
+                File.extension.in_(extensions)
+            ).all()
+        finally:
+            session.close()
+
+    def expire_content(self, file_ids):
+        """forget the indexed content of FILE_IDS, so the indexer reads them again"""
+        if not file_ids:
+            return
+
+        rows = [{'id': file_id} for file_id in file_ids]
+
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM content_fts WHERE rowid = :id"), rows)
+            conn.execute(text("DELETE FROM content_state WHERE file_id = :id"), rows)
+
+    def store_content(self, entries):
+        """replace the indexed content of ENTRIES, a list of (file_id, size, mtime, text), in one transaction.
+
+        A text of None records the file as seen without indexing anything,
+        so unreadable or binary files are not retried until they change.
+        """
+        if not entries:
+            return
+
+        rows = [{'id': file_id, 'size': size, 'mtime': mtime, 'body': body}
+                for file_id, size, mtime, body in entries]
+        indexed = [row for row in rows if row['body']]
+
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM content_fts WHERE rowid = :id"), rows)
+            if indexed:
+                conn.execute(text(
+                    "INSERT INTO content_fts (rowid, body) "
+                    "SELECT :id, :body WHERE EXISTS (SELECT 1 FROM files WHERE id = :id)"
+                ), indexed)
+            conn.execute(text(
+                "INSERT OR REPLACE INTO content_state (file_id, size, mtime, indexed_at) "
+                "SELECT :id, :size, :mtime, CURRENT_TIMESTAMP WHERE EXISTS (SELECT 1 FROM files WHERE id = :id)"
+            ), rows)
@@ -0,0 +1,197 @@
+from sqlalchemy import and_, or_, insert
+
+from module.util import db, get_metadb_path
+from module.auth import User, Group, GroupMember
+from module.metadata import UserMetadata
+
+SYNC_BATCH = 500
+
+
+class SharedFile(db.Model):
+    """Central index of files other users can read, one row per shared file.
+
+    Owners' metadata databases stay authoritative; this table mirrors the
+    rows that are group or world readable so a "shared with me" listing is
+    a single indexed query instead of opening every user's database.
+    """
+    __tablename__ = 'shared_files'
+    id = db.Column(db.Integer, primary_key=True)
+    owner = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    file_id = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String, nullable=False)
+    path = db.Column(db.String, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    is_directory = db.Column(db.Boolean, nullable=False)
+    file_group = db.Column(db.String, nullable=False)
+    permissions = db.Column(db.Integer, nullable=False)
+    world_read = db.Column(db.Boolean, nullable=False)
+    group_read = db.Column(db.Boolean, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('owner', 'file_id', name='_owner_file_uc'),
+        db.Index('ix_shared_files_world', 'world_read', 'id'),
+        db.Index('ix_shared_files_group', 'file_group', 'group_read', 'id'),
+        db.Index('ix_shared_files_owner_path', 'owner', 'path'),
+    )
+
+
+def _read_bits(permissions):
+    permissions = int(permissions)
+    return (permissions // 10) % 10 & 4 != 0, permissions % 10 & 4 != 0
+
+
+def _row(user, file):
+    group_read, world_read = _read_bits(file.permissions)
+
+    return {
+        'owner': user.id,
+        'file_id': file.id,
+        'filename': file.filename,
+        'path': file.path,
+        'size': file.size,
+        'is_directory': file.is_directory,
+        'file_group': file.file_group,
+        'permissions': int(file.permissions),
+        'world_read': world_read,
+        'group_read': group_read
+    }
+
+
+def _upsert(user, file):
+    group_read, world_read = _read_bits(file.permissions)
+    entry = SharedFile.query.filter_by(owner=user.id, file_id=file.id).first()
+
+    if not (group_read or world_read):
+        if entry:
+            db.session.delete(entry)
+        return
+
+    if not entry:
+        entry = SharedFile(owner=user.id, file_id=file.id)
+        db.session.add(entry)
+
+    entry.filename = file.filename
+    entry.path = file.path
+    entry.size = file.size
+    entry.is_directory = file.is_directory
+    entry.file_group = file.file_group
+    entry.permissions = int(file.permissions)
+    entry.world_read = world_read
+    entry.group_read = group_read
+
+
+def sync_file(user, file_id):
+    """mirror the current state of USER's file FILE_ID into the shared index"""
+    file = UserMetadata(get_metadb_path(user)).get_file_by_id(file_id)
+
+    if file:
+        _upsert(user, file)
+    else:
+        SharedFile.query.filter_by(owner=user.id, file_id=file_id).delete()
+
+    db.session.commit()
+
+
+def sync_files(user, file_ids):
+    """mirror the current state of USER's files FILE_IDS into the shared index in one transaction
+
+    The ids are handled SYNC_BATCH at a time, so any number of them stays
+    within SQLite's limit on bound parameters.
+    """
+    file_ids = list(file_ids)
+    if not file_ids:
+        return
+
+    metadata = UserMetadata(get_metadb_path(user))
+
+    for i in range(0, len(file_ids), SYNC_BATCH):
+        batch = file_ids[i:i + SYNC_BATCH]
+        files = metadata.get_files_by_ids(batch)
+        SharedFile.query.filter(
+            SharedFile.owner == user.id, SharedFile.file_id.in_(batch)
+        ).delete(synchronize_session=False)
+
+        rows = [_row(user, file) for file in files if any(_read_bits(file.permissions))]
+        if rows:
+            db.session.execute(insert(SharedFile), rows)
+
+    db.session.commit()
+
+
+def remove_files(user, files):
+    """drop FILES of USER from the shared index, with everything below the directories among them"""
+    SharedFile.query.filter(
+        SharedFile.owner == user.id, SharedFile.file_id.in_([file.id for file in files])
+    ).delete(synchronize_session=False)
+
+    for file in files:
+        if file.is_directory:
+            subdir_path = file.path.rstrip('/') + '/' + file.filename
+            SharedFile.query.filter(
+                SharedFile.owner == user.id,
+                or_(SharedFile.path == subdir_path,
+                    and_(SharedFile.path >= subdir_path + '/', SharedFile.path < subdir_path + '0'))
+            ).delete(synchronize_session=False)
+
+    db.session.commit()
+
+
+def remove_user(user):
+    SharedFile.query.filter_by(owner=user.id).delete()
+    db.session.commit()
+
+
+def rebuild_user(user):
+    """rebuild USER's shared index entries from their metadata database"""
+    SharedFile.query.filter_by(owner=user.id).delete()
+
+    rows = [_row(user, file) for file in UserMetadata(get_metadb_path(user)).get_files_readable_by_others()]
+
+    # every entry was just dropped, so insert in one batch instead of upserting file by file
+    if rows:
+        db.session.execute(insert(SharedFile), rows)
+
+    db.session.commit()
+
+
+def list_shared_with(user, cursor=None, limit=50):
+    """return files of other enabled users that USER can read, newest first, paged by keyset
+
+    Like the user list, owners who chose to be hidden are left out unless
+    USER is an admin.
+    """
+    groups = db.session.query(Group.name).join(
+        GroupMember, GroupMember.group_id == Group.id
+    ).filter(GroupMember.user_id == user.id)
+
+    entries = db.session.query(SharedFile, User.username).join(
+        User, User.id == SharedFile.owner
+    ).filter(
+        SharedFile.owner != user.id,
+        User.enabled,
+        or_(SharedFile.world_read, and_(SharedFile.group_read, SharedFile.file_group.in_(groups)))
+    )
+
+    if not user.has_flag(User.ADMIN):
+        entries = entries.filter(~User.flags.op('&')(User.HIDDEN))
+
+    if cursor is not None:
+        entries = entries.filter(SharedFile.id < cursor)
+
+    rows = entries.order_by(SharedFile.id.desc()).limit(limit + 1).all()
+    next_cursor = rows[limit - 1][0].id if len(rows) > limit else None
+
+    return {
+        'files': [{
+            'id': entry.file_id,
+            'name': entry.filename,
+            'path': entry.path,
+            'owner': entry.owner,
+            'owner_name': username,
+            'file_group': entry.file_group,
+            'size': entry.size,
+            'is_directory': entry.is_directory,
+            'permissions': entry.permissions
+        } for entry, username in rows[:limit]],
+        'next_cursor': next_cursor
+    }
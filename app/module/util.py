@@ -4,6 +4,7 @@ from logging.handlers import RotatingFileHandler
 import re
 import os
 import logging
+import threading
 import borgapi
 
 db = SQLAlchemy()
@@ -47,8 +48,50 @@ store_logger = logging.getLogger("store-log")
 store_logger.setLevel(logging.INFO)
 store_logger.addHandler(store_handler)
 
-borg_api = borgapi.BorgAPI(defaults={}, options={})
-borg_api.set_environ(BORG_PASSPHRASE="pass")
+# BORGAPI_EXECUTOR=pool runs borg commands in worker processes instead of the web worker;
+# BORGAPI_SESSION_IDLE keeps repository sessions, and their lock, open that many seconds
+borg_settings = dict(
+    defaults={},
+    options={},
+    executor=os.getenv('BORGAPI_EXECUTOR', 'inprocess'),
+    workers=int(os.getenv('BORGAPI_WORKERS', 2)),
+    timeout=float(os.getenv('BORGAPI_TIMEOUT')) if os.getenv('BORGAPI_TIMEOUT') else None,
+    session_idle_timeout=float(os.getenv('BORGAPI_SESSION_IDLE', 0))
+)
+
+
+class LazyBorgAPI:
+    """stands in for a borgapi facade and builds it on first use
+
+    building one imports borg's archiver and sets up its logging, which would
+    otherwise slow down every import of this module, worker boot and cli command
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._api = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._api is None:
+            with self._lock:
+                if self._api is None:
+                    self._api = self._factory()
+        return self._api
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+def _build_borg_api():
+    api = borgapi.BorgAPI(**borg_settings)
+    api.set_environ(BORG_PASSPHRASE="pass")
+    return api
+
+
+borg_api = LazyBorgAPI(_build_borg_api)
 
 
 def convert_to_bytes(size_str):
@@ -160,6 +203,11 @@ def get_metadb_path(user):
     return path
 
 
+def get_manifest_path(user):
+    """return path to USER's archive manifest index (/store/manifest.db), kept out of the stage"""
+    return os.path.join(user.store_path, 'manifest.db')
+
+
 def get_user_tree_path(user):
     """return path to USER's working filetree (/store/stage/tree/)"""
     return get_or_create_dir(os.path.join(get_stage_path(user), 'tree'))
@@ -16,19 +16,56 @@ document.addEventListener('DOMContentLoaded', function () {
 		       renderNothingWhenEmpty: false,
 		       colorScheme: 'dark' };
 
-    function displayDiff(archive) {
-	fetch(`/store/diff/${archive}`)
+    // files whose hunks are requested together
+    const hunkBatch = 10;
+
+    function drawHunks(archive, paths, container) {
+	const query = paths.map(path => `path=${encodeURIComponent(path)}`).join('&');
+
+	return fetch(`/store/diff/${archive}/files?${query}`)
 	    .then(response => response.json())
 	    .then(data => {
-		if (data.diff) {
-		    const diffString = data.diff;
-		    const diff2htmlUi = new Diff2HtmlUI(diffViewer, diffString, diffConf);
-
-		    diff2htmlUi.draw();
-		} else {
-		    // Handle case where the 'diff' key is not present in the response
-		    console.error('No diff found in the response.');
+		const diffString = (data.files || []).map(file => file.diff).join('');
+		if (!diffString) return;
+
+		const section = document.createElement('div');
+		container.appendChild(section);
+		new Diff2HtmlUI(section, diffString, diffConf).draw();
+	    });
+    }
+
+    function displayDiff(archive, cursor = null) {
+	const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+
+	if (!cursor) diffViewer.innerHTML = '';
+
+	fetch(`/store/diff/${archive}${query}`)
+	    .then(response => response.json())
+	    .then(async data => {
+		if (data.error) {
+		    diffViewer.textContent = data.error;
+		    return;
+		}
+		if (!cursor && data.changes.length === 0) {
 		    diffViewer.innerHTML = 'Identical to current tree';
+		    return;
+		}
+
+		const paths = data.changes.filter(change => !change.is_directory).map(change => change.path);
+		for (let i = 0; i < paths.length; i += hunkBatch) {
+		    // stop drawing once another archive was selected
+		    if (backupSelector.value !== archive) return;
+		    await drawHunks(archive, paths.slice(i, i + hunkBatch), diffViewer);
+		}
+
+		if (data.next_cursor) {
+		    const more = document.createElement('button');
+		    more.textContent = 'Show more changes';
+		    more.addEventListener('click', () => {
+			more.remove();
+			displayDiff(archive, data.next_cursor);
+		    });
+		    diffViewer.appendChild(more);
 		}
 	    })
 	    .catch(error => {
@@ -109,11 +146,7 @@ document.addEventListener('DOMContentLoaded', function () {
             return response.json();
         })
         .then(data => {
-            alert(data.message || 'Archive restored successfully');
-	    
-	    setTimeout(() => {
-		window.location.reload();
-	    }, 2000);
+            if (data && data.job) followRestoreJob(data.job);
         })
         .catch(error => {
             console.error('Error during restore:', error);
@@ -123,6 +156,36 @@ document.addEventListener('DOMContentLoaded', function () {
         alert('Please select a backup to restore.');
     }
 });
+    function followRestoreJob(jobId) {
+        const statusDiv = document.getElementById('restore-status');
+        const cancelBtn = document.getElementById('cancel-restore');
+
+        revertButton.disabled = true;
+        statusDiv.textContent = 'Restoring...';
+        statusDiv.className = 'status-info';
+
+        cancelBtn.hidden = false;
+        cancelBtn.onclick = () => cancelJob(jobId);
+
+        followJob(jobId, job => {
+            statusDiv.textContent = `Restoring: ${describeJob(job)}`;
+            cancelBtn.hidden = !job.cancellable;
+        }, job => {
+            cancelBtn.hidden = true;
+
+            if (job.state === 'done') {
+                window.location.reload();
+                return;
+            }
+
+            statusDiv.textContent = job.state === 'cancelled'
+                ? 'Restore cancelled, files were left unchanged.'
+                : `Failed to restore archive: ${job.error}`;
+            statusDiv.className = 'status-error';
+            updateButtons();
+        });
+    }
+
     resetSelector();
     updateButtons();
     updateDiff();
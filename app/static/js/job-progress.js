@@ -0,0 +1,56 @@
+function formatBytes(bytes) {
+    const units = ['Bytes', 'KB', 'MB', 'GB', 'TB'];
+    let i = 0;
+
+    while (bytes >= 1024 && i < units.length - 1) {
+        bytes /= 1024;
+        i++;
+    }
+
+    return `${i === 0 ? bytes : bytes.toFixed(2)} ${units[i]}`;
+}
+
+function describeJob(job) {
+    const parts = [];
+
+    if (job.percent !== null) parts.push(`${job.percent}%`);
+    if (job.files) parts.push(`${job.files} file(s)`);
+    if (job.bytes) parts.push(formatBytes(job.bytes));
+    if (job.eta !== null) parts.push(`ETA ${Math.ceil(job.eta)}s`);
+
+    return parts.join(', ');
+}
+
+const JOB_POLL_INTERVAL = 1000;
+
+// Poll a borg job's progress. onProgress gets every update while it runs,
+// onDone the final state ("done", "failed" or "cancelled"). Progress is
+// polled rather than streamed, so following a job never holds a server thread.
+function followJob(jobId, onProgress, onDone) {
+    let timer = null;
+
+    const poll = () => fetch(`/store/jobs/${jobId}`)
+        .then(resp => resp.json())
+        .then(job => {
+            if (job.error && !job.state) {
+                onDone({ state: 'failed', error: job.error });
+            } else if (job.state === 'running') {
+                onProgress(job);
+                timer = setTimeout(poll, JOB_POLL_INTERVAL);
+            } else {
+                onDone(job);
+            }
+        })
+        .catch(() => {
+            timer = setTimeout(poll, JOB_POLL_INTERVAL);
+        });
+
+    poll();
+
+    return { close: () => clearTimeout(timer) };
+}
+
+function cancelJob(jobId) {
+    return fetch(`/store/jobs/${jobId}/cancel`, { method: 'POST' })
+        .then(resp => resp.json());
+}
@@ -71,7 +71,11 @@ document.getElementById('upload-form').addEventListener('submit', function(e) {
                 document.getElementById("upload-form").reset();
                 updatePermissionDisplay();
 
-                setTimeout(() => window.location.reload(), 1800);
+                if (data.job) {
+                    followArchiveJob(data.job, data.count);
+                } else {
+                    window.location.reload();
+                }
             }
         })
         .catch(err => {
@@ -84,3 +88,30 @@ document.getElementById('upload-form').addEventListener('submit', function(e) {
         });
 });
 
+
+function followArchiveJob(jobId, count) {
+    const statusDiv = document.getElementById('upload-status');
+    const cancelBtn = document.getElementById('cancel-archive');
+
+    statusDiv.textContent = `Uploaded ${count} file(s). Archiving...`;
+    statusDiv.className = 'status-info';
+
+    cancelBtn.hidden = false;
+    cancelBtn.onclick = () => cancelJob(jobId);
+
+    followJob(jobId, job => {
+        statusDiv.textContent = `Uploaded ${count} file(s). Archiving: ${describeJob(job)}`;
+        cancelBtn.hidden = !job.cancellable;
+    }, job => {
+        cancelBtn.hidden = true;
+
+        if (job.state === 'done') {
+            window.location.reload();
+        } else {
+            statusDiv.textContent = job.state === 'cancelled'
+                ? 'Archiving cancelled, files were uploaded.'
+                : `Archiving failed: ${job.error}`;
+            statusDiv.className = 'status-error';
+        }
+    });
+}
@@ -0,0 +1,113 @@
+"""Measure how long the app takes to import and to serve its first request.
+
+`importtime` runs `python -X importtime -c "import app"` and lists the modules
+that cost the most; `first-request` starts a fresh interpreter, imports the
+app and serves GET /auth/login with the test client, and fails if that took
+longer than the target. Run from the repository root with the app's
+requirements installed:
+
+    python benchmarks/app_startup.py importtime
+    python benchmarks/app_startup.py first-request --target 1.0
+
+Neither builds the borg facade, so borg itself should not show up in the
+import profile; if it does, something imports it eagerly again.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT, "app")
+
+FIRST_REQUEST = """
+import json, sys, time
+started = time.perf_counter()
+from app import app
+imported = time.perf_counter()
+response = app.test_client().get("/auth/login")
+served = time.perf_counter()
+print(json.dumps({
+    "status": response.status_code,
+    "import": imported - started,
+    "request": served - imported,
+    "borg": "borg.archiver" in sys.modules,
+}))
+"""
+
+
+def run_python(args, log_dir):
+    path = [APP_DIR, os.path.join(ROOT, "vend"), os.environ.get("PYTHONPATH")]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, path))}
+    # the app writes its logs to the working directory
+    return subprocess.run(
+        [sys.executable, *args], cwd=log_dir, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def importtime(opts, log_dir):
+    stderr = run_python(["-X", "importtime", "-c", "import app"], log_dir).stderr
+
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    total = max(cumulative for cumulative, _, name in rows if name.strip() == "app")
+    print(f"{'import app':<48}{total / 1000:8.1f} ms")
+    print(f"{'module':<48}{'cumul.':>8}{'self':>10}")
+    for cumulative, self_us, name in sorted(rows, key=lambda row: row[1], reverse=True)[: opts.top]:
+        print(f"{name.strip():<48}{cumulative / 1000:8.1f}{self_us / 1000:10.1f}")
+
+
+def first_request(opts, log_dir):
+    timings = []
+    for _ in range(opts.repeat):
+        started = time.perf_counter()
+        result = json.loads(run_python(["-c", FIRST_REQUEST], log_dir).stdout)
+        result["total"] = time.perf_counter() - started
+        timings.append(result)
+
+    best = min(timings, key=lambda result: result["total"])
+    print(f"{'interpreter + import':<24}{(best['total'] - best['request']) * 1000:8.1f} ms")
+    print(f"{'  of which import app':<24}{best['import'] * 1000:8.1f} ms")
+    print(f"{'first request':<24}{best['request'] * 1000:8.1f} ms  (status {best['status']})")
+    print(
+        f"{'time to first request':<24}{best['total'] * 1000:8.1f} ms"
+        f"  (target {opts.target * 1000:.0f} ms)"
+    )
+
+    if best["borg"]:
+        print("borg.archiver was imported before any borg command ran")
+    if best["total"] > opts.target or best["borg"]:
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    profile = commands.add_parser("importtime", help="list the slowest imports of the app")
+    profile.add_argument("--top", type=int, default=25)
+
+    ttfr = commands.add_parser("first-request", help="time a cold start up to the first response")
+    ttfr.add_argument("--target", type=float, default=1.0, help="seconds, defaults to 1.0")
+    ttfr.add_argument("--repeat", type=int, default=5)
+
+    opts = parser.parse_args()
+    with tempfile.TemporaryDirectory() as log_dir:
+        if opts.command == "importtime":
+            importtime(opts, log_dir)
+        else:
+            sys.exit(first_request(opts, log_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Measure the time borgapi spends around a borg command, not in it.
+
+The archiver's do_info/do_list are replaced with no-ops, so what is timed is
+option building, argv parsing and output capture. Run from the repository
+root with borg installed:
+
+    PYTHONPATH=vend python benchmarks/borgapi_overhead.py
+"""
+
+import argparse
+import timeit
+
+import borgapi
+from borgapi.options import CommonOptions, ListOptional
+
+
+def noop(name):
+    def command(args):
+        return None
+
+    command.__name__ = name
+    return command
+
+
+def per_call(fn, number):
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--number", type=int, default=2000)
+    opts = parser.parse_args()
+
+    api = borgapi.BorgAPI()
+    api.archiver.do_info = noop("do_info")
+    api.archiver.do_list = noop("do_list")
+
+    options = {"json": True, "lock_wait": 5, "exclude": ["*.tmp"], "short": True}
+    common = per_call(lambda: CommonOptions(**options).parse(), opts.number)
+    optional = per_call(lambda: ListOptional(**options).parse(), opts.number)
+    print(f"{'common options parse':<24}{common:8.1f} us")
+    print(f"{'list options parse':<24}{optional:8.1f} us")
+
+    cases = {
+        "info": lambda: api.info("/tmp/borgapi-bench-repo", json=True),
+        "list": lambda: api.list("/tmp/borgapi-bench-repo", json=True),
+    }
+    for name, call in cases.items():
+        cached = per_call(call, opts.number)
+        api.ARGS_CACHE_COMMANDS = set()
+        uncached = per_call(call, max(1, opts.number // 10))
+        del api.ARGS_CACHE_COMMANDS
+        print(f"{name + ' (argv cache)':<24}{cached:8.1f} us")
+        print(f"{name + ' (no argv cache)':<24}{uncached:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Test setup: the app and the vendored borgapi are imported from the tree."""
+
+import os
+import subprocess
+import sys
+from functools import lru_cache
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, "app"), os.path.join(ROOT, "vend")]
+
+
+@lru_cache(maxsize=None)
+def borg_version():
+    """return the version of the borg that `python -m borg` runs, None if it cannot run"""
+    try:
+        result = subprocess.run(
+            [sys.executable, "-m", "borg", "--version"], capture_output=True, text=True, timeout=60
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+    name, _, version = result.stdout.strip().partition(" ")
+    if result.returncode or name != "borg" or not version.startswith("1."):
+        return None
+
+    return version
+
+
+@pytest.fixture
+def real_borg():
+    """skip unless a working borg 1.x is installed, since the test drives real repositories"""
+    if borg_version() is None:
+        pytest.skip("needs a working borg 1.x")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """run in TMP_PATH; module.util opens its log files under the working directory on import"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def flask_app(workdir):
+    """a bare app with the auth blueprint and its database in WORKDIR, inside an app context"""
+    from flask import Flask
+    from flask_login import LoginManager
+    from module import auth as auth_module
+    from module.auth import User, auth
+    from module.util import db
+
+    # group ids are cached per process, and every test has a database of its own
+    auth_module._group_ids.clear()
+
+    app = Flask(__name__)
+    app.config.update(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{workdir / 'nasinfo.db'}",
+        SECRET_KEY="test",
+        WTF_CSRF_ENABLED=False,
+    )
+    app.register_blueprint(auth, url_prefix="/auth")
+    db.init_app(app)
+
+    login_manager = LoginManager(app)
+    login_manager.user_loader(lambda user_id: db.session.get(User, int(user_id)))
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def make_user(flask_app, workdir):
+    """return a function adding a user NAME in GROUPS, with a store under WORKDIR"""
+    from module.auth import User
+    from module.util import db
+
+    def make_user(name, groups=(), admin=False):
+        user = User(username=name, password="x", store_path=str(workdir / name), user_groups=name)
+        if admin:
+            user.set_flag(User.ADMIN)
+        db.session.add(user)
+        db.session.flush()
+        for group in groups:
+            user.join_group(group)
+        db.session.commit()
+        os.makedirs(user.store_path, exist_ok=True)
+        return user
+
+    return make_user
+
+
+def log_in(client, user):
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user.id)
+        session["_fresh"] = True
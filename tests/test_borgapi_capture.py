@@ -0,0 +1,93 @@
+"""borgapi's capture of borg's output."""
+
+import io
+import sys
+import threading
+
+import pytest
+
+pytest.importorskip("borg")
+
+from borgapi.capture import CaptureLimits, LineBuffer, ListStringIO, OutputCapture, OutputOptions  # noqa: E402
+
+
+def test_lines_past_the_limits_are_spilled_and_read_back():
+    buffer = LineBuffer(CaptureLimits(max_lines=2))
+    for i in range(5):
+        buffer.append(f"line {i}\n")
+
+    assert len(buffer) == 5 and len(buffer.lines) == 2
+    assert buffer[0] == "line 0\n" and buffer[4] == "line 4\n"
+    assert list(buffer) == [f"line {i}\n" for i in range(5)]
+    buffer.close()
+
+
+def test_a_ring_buffer_drops_the_oldest_lines():
+    buffer = LineBuffer(CaptureLimits(max_bytes=10, overflow="ring"))
+    for i in range(5):
+        buffer.append(f"line {i}\n")
+
+    assert buffer.first == 4
+    assert list(buffer) == ["line 4\n"]
+    with pytest.raises(IndexError):
+        buffer[0]
+
+
+def test_unknown_overflow_modes_are_rejected():
+    with pytest.raises(ValueError):
+        CaptureLimits(overflow="wrap")
+
+
+def test_partial_writes_and_carriage_returns_make_whole_lines():
+    stream = ListStringIO()
+    stream.write("Extracting: 1")
+    stream.write("0%\rExtracting: 20%\rdone\nta")
+
+    assert stream.get() == "Extracting: 10%\n"
+    assert stream.get_all() == ["Extracting: 10%\n", "Extracting: 20%\n", "done\n", "ta"]
+
+    stream.close()
+    assert list(stream.values)[-1] == "ta"
+
+
+def test_readers_of_a_ring_buffer_skip_dropped_lines():
+    stream = ListStringIO(limits=CaptureLimits(max_lines=2, overflow="ring"))
+    stream.write("a\nb\nc\nd\n")
+
+    assert [stream.get(), stream.get(), stream.get()] == ["c\n", "d\n", None]
+
+
+def test_listeners_see_output_that_is_not_kept():
+    seen = []
+    stream = ListStringIO(listener=seen.append, keep=False)
+    stream.write("a\nb")
+
+    assert seen == ["a\nb"]
+    assert stream.get_all() == []
+
+
+def test_concurrent_captures_only_see_their_own_thread(monkeypatch):
+    real = io.StringIO()
+    monkeypatch.setattr(sys, "stdout", real)
+    monkeypatch.setattr(sys, "stderr", io.StringIO())
+    barrier = threading.Barrier(2)
+    captured = {}
+
+    def run(name):
+        with OutputCapture()(OutputOptions()) as capture:
+            for i in range(100):
+                print(f"{name} {i}")
+                if i == 50:
+                    barrier.wait()
+            captured[name] = capture.getvalues()["stdout"]
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print("outside")
+
+    for name in ("a", "b"):
+        assert captured[name] == "".join(f"{name} {i}\n" for i in range(100))
+    assert real.getvalue() == "outside\n"
@@ -0,0 +1,72 @@
+"""Running borg commands in worker processes, checked against a real borg repository."""
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip("borg.archiver")
+
+import borgapi  # noqa: E402
+from borgapi.executor import JobCancelled  # noqa: E402
+from borgapi.session import RepositorySession  # noqa: E402
+
+
+pytestmark = pytest.mark.usefixtures("real_borg")
+
+
+@pytest.fixture
+def repo(tmp_path, monkeypatch):
+    monkeypatch.setenv("BORG_BASE_DIR", str(tmp_path / "base"))
+    monkeypatch.setenv("BORG_UNKNOWN_UNENCRYPTED_REPO_ACCESS_IS_OK", "yes")
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "a.txt").write_text("content\n")
+
+    repo = str(tmp_path / "repo")
+    api = borgapi.BorgAPI()
+    api.init(repo, encryption="none")
+    api.create(f"{repo}::first", "data")
+    return repo
+
+
+@pytest.fixture
+def pool():
+    api = borgapi.BorgAPI(executor="pool", workers=1)
+    yield api
+    api.executor.shutdown()
+
+
+def test_cancelling_a_running_job_stops_its_worker(pool, repo):
+    lock = RepositorySession(repo, exclusive=True)
+    try:
+        # the worker waits for the lock held here, so the job is running when cancelled
+        job = pool.submit("create", f"{repo}::blocked", "data", lock_wait=600)
+        while not job.started:
+            time.sleep(0.05)
+        time.sleep(1)
+
+        start = time.monotonic()
+        assert job.cancel()
+        with pytest.raises(JobCancelled):
+            job.result(60)
+        assert time.monotonic() - start < 30
+    finally:
+        lock.close()
+
+    # the worker was replaced, and the next job runs on the fresh one
+    archives = pool.submit("list", repo, json=True).result(120)["archives"]
+    assert [archive["name"] for archive in archives] == ["first"]
+
+
+def test_jobs_with_a_working_directory_leave_the_callers_alone(repo, tmp_path):
+    api = borgapi.BorgAPI()
+    restore = tmp_path / "restore"
+    restore.mkdir()
+    try:
+        api.submit("extract", f"{repo}::first", "data", cwd=str(restore)).result(120)
+    finally:
+        api.executor.shutdown()
+
+    assert os.getcwd() == str(tmp_path)
+    assert (restore / "data" / "a.txt").read_text() == "content\n"
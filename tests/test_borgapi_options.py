@@ -0,0 +1,34 @@
+"""Turning borgapi's option dataclasses into command line flags."""
+
+import pytest
+
+from borgapi.options import CommandOptions, CommonOptions, CreateOptional, ExclusionOptions
+
+
+def test_flags_follow_the_field_order_and_skip_defaults():
+    options = CommonOptions(progress=True, lock_wait=5, debug_topic=["a", "b"], umask=None, unknown=1)
+
+    assert options.parse() == ["--debug-topic", "a", "--debug-topic", "b", "--progress", "--lock-wait", 5]
+    assert CommonOptions().parse() == []
+
+
+def test_list_fields_repeat_their_flag():
+    options = ExclusionOptions(exclude=["*.tmp", "cache"], exclude_from="list.txt")
+
+    assert options.parse() == ["--exclude", "*.tmp", "--exclude", "cache", "--exclude-from", "list.txt"]
+
+
+def test_specs_are_worked_out_once_per_class():
+    CreateOptional(stats=True).parse()
+    CreateOptional(json=True).parse()
+
+    assert CreateOptional._argument_specs() is CreateOptional._argument_specs()
+    assert CreateOptional._argument_specs() is not CommonOptions._argument_specs()
+
+
+def test_command_values_override_the_defaults():
+    options = CommandOptions({"create": {"stats": True, "filter": "AME"}})
+
+    assert options.to_list("create", {"stats": False, "json": True}) == ["--filter", "AME", "--json"]
+    with pytest.raises(ValueError):
+        options.to_list("frobnicate", {})
@@ -0,0 +1,119 @@
+"""borgapi's direct repository access, checked against a real borg repository.
+
+`RepositorySession` and `BorgAPI.iter_items` call into borg internals
+(`Manifest.load`, `Archive`, the functions `with_repository` wraps), so they
+are run against the installed borg rather than mocked. Without a working
+borg 1.x they are skipped.
+"""
+
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("borg.archiver")
+
+import borgapi  # noqa: E402
+from borgapi.session import RepositorySession  # noqa: E402
+
+
+pytestmark = pytest.mark.usefixtures("real_borg")
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    monkeypatch.setenv("BORG_BASE_DIR", str(tmp_path / "base"))
+    monkeypatch.setenv("BORG_UNKNOWN_UNENCRYPTED_REPO_ACCESS_IS_OK", "yes")
+    monkeypatch.chdir(tmp_path)
+    return borgapi.BorgAPI()
+
+
+@pytest.fixture
+def repo(api, tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "a.txt").write_text("same content\n")
+    (data / "b.txt").write_text("same content\n")
+    (data / "c.txt").write_text("other content\n")
+
+    repo = str(tmp_path / "repo")
+    api.init(repo, encryption="none")
+    api.create(f"{repo}::first", "data")
+    return repo
+
+
+def test_iter_items_reads_items_and_chunk_digests(api, repo):
+    items = {item["path"]: item for item in api.iter_items(f"{repo}::first")}
+
+    assert items["data"]["type"] == "d"
+    assert items["data"]["chunk_digest"] is None
+    assert items["data/a.txt"]["type"] == "-"
+    assert items["data/a.txt"]["size"] == len("same content\n")
+    assert items["data/a.txt"]["chunk_digest"] == items["data/b.txt"]["chunk_digest"]
+    assert items["data/a.txt"]["chunk_digest"] != items["data/c.txt"]["chunk_digest"]
+
+
+def test_iter_items_releases_the_lock_before_yielding(api, repo):
+    items = api.iter_items(f"{repo}::first")
+    first = next(items)
+
+    # with the 1 s default lock wait this fails if the read still holds the repository
+    api.create(f"{repo}::second", "data")
+
+    assert first["path"] == "data"
+    assert len(list(items)) == 3
+
+
+def test_iter_items_rejects_a_bare_repository(api, repo):
+    with pytest.raises(ValueError):
+        next(api.iter_items(repo))
+
+
+def test_repository_session_runs_commands_on_the_open_repository(api, repo):
+    with api.session(repo) as session:
+        first = api.list(repo, json=True)
+        second = api.list(repo, json=True)
+        assert not session.closed
+
+    assert [archive["name"] for archive in first["archives"]] == ["first"]
+    assert second["archives"] == first["archives"]
+    # the default idle timeout of 0 closes the session as soon as the block ends
+    assert session.closed
+
+
+def test_repository_session_releases_the_lock_on_close(api, repo):
+    session = RepositorySession(repo)
+    assert [item["path"] for item in session.iter_items("first")][0] == "data"
+    session.close()
+
+    exclusive = RepositorySession(repo, exclusive=True)
+    exclusive.close()
+    assert exclusive.closed
+
+
+def test_sessions_release_the_lock_to_other_processes_by_default(api, repo, tmp_path):
+    with api.session(repo):
+        api.list(repo, json=True)
+
+    # nothing in another process can evict a session, so none may outlive its block
+    result = subprocess.run(
+        [sys.executable, "-m", "borg", "create", "--lock-wait", "0", f"{repo}::other", "data"],
+        cwd=tmp_path,
+    )
+    assert result.returncode == 0
+
+
+def test_list_and_diff_stream_parsed_lines(api, repo, tmp_path):
+    (tmp_path / "data" / "c.txt").write_text("changed content\n")
+    api.create(f"{repo}::second", "data")
+
+    archives = api.iter_list(repo)
+    assert next(archives)["name"] == "first"
+    archives.close()
+
+    items = {item["path"]: item for item in api.iter_list(f"{repo}::first")}
+    assert items["data/a.txt"]["size"] == len("same content\n")
+
+    changes = {change["path"]: change for change in api.iter_diff(f"{repo}::first", "second")}
+    assert "data/a.txt" not in changes
+    assert "modified" in [change["type"] for change in changes["data/c.txt"]["changes"]]
@@ -0,0 +1,59 @@
+"""Background indexing of file contents for search."""
+
+import os
+
+import pytest
+
+
+@pytest.fixture
+def indexer(workdir):
+    from module.content_index import ContentIndexer
+
+    indexer = ContentIndexer(cpu_budget=1, workers=1)
+    yield indexer
+    if indexer.pool is not None:
+        indexer.pool.shutdown()
+
+
+@pytest.fixture
+def tree(workdir):
+    from module.metadata import UserMetadata
+
+    tree = workdir / "tree"
+    (tree / "docs").mkdir(parents=True)
+    (tree / "docs" / "notes.txt").write_text("the quick brown fox\n")
+    (tree / "docs" / "blob.txt").write_bytes(b"fox\x00\x01")
+    (tree / "image.png").write_text("fox")
+
+    metadata = UserMetadata(str(workdir / "_meta.db"))
+    metadata.add_files([("/", "docs", 0, True), ("/docs", "notes.txt", 20, False),
+                        ("/docs", "blob.txt", 5, False), ("/", "image.png", 3, False)], 1, "alice")
+    return tree, metadata
+
+
+def found(metadata, word):
+    return sorted(file["name"] for file in metadata.search_files(content=word)["files"])
+
+
+def test_text_files_are_searchable_by_content(indexer, tree, workdir):
+    tree, metadata = tree
+
+    indexer.index_user(str(workdir / "_meta.db"), str(tree))
+
+    # binary heads and extensions that are not text-like are never indexed
+    assert found(metadata, "fox") == ["notes.txt"]
+    assert found(metadata, "quick") == ["notes.txt"]
+
+
+def test_files_rewritten_with_the_same_size_are_indexed_again(indexer, tree, workdir):
+    tree, metadata = tree
+    notes = tree / "docs" / "notes.txt"
+
+    indexer.index_user(str(workdir / "_meta.db"), str(tree))
+    notes.write_text("the quick brown cat\n")
+    mtime = os.stat(notes).st_mtime_ns + 1_000_000_000
+    os.utime(notes, ns=(mtime, mtime))
+    indexer.index_user(str(workdir / "_meta.db"), str(tree))
+
+    assert found(metadata, "fox") == []
+    assert found(metadata, "cat") == ["notes.txt"]
@@ -0,0 +1,108 @@
+"""Datastore views, with borg replaced by canned output."""
+
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import log_in
+
+pytest.importorskip("borg")
+
+
+@pytest.fixture
+def datastore(flask_app, monkeypatch):
+    from module import datastore
+    from module.util import db
+
+    flask_app.register_blueprint(datastore.datastore, url_prefix="/store")
+    db.create_all()
+    extracted = []
+
+    def iter_extract(archive, member):
+        extracted.append((archive, member))
+        yield from (b"old ", b"content\n")
+
+    monkeypatch.setattr(datastore, "borg_api", SimpleNamespace(iter_extract=iter_extract, extracted=extracted))
+    return datastore
+
+
+@pytest.fixture
+def alice(make_user, datastore):
+    from module.manifest_index import ManifestIndex
+    from module.metadata import UserMetadata
+    from module.util import get_manifest_path, get_metadb_path
+
+    alice = make_user("alice")
+    # get_repo_path would init a repository where there is none
+    os.makedirs(os.path.join(alice.store_path, "repo"))
+    metadata = UserMetadata(get_metadb_path(alice))
+    metadata.add_files([("/", "docs", 0, True), ("/docs", "a.txt", 4, False)], alice.id, "alice", 700)
+
+    items = [{"path": path, "type": type, "mode": 0, "size": size, "mtime": "2024-01-01T00:00:00",
+              "chunk_digest": digest}
+             for path, type, size, digest in [("stage/tree", "d", 0, None), ("stage/tree/docs", "d", 0, None),
+                                              ("stage/tree/docs/a.txt", "-", 12, "aa")]]
+    ManifestIndex(get_manifest_path(alice)).add_archive(
+        {"id": "01", "name": "first", "start": "2024-01-01T00:00:00"}, items)
+
+    alice.file_id = metadata.get_file_ids("/docs", ["a.txt"])[0]
+    return alice
+
+
+def test_archived_versions_stream_from_borg(flask_app, datastore, alice):
+    client = flask_app.test_client()
+    log_in(client, alice)
+
+    response = client.get(f"/store/download?user_id={alice.id}&file_id={alice.file_id}&archive=01")
+
+    assert response.status_code == 200
+    assert response.headers["Content-Length"] == "12"
+    assert response.data == b"old content\n"
+    assert datastore.borg_api.extracted == [(f"{alice.store_path}/repo::first", "stage/tree/docs/a.txt")]
+
+
+def test_archived_versions_need_read_permission(flask_app, datastore, alice, make_user):
+    client = flask_app.test_client()
+    log_in(client, make_user("bob"))
+
+    response = client.get(f"/store/download?user_id={alice.id}&file_id={alice.file_id}&archive=01")
+
+    assert response.status_code == 403
+    assert datastore.borg_api.extracted == []
+
+
+def test_files_missing_from_the_archive_are_not_found(flask_app, datastore, alice):
+    client = flask_app.test_client()
+    log_in(client, alice)
+
+    response = client.get(f"/store/download?user_id={alice.id}&file_id={alice.file_id}&archive=02")
+
+    assert response.status_code == 404
+
+
+def test_archive_diffs_page_from_the_index(flask_app, datastore, alice, monkeypatch):
+    from module.manifest_index import ManifestIndex
+    from module.util import get_manifest_path
+
+    item = {"path": "stage/tree/b.txt", "type": "-", "mode": 0, "size": 3, "mtime": "2024-01-02T00:00:00",
+            "chunk_digest": "bb"}
+    ManifestIndex(get_manifest_path(alice)).add_archive(
+        {"id": "02", "name": "second", "start": "2024-01-02T00:00:00"}, [item])
+    scheduled = []
+    monkeypatch.setattr(datastore.manifest_indexer, "schedule", lambda *args: scheduled.append(args))
+    monkeypatch.setattr(datastore, "find_archive_by_id",
+                        lambda user, id: {"name": "third"} if id == "03" else None)
+    client = flask_app.test_client()
+    log_in(client, alice)
+
+    page = client.get("/store/diff/01/02?limit=2").get_json()
+    assert [(change["path"], change["status"]) for change in page["changes"]] == [
+        ("/b.txt", "added"), ("/docs", "removed")]
+    page = client.get(f"/store/diff/01/02?limit=2&cursor={page['next_cursor']}").get_json()
+    assert [(change["path"], change["status"]) for change in page["changes"]] == [("/docs/a.txt", "removed")]
+    assert datastore.borg_api.extracted == []
+
+    assert client.get("/store/diff/01/03").status_code == 404
+    assert len(scheduled) == 1
+    assert client.get("/store/diff/01/09").status_code == 400
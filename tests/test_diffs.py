@@ -0,0 +1,63 @@
+"""Diffs between the live tree and archived versions of it."""
+
+from types import SimpleNamespace
+
+import pytest
+
+
+@pytest.fixture
+def diffs(workdir):
+    from module import diffs
+
+    return diffs
+
+
+def test_text_files_diff_in_gits_format(diffs):
+    diff = diffs.unified_file_diff("/a.txt", b"one\ntwo\n", b"one\nthree")
+
+    assert not diff["binary"] and not diff["truncated"]
+    assert diff["diff"].startswith("diff --git a/a.txt b/a.txt\n--- a/a.txt\n+++ b/a.txt\n")
+    assert "-two\n+three\n\\ No newline at end of file\n" in diff["diff"]
+    assert diffs.unified_file_diff("/a.txt", b"same\n", b"same\n")["diff"] == ""
+
+
+def test_binary_and_large_files_are_guarded(diffs):
+    binary = diffs.unified_file_diff("/a.bin", b"\x00\x01", b"\x00\x02")
+    assert binary["binary"] and "Binary files a/a.bin and b/a.bin differ" in binary["diff"]
+
+    large = diffs.unified_file_diff("/a.txt", b"a\n" * 10, b"b\n" * 10, max_bytes=4)
+    assert large["truncated"]
+    assert large["diff"].count("\n-a") == 2
+    assert large["diff"].endswith("\\ Truncated: only the first 4 bytes were compared\n")
+
+
+def test_tree_changes_page_by_path(diffs):
+    archived = {"/a": ("-", 1, "t0"), "/b": ("-", 2, "t0"), "/d": ("d", 0, "t0"), "/d/c": ("-", 3, "t0")}
+    live = {"/a": ("-", 1, "t0"), "/b": ("-", 5, "t1"), "/d": ("d", 9, "t1"), "/e": ("-", 4, "t1")}
+
+    first = diffs.tree_changes(archived, live, limit=2)
+    second = diffs.tree_changes(archived, live, cursor=first["next_cursor"], limit=2)
+
+    assert [(change["path"], change["status"], change["size_delta"]) for change in first["changes"]] == [
+        ("/b", "modified", 3), ("/d/c", "removed", -3)]
+    assert [(change["path"], change["status"]) for change in second["changes"]] == [("/e", "added")]
+    assert second["next_cursor"] is None
+
+
+def test_live_diffs_read_only_the_head_of_each_side(diffs, workdir, monkeypatch):
+    (workdir / "tree").mkdir()
+    (workdir / "tree" / "a.txt").write_text("new\n")
+    read = []
+
+    def iter_extract(archive, member):
+        read.append(member)
+        yield from (b"old\n", b"x" * 100, b"never read")
+
+    monkeypatch.setattr(diffs, "borg_api", SimpleNamespace(iter_extract=iter_extract))
+
+    files = diffs.live_file_diffs("repo", "first", str(workdir / "tree"), ["/a.txt", "/gone.txt"], max_bytes=50)
+
+    assert sorted(read) == ["stage/tree/a.txt", "stage/tree/gone.txt"]
+    assert [file["path"] for file in files] == ["/a.txt", "/gone.txt"]
+    assert files[0]["truncated"] and "+new\n" in files[0]["diff"]
+    assert diffs.read_archived("repo", "first", "stage/tree/a.txt", max_bytes=50) == b"old\n" + b"x" * 100
@@ -0,0 +1,73 @@
+"""Streaming tarballs of a user's tree."""
+
+import gzip
+import io
+import os
+import tarfile
+
+import pytest
+
+
+@pytest.fixture
+def exports(workdir):
+    from module import exports
+
+    return exports
+
+
+@pytest.fixture
+def tree(workdir):
+    tree = workdir / "tree"
+    (tree / "docs" / "empty").mkdir(parents=True)
+    (tree / "docs" / "big.bin").write_bytes(bytes(range(256)) * 1000)
+    (tree / "a.txt").write_text("hello\n")
+    os.symlink("docs", tree / "link-to-docs")
+    os.symlink("a.txt", tree / "link-to-a")
+    return tree
+
+
+def read_tar(data):
+    with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+        return {member.name: (member, archive.extractfile(member).read() if member.isreg() else None)
+                for member in archive}
+
+
+def test_the_tree_is_laid_out_like_borgs_export(exports, tree):
+    members = read_tar(b"".join(exports.iter_tree_tar(str(tree), chunk_size=1000)))
+
+    assert sorted(members) == [
+        "stage/tree", "stage/tree/a.txt", "stage/tree/docs", "stage/tree/docs/big.bin",
+        "stage/tree/docs/empty", "stage/tree/link-to-a", "stage/tree/link-to-docs",
+    ]
+    assert members["stage/tree/a.txt"][1] == b"hello\n"
+    assert members["stage/tree/docs/big.bin"][1] == (tree / "docs" / "big.bin").read_bytes()
+    assert members["stage/tree/docs/empty"][0].isdir()
+    assert members["stage/tree/link-to-docs"][0].linkname == "docs"
+    assert members["stage/tree/link-to-a"][0].issym()
+
+
+def test_chunks_stay_small_however_large_the_files(exports, tree):
+    assert max(len(chunk) for chunk in exports.iter_tree_tar(str(tree), chunk_size=4096)) <= 4096
+
+
+def test_gzip_exports_decompress_to_the_same_tarball(exports, tree):
+    plain = b"".join(exports.export_tree(str(tree), "tar"))
+    compressed = b"".join(exports.export_tree(str(tree), "tar.gz"))
+
+    assert gzip.decompress(compressed) == plain
+
+
+def test_missing_compressors_fail_before_anything_is_read(exports, tree, monkeypatch):
+    import builtins
+
+    real_import = builtins.__import__
+
+    def no_zstandard(name, *args, **kwargs):
+        if name == "zstandard":
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "__import__", no_zstandard)
+
+    with pytest.raises(exports.ExportError):
+        exports.export_tree(str(tree), "tar.zst")
@@ -0,0 +1,69 @@
+"""Group membership kept in the groups and group_members tables."""
+
+from conftest import log_in
+
+
+def test_membership_and_the_legacy_column_follow_joins_and_leaves(make_user):
+    from module.util import db
+
+    user = make_user("alice", ["staff", "ops"])
+    assert user.in_group("staff") and user.in_group("ops")
+    assert not user.in_group("other")
+    assert user.user_groups == "staff,ops"
+
+    user.leave_group("staff")
+    db.session.commit()
+
+    assert not user.in_group("staff")
+    assert user.group_names() == ["ops"]
+    assert user.user_groups == "ops"
+
+
+def test_group_ids_are_cached_only_once_committed(flask_app):
+    from module import auth
+    from module.auth import Group
+    from module.util import db
+
+    auth.get_group_id("rolled-back", create=True)
+    db.session.rollback()
+
+    assert "rolled-back" not in auth._group_ids
+    assert Group.query.filter_by(name="rolled-back").count() == 0
+
+    group_id = auth.get_group_id("kept", create=True)
+    db.session.commit()
+
+    assert auth._group_ids["kept"] == group_id
+
+
+def test_migration_moves_the_legacy_column_once(flask_app):
+    from module.auth import GroupMember, User, migrate_user_groups
+    from module.util import db
+
+    db.session.add(User(username="old", password="x", store_path="old", user_groups="staff,ops"))
+    db.session.commit()
+
+    migrate_user_groups()
+    migrate_user_groups()
+
+    user = User.query.filter_by(username="old").one()
+    assert user.group_names() == ["staff", "ops"]
+    assert GroupMember.query.filter_by(user_id=user.id).count() == 2
+
+
+def test_a_reused_user_id_does_not_inherit_memberships(flask_app, make_user):
+    from module.auth import GroupMember
+
+    admin = make_user("admin", admin=True)
+    gone = make_user("gone", ["staff"])
+    gone_id = gone.id
+
+    client = flask_app.test_client()
+    log_in(client, admin)
+    client.get(f"/auth/admin/delete/{gone_id}", headers={"Referer": "/"})
+
+    assert GroupMember.query.filter_by(user_id=gone_id).count() == 0
+
+    reused = make_user("new")
+    assert reused.id == gone_id
+    assert not reused.in_group("staff")
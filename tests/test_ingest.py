@@ -0,0 +1,64 @@
+"""Unpacking uploaded tar and zip archives into a user's tree."""
+
+import io
+import tarfile
+
+import pytest
+
+
+@pytest.fixture
+def ingest(flask_app, monkeypatch):
+    from module import ingest, shared_index  # noqa: F401, registers the shared_files table
+    from module.util import db
+
+    db.create_all()
+    monkeypatch.setattr(ingest.content_indexer, "schedule", lambda *args: None)
+    return ingest
+
+
+def tarball(files):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode="w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    data.seek(0)
+    return data
+
+
+def shared_names(user):
+    from module import shared_index
+
+    return sorted(file["name"] for file in shared_index.list_shared_with(user)["files"])
+
+
+def test_ingest_mirrors_only_its_own_rows_into_the_shared_index(ingest, make_user, monkeypatch):
+    from module import shared_index
+    from module.metadata import UserMetadata
+    from module.util import get_metadb_path
+
+    alice, bob = make_user("alice"), make_user("bob")
+    # registered behind the shared index's back: only a rebuild would pick it up
+    UserMetadata(get_metadb_path(alice)).add_files([("/", "old.txt", 1, False)], alice.id, "alice", 744)
+    monkeypatch.setattr(shared_index, "SYNC_BATCH", 2)
+
+    result = ingest.ingest(alice, tarball({"docs/a.txt": b"a", "docs/sub/b.txt": b"bb", "c.txt": b"c"}),
+                           "upload.tar.gz", dest="/in", permissions=744)
+
+    assert (result["count"], result["added"], result["skipped"]) == (3, 3, [])
+    assert alice.num_files == 3
+    assert shared_names(bob) == ["a.txt", "b.txt", "c.txt", "docs", "in", "sub"]
+
+
+def test_ingest_skips_unsafe_members(ingest, make_user, workdir):
+    from module.metadata import UserMetadata
+    from module.util import get_metadb_path
+
+    alice = make_user("alice")
+
+    result = ingest.ingest(alice, tarball({"../evil.txt": b"x", "ok.txt": b"y"}), "upload.tar")
+
+    assert result["count"] == 1
+    assert [file["name"] for file in UserMetadata(get_metadb_path(alice)).get_files("/")] == ["ok.txt"]
+    assert not list(workdir.rglob("evil.txt"))
@@ -0,0 +1,80 @@
+"""Background borg jobs: progress parsing, outcome and cancellation."""
+
+import json
+
+import pytest
+
+pytest.importorskip("borg")
+
+
+@pytest.fixture
+def jobs(workdir, monkeypatch):
+    from borgapi.executor import BorgJob
+    from module import jobs
+
+    class Api:
+        def __init__(self):
+            self.submitted = []
+
+        def submit(self, command, *args, **kwargs):
+            self.submitted.append((command, args, kwargs))
+            return BorgJob(command, kwargs.get("on_output"))
+
+    monkeypatch.setattr(jobs, "borg_api", Api())
+    return jobs
+
+
+def progress(nfiles, size, path):
+    return json.dumps({"type": "archive_progress", "nfiles": nfiles, "original_size": size, "path": path})
+
+
+def test_create_progress_is_parsed_across_partial_writes(jobs):
+    job = jobs.Job(1, "create", total_bytes=400)
+    line = progress(3, 100, "stage/tree/a") + "\n"
+
+    job.on_output("stderr", line[:10])
+    assert job.files == 0
+
+    job.on_output("stderr", line[10:])
+    snapshot = job.snapshot()
+    assert (snapshot["files"], snapshot["bytes"], snapshot["percent"]) == (3, 100, 25.0)
+    assert snapshot["path"] == "stage/tree/a"
+    assert snapshot["cancellable"]
+
+
+def test_extract_percentages_and_stdout_are_told_apart(jobs):
+    job = jobs.Job(1, "extract")
+
+    job.on_output("stdout", "Extracting: 90.0%\n")
+    job.on_output("stderr", "Extracting: 12.5%\r")
+
+    assert job.percent == 12.5
+
+
+def test_jobs_run_isolated_so_running_ones_can_be_cancelled(jobs):
+    job = jobs.start_job(1, "create", "create", "repo::archive", "stage", lock_wait=300)
+    command, args, kwargs = jobs.borg_api.submitted[0]
+
+    assert (command, args) == ("create", ("repo::archive", "stage"))
+    assert kwargs["isolated"] and kwargs["progress"] and kwargs["lock_wait"] == 300
+    assert jobs.get_job(job.id, 1) is job
+    assert jobs.get_job(job.id, 2) is None
+
+    assert job.cancel()
+    job.borg_job._finish(error=jobs.JobCancelled("create"))
+
+    assert job.wait(1)
+    assert job.snapshot()["state"] == "cancelled"
+    assert not job.snapshot()["cancellable"]
+    assert not job.cancel()
+
+
+def test_on_done_runs_before_the_outcome_is_reported(jobs):
+    seen = []
+    job = jobs.start_job(1, "create", "create", "repo::archive",
+                         on_done=lambda job, borg_job: seen.append(job.state))
+
+    job.borg_job._finish(result="")
+
+    assert seen == ["running"]
+    assert job.state == "done" and job.percent == 100.0
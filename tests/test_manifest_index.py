@@ -0,0 +1,183 @@
+"""The per-user manifest index, fed the items and metadata borg would yield."""
+
+import sqlite3
+from contextlib import closing
+from types import SimpleNamespace
+
+import pytest
+
+
+def item(path, size=0, digest=None, mtime="2024-01-01T00:00:00"):
+    return {"path": path, "type": "d" if digest is None else "-", "mode": 0, "size": size,
+            "mtime": mtime, "chunk_digest": digest}
+
+
+FIRST = [
+    item("stage"), item("stage/tree"), item("stage/tree/docs"),
+    item("stage/tree/docs/a.txt", 10, "aa"),
+    item("stage/tree/docs/b.txt", 20, "bb"),
+    item("stage/tree/c.txt", 30, "cc"),
+]
+SECOND = [
+    item("stage"), item("stage/tree"), item("stage/tree/docs"),
+    item("stage/tree/docs/a.txt", 11, "a2", mtime="2024-01-02T00:00:00"),
+    item("stage/tree/c.txt", 30, "cc"),
+]
+
+
+@pytest.fixture
+def manifest(workdir):
+    from module import manifest_index
+
+    return manifest_index
+
+
+@pytest.fixture
+def index(manifest, workdir):
+    index = manifest.ManifestIndex(str(workdir / "manifest.db"))
+    access = [("stage/tree/docs", "b.txt", 1, "alice", 740)]
+    index.add_archive({"id": "01", "name": "first", "start": "2024-01-01T00:00:00"}, FIRST, access)
+    index.add_archive({"id": "02", "name": "second", "start": "2024-01-02T00:00:00"}, SECOND)
+    return index
+
+
+def test_archives_are_listed_with_their_totals(index):
+    archives = {archive["name"]: archive for archive in index.get_archives()}
+
+    assert archives["first"]["item_count"] == 6 and archives["first"]["total_size"] == 60
+    assert archives["second"]["item_count"] == 5 and archives["second"]["total_size"] == 41
+
+
+def test_trees_hold_what_each_archive_held(index):
+    first, second = index.get_tree("01"), index.get_tree("02")
+
+    assert first["/docs/b.txt"] == ("-", 20, "2024-01-01T00:00:00")
+    assert "/docs/b.txt" not in second
+    assert second["/docs/a.txt"][1] == 11
+    # directory sizes are the total of everything below them
+    assert first["/docs"][1] == 30 and second["/docs"][1] == 11
+
+
+def test_history_folds_unchanged_versions(index):
+    history = index.get_history("stage/tree/docs/a.txt")
+    assert [(version["archive"], version["digest"]) for version in history] == [("first", "aa"), ("second", "a2")]
+
+    assert [version["archive"] for version in index.get_history("stage/tree/c.txt")] == ["first"]
+
+
+def test_listings_page_and_apply_the_archived_permissions(manifest, index):
+    from module.metadata import Viewer
+
+    owner = Viewer(1, set(), False)
+    stranger = Viewer(2, set(), False)
+
+    page = index.list_directory("01", "stage/tree/docs", viewer=owner, owner=1, group="alice", limit=1)
+    assert [file["name"] for file in page["files"]] == ["a.txt"]
+
+    cursor = manifest.parse_cursor(page["next_cursor"])
+    page = index.list_directory("01", "stage/tree/docs", viewer=owner, owner=1, group="alice", cursor=cursor)
+    assert [(file["name"], file["permissions"]) for file in page["files"]] == [("b.txt", 740)]
+    assert page["next_cursor"] is None
+
+    page = index.list_directory("01", "stage/tree/docs", viewer=stranger, owner=1, group="alice")
+    assert [file["name"] for file in page["files"]] == ["a.txt"]
+
+    assert index.list_directory("03", "stage/tree") is None
+
+
+def test_archived_access_is_read_from_the_streamed_metadata(manifest, workdir, monkeypatch):
+    with closing(sqlite3.connect(workdir / "_meta.db")) as conn:
+        conn.execute("CREATE TABLE files (path TEXT, filename TEXT, owner INTEGER, file_group TEXT, permissions INTEGER)")
+        conn.execute("INSERT INTO files VALUES ('/docs', 'b.txt', 1, 'alice', 740)")
+        conn.commit()
+    data = (workdir / "_meta.db").read_bytes()
+
+    def iter_extract(archive, *paths):
+        assert (archive, paths) == ("repo::first", (manifest.METADB_MEMBER,))
+        for i in range(0, len(data), 100):
+            yield data[i:i + 100]
+
+    monkeypatch.setattr(manifest, "borg_api", SimpleNamespace(iter_extract=iter_extract))
+
+    assert list(manifest.read_archived_access("repo", "first")) == [("stage/tree/docs", "b.txt", 1, "alice", 740)]
+
+
+def test_archives_without_metadata_have_no_archived_access(manifest, monkeypatch):
+    def iter_extract(archive, *paths):
+        raise RuntimeError("no such member")
+        yield
+
+    monkeypatch.setattr(manifest, "borg_api", SimpleNamespace(iter_extract=iter_extract))
+
+    assert list(manifest.read_archived_access("repo", "first")) == []
+
+
+def test_changes_between_archives_come_from_the_index(manifest, workdir):
+    index = manifest.ManifestIndex(str(workdir / "manifest.db"))
+    third = SECOND + [item("stage/tree/docs/d.txt", 5, "dd"), item("stage/tree/docs-x"),
+                      item("stage/tree/docs-x/e.txt", 6, "ee")]
+    index.add_archive({"id": "01", "name": "first", "start": "2024-01-01T00:00:00"}, FIRST)
+    index.add_archive({"id": "02", "name": "second", "start": "2024-01-02T00:00:00"}, SECOND)
+    index.add_archive({"id": "03", "name": "third", "start": "2024-01-03T00:00:00"}, third,
+                      [("stage/tree", "c.txt", 1, "alice", 700)])
+
+    pages, cursor = [], None
+    while True:
+        page = index.get_changes("01", "03", cursor=cursor, limit=2)
+        pages.append([(change["path"], change["status"], change["size_delta"]) for change in page["changes"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    # ordered by path like tree_changes; unchanged paths and directories
+    # whose size alone changed never take a slot on a page
+    assert pages == [
+        [("/c.txt", "metadata", 0), ("/docs-x", "added", 0)],
+        [("/docs-x/e.txt", "added", 6), ("/docs/a.txt", "modified", 1)],
+        [("/docs/b.txt", "removed", -20), ("/docs/d.txt", "added", 5)],
+    ]
+
+    backwards = index.get_changes("02", "01")["changes"]
+    assert [(change["path"], change["status"]) for change in backwards] == [
+        ("/docs/a.txt", "modified"), ("/docs/b.txt", "added")]
+    assert index.get_changes("01", "09") is None
+
+
+def test_malformed_cursors_are_rejected(manifest):
+    assert manifest.parse_cursor("1:a:b.txt") == (1, "a:b.txt")
+
+    for cursor in ("", "a.txt", "2:a.txt"):
+        with pytest.raises(ValueError):
+            manifest.parse_cursor(cursor)
+
+
+def test_items_without_archived_metadata_belong_to_the_owner(index):
+    from module.metadata import Viewer
+
+    # c.txt has no row in the archived metadata: the owner's, mode 744
+    page = index.list_directory("02", "stage/tree", viewer=Viewer(2, set(), False), owner=1, group="alice")
+    assert [(file["name"], file["owner"], file["permissions"]) for file in page["files"]] == [
+        ("docs", 1, 744), ("c.txt", 1, 744)]
+
+    assert index.get_item("01", "stage/tree/docs/b.txt")["size"] == 20
+    assert index.get_item("02", "stage/tree/docs/b.txt") is None
+
+
+def test_history_skips_versions_whose_content_did_not_change(manifest, workdir):
+    index = manifest.ManifestIndex(str(workdir / "manifest.db"))
+    archives = [
+        ([item("stage/tree/a.txt", 1, "v1")], []),
+        # only the permissions changed
+        ([item("stage/tree/a.txt", 1, "v1")], [("stage/tree", "a.txt", 1, "alice", 744)]),
+        ([item("stage/tree/a.txt", 2, "v2")], []),
+        ([], []),
+        ([item("stage/tree/a.txt", 2, "v2")], []),
+    ]
+    for i, (items, access) in enumerate(archives):
+        index.add_archive({"id": f"0{i}", "name": f"n{i}", "start": f"2024-01-0{i + 1}T00:00:00"}, items, access)
+
+    history = index.get_history("stage/tree/a.txt")
+
+    # removed and brought back with the same content is still the same version
+    assert [(version["archive"], version["digest"]) for version in history] == [("n0", "v1"), ("n2", "v2")]
+    assert index.get_history("stage/tree/missing.txt") == []
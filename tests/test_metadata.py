@@ -0,0 +1,82 @@
+"""The per-user metadata database."""
+
+import pytest
+
+
+@pytest.fixture
+def metadata(workdir):
+    from module.metadata import UserMetadata
+
+    return UserMetadata(str(workdir / "_meta.db"))
+
+
+def names(metadata, path):
+    return sorted(file["name"] for file in metadata.get_files(path))
+
+
+def test_remove_files_takes_folders_with_everything_below_them(metadata):
+    metadata.add_files([
+        ("/", "share", 0, True), ("/", "share-x", 0, True), ("/", "share0", 0, True),
+        ("/share", "inner", 0, True), ("/share", "a.txt", 1, False),
+        ("/share/inner", "b.txt", 2, False),
+        ("/share-x", "c.txt", 3, False), ("/share0", "d.txt", 4, False),
+    ], 1, "alice")
+    share, inner = (metadata.get_file_by_id(id) for id in
+                    metadata.get_file_ids("/", ["share"]) + metadata.get_file_ids("/share", ["inner"]))
+
+    # the inner folder is selected too, and its file must be counted once
+    assert metadata.remove_files([share, inner]) == 2
+
+    assert names(metadata, "/") == ["share-x", "share0"]
+    assert names(metadata, "/share") == [] and names(metadata, "/share/inner") == []
+    assert names(metadata, "/share-x") == ["c.txt"] and names(metadata, "/share0") == ["d.txt"]
+
+
+def test_remove_files_of_nothing_removes_nothing(metadata):
+    assert metadata.remove_files([]) == 0
+
+
+def test_add_files_counts_only_new_files_and_updates_sizes(metadata):
+    entries = [("/", "docs", 0, True), ("/docs", "a.txt", 1, False), ("/docs", "b.txt", 2, False)]
+    assert metadata.add_files(entries, 1, "alice") == 2
+
+    entries = [("/", "docs", 0, True), ("/docs", "a.txt", 10, False), ("/docs", "c.txt", 3, False),
+               ("/", "docs", 5, False)]
+    assert metadata.add_files(entries, 1, "alice") == 1
+
+    sizes = {file["name"]: (file["size"], file["is_directory"]) for file in metadata.get_files("/docs")}
+    assert sizes == {"a.txt": (10, False), "b.txt": (2, False), "c.txt": (3, False)}
+    # a file entry never replaces the directory registered in its place
+    assert [(file["name"], file["is_directory"]) for file in metadata.get_files("/")] == [("docs", True)]
+
+
+def test_add_files_of_nothing_adds_nothing(metadata):
+    assert metadata.add_files([], 1, "alice") == 0
+
+
+@pytest.mark.parametrize("viewer, readable", [
+    ((1, set(), False), ["group.txt", "private.txt", "world.txt", "write-only.txt"]),
+    ((2, {"alice"}, False), ["group.txt", "world.txt"]),
+    ((2, {"bob"}, False), ["world.txt"]),
+    ((3, set(), True), ["group.txt", "private.txt", "world.txt", "write-only.txt"]),
+])
+def test_listings_keep_only_what_the_viewer_may_read(metadata, viewer, readable):
+    from module.metadata import Viewer
+
+    for name, permissions in (("private.txt", 700), ("group.txt", 740), ("world.txt", 704),
+                              ("write-only.txt", 722)):
+        metadata.add_files([("/", name, 1, False)], 1, "alice", permissions)
+
+    assert sorted(file["name"] for file in metadata.get_files("/", viewer=Viewer(*viewer))) == readable
+
+
+def test_write_checks_split_the_requested_files(metadata):
+    from module.metadata import Viewer
+
+    metadata.add_files([("/", "shared.txt", 1, False)], 1, "alice", 762)
+    metadata.add_files([("/", "mine.txt", 1, False)], 1, "alice", 700)
+    ids = metadata.get_file_ids("/", ["shared.txt", "mine.txt"])
+
+    writable, denied = metadata.get_files_for_write(ids, Viewer(2, {"alice"}, False))
+    assert [file.filename for file in writable] == ["shared.txt"]
+    assert [file.filename for file in denied] == ["mine.txt"]
@@ -0,0 +1,45 @@
+"""Search pages when the viewer may read only some of the files."""
+
+import pytest
+
+
+@pytest.fixture
+def metadata(workdir):
+    from module.metadata import UserMetadata
+
+    metadata = UserMetadata(str(workdir / "_meta.db"))
+    # owner 1 keeps every other file private
+    metadata.add_files([("/", f"f{i:02}.txt", i, False) for i in range(0, 20, 2)], 1, "alice", 740)
+    metadata.add_files([("/", f"f{i:02}.txt", i, False) for i in range(1, 20, 2)], 1, "alice", 744)
+    return metadata
+
+
+def search_all(metadata, viewer, limit):
+    pages, cursor = [], None
+
+    while True:
+        page = metadata.search_files(query="txt", viewer=viewer, cursor=cursor, limit=limit)
+        pages.append([file["name"] for file in page["files"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_pages_are_full_for_a_restricted_viewer(metadata):
+    from module.metadata import Viewer
+
+    pages = search_all(metadata, Viewer(2, set(), False), limit=3)
+
+    # unreadable files are left out by the query, not after the LIMIT
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    assert sorted(sum(pages, [])) == [f"f{i:02}.txt" for i in range(1, 20, 2)]
+
+
+def test_group_members_and_admins_page_through_everything_they_may_read(metadata):
+    from module.metadata import Viewer
+
+    for viewer in (Viewer(2, {"alice"}, False), Viewer(3, set(), True)):
+        pages = search_all(metadata, viewer, limit=7)
+
+        assert [len(page) for page in pages] == [7, 7, 6]
+        assert len(set(sum(pages, []))) == 20
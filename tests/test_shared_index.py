@@ -0,0 +1,80 @@
+"""The central index of files other users can read."""
+
+import pytest
+
+
+@pytest.fixture
+def shared(flask_app):
+    from module import shared_index
+    from module.util import db
+
+    db.create_all()
+    return shared_index
+
+
+def add_files(user, entries, permissions):
+    from module.metadata import UserMetadata
+    from module.util import get_metadb_path
+
+    metadata = UserMetadata(get_metadb_path(user))
+    metadata.add_files(entries, user.id, user.username, permissions)
+    return metadata
+
+
+def shared_names(shared, user, limit=50):
+    names, cursor = [], None
+
+    while True:
+        page = shared.list_shared_with(user, cursor=cursor, limit=limit)
+        names += [file["name"] for file in page["files"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return sorted(names)
+
+
+def test_files_are_shared_by_group_or_world_read(shared, make_user):
+    alice, bob, carol = make_user("alice"), make_user("bob", groups=["alice"]), make_user("carol")
+    add_files(alice, [("/", "private.txt", 1, False)], 700)
+    add_files(alice, [("/", "team.txt", 1, False)], 740)
+    add_files(alice, [("/", "world.txt", 1, False)], 704)
+    shared.rebuild_user(alice)
+
+    assert shared_names(shared, bob, limit=1) == ["team.txt", "world.txt"]
+    assert shared_names(shared, carol) == ["world.txt"]
+    assert shared_names(shared, alice) == []
+
+
+def test_hidden_and_disabled_owners_are_left_out(shared, make_user):
+    from module.auth import User
+    from module.util import db
+
+    alice, bob = make_user("alice"), make_user("bob")
+    admin = make_user("admin", admin=True)
+    add_files(alice, [("/", "world.txt", 1, False)], 704)
+    shared.rebuild_user(alice)
+
+    alice.set_flag(User.HIDDEN)
+    db.session.commit()
+    assert shared_names(shared, bob) == []
+    assert shared_names(shared, admin) == ["world.txt"]
+
+    alice.unset_flag(User.HIDDEN)
+    alice.enabled = False
+    db.session.commit()
+    assert shared_names(shared, bob) == []
+
+
+def test_sync_and_remove_follow_the_owners_changes(shared, make_user):
+    alice, bob = make_user("alice"), make_user("bob")
+    metadata = add_files(alice, [("/", "docs", 0, True), ("/docs", "a.txt", 1, False),
+                                 ("/docs", "b.txt", 1, False), ("/", "docs-x", 0, True)], 704)
+    shared.rebuild_user(alice)
+    a, b = metadata.get_file_ids("/docs", ["a.txt", "b.txt"])
+
+    metadata.set_file_perms(a, 700)
+    shared.sync_files(alice, [a, b])
+    assert shared_names(shared, bob) == ["b.txt", "docs", "docs-x"]
+
+    docs = metadata.get_file_by_id(metadata.get_file_ids("/", ["docs"])[0])
+    shared.remove_files(alice, [docs])
+    assert shared_names(shared, bob) == ["docs-x"]
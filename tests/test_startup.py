@@ -0,0 +1,31 @@
+"""Importing the app's modules must not pay for borg's archiver."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT
+
+pytest.importorskip("borg")
+
+CHECK = """
+import sys
+import borgapi
+from borgapi import CommandOptions, JobCancelled
+from module import datastore, jobs, util
+
+assert "borg.archiver" not in sys.modules, "borg.archiver was imported"
+assert util.borg_api._api is None, "the borg facade was built"
+"""
+
+
+def test_importing_the_views_leaves_borg_unloaded(workdir):
+    # a fresh interpreter, since other tests may have loaded the archiver already
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.join(ROOT, "app"), os.path.join(ROOT, "vend"), *sys.path]))
+    result = subprocess.run([sys.executable, "-c", CHECK], cwd=workdir, env=env,
+                            capture_output=True, text=True, timeout=120)
+
+    assert result.returncode == 0, result.stderr
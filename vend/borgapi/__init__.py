@@ -1,8 +1,15 @@
 """Interface for BorgBackup."""
 
+import importlib
+from typing import TYPE_CHECKING
+
 __all__ = [
     "BorgAPI",
     "BorgAPIAsync",
+    "BorgJob",
+    "JobCancelled",
+    "JobTimeout",
+    "WorkerCrashed",
     "CommonOptions",
     "ExclusionOptions",
     "ExclusionInput",
@@ -17,29 +24,91 @@ __all__ = [
     "Output",
     "Options",
     "OutputOptions",
+    "CaptureLimits",
+    "LineBuffer",
     "ListStringIO",
     "PersistantHandler",
     "BorgLogCapture",
     "OutputCapture",
+    "RepositorySession",
+    "SessionError",
+    "SessionPool",
 ]
 
-from .borgapi import BorgAPI as BorgAPI
-from .borgapi import BorgAPIAsync as BorgAPIAsync
-from .capture import BorgLogCapture as BorgLogCapture
-from .capture import ListStringIO as ListStringIO
-from .capture import OutputCapture as OutputCapture
-from .capture import OutputOptions as OutputOptions
-from .capture import PersistantHandler as PersistantHandler
-from .helpers import Json as Json
-from .helpers import Options as Options
-from .helpers import Output as Output
-from .options import ArchiveInput as ArchiveInput
-from .options import ArchiveOptions as ArchiveOptions
-from .options import ArchiveOutput as ArchiveOutput
-from .options import ArchivePattern as ArchivePattern
-from .options import CommandOptions as CommandOptions
-from .options import CommonOptions as CommonOptions
-from .options import ExclusionInput as ExclusionInput
-from .options import ExclusionOptions as ExclusionOptions
-from .options import ExclusionOutput as ExclusionOutput
-from .options import FilesystemOptions as FilesystemOptions
+# Exports are imported on first access: `borgapi.borgapi` pulls in borg's
+# archiver, which is slow to import and not needed for the exceptions or options.
+_EXPORTS = {
+    "BorgAPI": "borgapi",
+    "BorgAPIAsync": "borgapi",
+    "BorgLogCapture": "capture",
+    "CaptureLimits": "capture",
+    "LineBuffer": "capture",
+    "ListStringIO": "capture",
+    "OutputCapture": "capture",
+    "OutputOptions": "capture",
+    "PersistantHandler": "capture",
+    "BorgJob": "executor",
+    "JobCancelled": "executor",
+    "JobTimeout": "executor",
+    "WorkerCrashed": "executor",
+    "Json": "helpers",
+    "Options": "helpers",
+    "Output": "helpers",
+    "ArchiveInput": "options",
+    "ArchiveOptions": "options",
+    "ArchiveOutput": "options",
+    "ArchivePattern": "options",
+    "CommandOptions": "options",
+    "CommonOptions": "options",
+    "ExclusionInput": "options",
+    "ExclusionOptions": "options",
+    "ExclusionOutput": "options",
+    "FilesystemOptions": "options",
+    "RepositorySession": "session",
+    "SessionError": "session",
+    "SessionPool": "session",
+}
+
+if TYPE_CHECKING:
+    from .borgapi import BorgAPI as BorgAPI
+    from .borgapi import BorgAPIAsync as BorgAPIAsync
+    from .capture import BorgLogCapture as BorgLogCapture
+    from .capture import CaptureLimits as CaptureLimits
+    from .capture import LineBuffer as LineBuffer
+    from .capture import ListStringIO as ListStringIO
+    from .capture import OutputCapture as OutputCapture
+    from .capture import OutputOptions as OutputOptions
+    from .capture import PersistantHandler as PersistantHandler
+    from .executor import BorgJob as BorgJob
+    from .executor import JobCancelled as JobCancelled
+    from .executor import JobTimeout as JobTimeout
+    from .executor import WorkerCrashed as WorkerCrashed
+    from .helpers import Json as Json
+    from .helpers import Options as Options
+    from .helpers import Output as Output
+    from .options import ArchiveInput as ArchiveInput
+    from .options import ArchiveOptions as ArchiveOptions
+    from .options import ArchiveOutput as ArchiveOutput
+    from .options import ArchivePattern as ArchivePattern
+    from .options import CommandOptions as CommandOptions
+    from .options import CommonOptions as CommonOptions
+    from .options import ExclusionInput as ExclusionInput
+    from .options import ExclusionOptions as ExclusionOptions
+    from .options import ExclusionOutput as ExclusionOutput
+    from .options import FilesystemOptions as FilesystemOptions
+    from .session import RepositorySession as RepositorySession
+    from .session import SessionError as SessionError
+    from .session import SessionPool as SessionPool
+
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
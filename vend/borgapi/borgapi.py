@@ -1,19 +1,40 @@
 """Run Borg backups."""
 
+import argparse
+import contextvars
+import copy
 import functools
 import logging
 import os
+import queue
+import tempfile
+import threading
 from asyncio import wrap_future
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from io import StringIO
-from json import decoder, loads
-from typing import Callable, Optional, Union
+from json import decoder, dumps, loads
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Union
 
 import borg.archiver
-from dotenv import dotenv_values, load_dotenv
-
-from .capture import LOG_LVL, OutputCapture, OutputOptions
-from .helpers import ENVIRONMENT_DEFAULTS, Options, Output
+from borg.helpers import Location
+
+from .capture import (
+    LOG_LVL,
+    CaptureLimits,
+    OutputCapture,
+    OutputOptions,
+    discard_streams,
+    install_stream_proxies,
+    reset_discarded_streams,
+    reset_output_listener,
+    reset_raw_sink,
+    set_output_listener,
+    set_raw_sink,
+)
+from .executor import EXECUTORS, LOCAL_COMMANDS, BorgJob
+from .helpers import ENVIRONMENT_DEFAULTS, Json, Options, Output
 from .options import (
     ArchiveInput,
     ArchiveOutput,
@@ -26,9 +47,50 @@ from .options import (
     FilesystemOptions,
     OptionsBase,
 )
+from .session import RepositorySession, SessionPool, _active_session
 
 __all__ = ["BorgAPI", "BorgAPIAsync"]
 
+# end of a streamed command's output
+_STREAM_END = object()
+
+
+class _StreamClosed(Exception):
+    """Raised inside borg's writes to stop it once the consumer stops iterating."""
+
+
+class _ChunkWriter:
+    """Binary file object handing what is written to `put` in pieces of at most `chunk_size`."""
+
+    def __init__(self, put: Callable[[bytes], None], chunk_size: int):
+        self.put = put
+        self.chunk_size = chunk_size
+
+    def write(self, data) -> int:
+        view = memoryview(data)
+        for start in range(0, len(view), self.chunk_size):
+            self.put(bytes(view[start : start + self.chunk_size]))
+        return len(view)
+
+    def flush(self):
+        pass
+
+
+def _with_discard(method: Callable) -> Callable:
+    """Give a command the `discard` option, naming output streams it should not keep."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, discard: Iterable[str] = (), **options):
+        if not discard:
+            return method(self, *args, **options)
+        token = discard_streams(*discard)
+        try:
+            return method(self, *args, **options)
+        finally:
+            reset_discarded_streams(token)
+
+    return wrapper
+
 
 class BorgAPIBase:
     """Automate borg in code.
@@ -37,6 +99,11 @@ class BorgAPIBase:
     Should not be called by itself. Only really here for readability purposes.
     """
 
+    # Borg functions whose parsed arguments are reused for identical argv: read-only
+    # commands, where argparse does no time dependent expansion like "{now}".
+    ARGS_CACHE_COMMANDS = {"do_info", "do_list", "do_diff"}
+    ARGS_CACHE_SIZE = 256
+
     def __init__(
         self,
         defaults: dict = None,
@@ -44,6 +111,11 @@ class BorgAPIBase:
         log_level: str = LOG_LVL,
         log_json: bool = False,
         environ: dict = None,
+        executor: str = "inprocess",
+        workers: int = 2,
+        timeout: Optional[float] = None,
+        capture_limits: Optional[CaptureLimits] = None,
+        session_idle_timeout: float = 0,
     ):
         """Set the options to be used across the different command call.
 
@@ -58,10 +130,36 @@ class BorgAPIBase:
         :param environ: envirnmental variables to set for borg to use (ie BORG_PASSCOMMAND),
             defaults to None
         :type environ: dict, optional
+        :param executor: where commands run, "inprocess" or "pool" for a pool of
+            worker processes, defaults to "inprocess"
+        :type executor: str, optional
+        :param workers: number of threads or worker processes for the executor, defaults to 2
+        :type workers: int, optional
+        :param timeout: default seconds a submitted command may run, defaults to None
+        :type timeout: Optional[float], optional
+        :param capture_limits: how much of each output stream a command holds in memory
+            before spilling or dropping the oldest lines, defaults to None for no limit
+        :type capture_limits: Optional[CaptureLimits], optional
+        :param session_idle_timeout: seconds a repository session stays open unused,
+            holding the repository lock, defaults to 0 to close it when its block ends
+        :type session_idle_timeout: float, optional
         """
+        self.init_kwargs = {
+            "defaults": defaults,
+            "options": options,
+            "log_level": log_level,
+            "log_json": log_json,
+            "environ": environ,
+            "capture_limits": capture_limits,
+            "session_idle_timeout": session_idle_timeout,
+        }
+        self.capture_limits = capture_limits
         self.options = options or {}
         self.optionals = CommandOptions(defaults)
-        self.archiver = borg.archiver.Archiver()
+        self._archivers = threading.local()
+        self._args_cache = OrderedDict()
+        self._args_lock = threading.Lock()
+        self.sessions = SessionPool(session_idle_timeout)
         self._previous_dotenv = []
         self._set_environ_defaults()
         if environ is not None:
@@ -70,12 +168,32 @@ class BorgAPIBase:
         if log_json:
             self.options.set("log_json", log_json)
 
-        self.archiver.log_json = log_json
+        self._log_json = log_json
+        # proxies go in before borg builds its stream handlers so they pick them up
+        install_stream_proxies()
         borg.archiver.setup_logging(level=self.log_level, is_serve=False, json=log_json)
         logging.getLogger("borgapi")
         self._logger = logging.getLogger(__name__)
 
-        self.output = OutputCapture()
+        try:
+            self.executor = EXECUTORS[executor](self, workers, timeout)
+        except KeyError as e:
+            raise ValueError(
+                f"Unknown executor `{executor}`, expected one of {', '.join(EXECUTORS)}"
+            ) from e
+
+    @property
+    def archiver(self) -> borg.archiver.Archiver:
+        """Borg archiver for the calling thread.
+
+        The archiver keeps per-command state on itself, so each thread gets its own.
+        """
+        archiver = getattr(self._archivers, "archiver", None)
+        if archiver is None:
+            archiver = borg.archiver.Archiver()
+            archiver.log_json = self._log_json
+            self._archivers.archiver = archiver
+        return archiver
 
     @staticmethod
     def _loads_json_lines(string: Union[str, list]) -> Union[dict, str, None]:
@@ -123,25 +241,121 @@ class BorgAPIBase:
         self._logger.debug("%s: %s", func.__name__, arg_list)
         arg_list.insert(0, "borgapi")
         arg_list = [str(arg) for arg in arg_list]
-        args = self.archiver.get_args(arg_list, os.getenv("SSH_ORIGINAL_COMMAND", None))
+        args = self._get_args(arg_list, func)
+        func = self._session_func(args, func)
 
         prev_json = self.archiver.log_json
         log_json = getattr(args, "log_json", prev_json)
         self.archiver.log_json = log_json
 
-        with self.output(output_options):
+        capture = OutputCapture(self.capture_limits)
+        with capture(output_options):
             try:
                 func(args)
             except Exception as e:
                 self._logger.error(e)
                 raise e
             else:
-                capture_result = self.output.getvalues()
+                capture_result = capture.getvalues()
 
         self.archiver.log_json = prev_json
 
         return capture_result
 
+    def _session_func(self, args: argparse.Namespace, func: Callable) -> Callable:
+        location = getattr(args, "location", None)
+        if not self.sessions.sessions or location is None or not getattr(location, "valid", True):
+            return func
+        session = _active_session.get()
+        if session is not None and session.matches(location):
+            return session.bind(self.archiver, func)
+        # an idle session would hold the lock this command is about to take
+        self.sessions.evict(location.canonical_path())
+        return func
+
+    def _evict_session_for(self, repository_or_archive):
+        if not self.sessions.sessions:
+            return
+        try:
+            self.sessions.evict(Location(str(repository_or_archive)).canonical_path())
+        except Exception:
+            pass
+
+    @contextmanager
+    def session(
+        self, repository: str, exclusive: bool = False, lock_wait: int = 1
+    ) -> Iterator[RepositorySession]:
+        """Keep `repository` open for the commands run inside the `with` block.
+
+        The lock, key, manifest and chunks cache are set up once and reused by
+        every command on that repository in the calling thread or task. With a
+        `session_idle_timeout` above 0 the session stays open that many seconds
+        after the block, so the next block on the same repository skips the
+        setup too. It keeps the repository lock meanwhile: commands from this
+        api close an idle session first, but other processes have to wait.
+
+        :param repository: repository location
+        :type repository: str
+        :param exclusive: hold the write lock so a batch of writes can run, defaults to False
+        :type exclusive: bool, optional
+        :param lock_wait: seconds to wait for the repository lock, defaults to 1
+        :type lock_wait: int, optional
+        :return: the open session
+        :rtype: Iterator[RepositorySession]
+        """
+        session = self.sessions.acquire(repository, exclusive, lock_wait)
+        token = _active_session.set(session)
+        try:
+            yield session
+        finally:
+            _active_session.reset(token)
+            self.sessions.release(session)
+
+    def _get_args(self, arg_list: list, func: Callable) -> argparse.Namespace:
+        """Parse `arg_list` with borg's argparse tree, reusing earlier parses when safe.
+
+        Building and running borg's parser costs far more than the commands that
+        only read a little repository metadata, so the namespace of a repeated
+        read-only command is copied from the cache instead.
+        """
+        ssh_command = os.getenv("SSH_ORIGINAL_COMMAND", None)
+        if (
+            getattr(func, "__name__", None) not in self.ARGS_CACHE_COMMANDS
+            or ssh_command is not None
+            or any("{" in arg for arg in arg_list)
+        ):
+            return self.archiver.get_args(arg_list, ssh_command)
+
+        # BORG_REPO fills in a missing repository location while parsing
+        key = (tuple(arg_list), os.getenv("BORG_REPO"))
+        with self._args_lock:
+            cached = self._args_cache.get(key)
+            if cached is not None:
+                self._args_cache.move_to_end(key)
+
+        if cached is None:
+            cached = self.archiver.get_args(arg_list, None)
+            with self._args_lock:
+                self._args_cache[key] = cached
+                if len(self._args_cache) > self.ARGS_CACHE_SIZE:
+                    self._args_cache.popitem(last=False)
+
+        return self._copy_args(cached)
+
+    def _copy_args(self, cached: argparse.Namespace) -> argparse.Namespace:
+        # borg may fill in the containers while running, the rest is read-only
+        args = argparse.Namespace(
+            **{
+                name: copy.deepcopy(value) if isinstance(value, (list, dict, set)) else value
+                for name, value in vars(cached).items()
+            }
+        )
+        # rebind the subcommand to this thread's archiver
+        func = getattr(cached, "func", None)
+        if getattr(func, "__self__", None) is not None:
+            args.func = getattr(self.archiver, func.__name__)
+        return args
+
     def _get_option(self, value: dict, options_class: OptionsBase) -> OptionsBase:
         args = {**self.options, **(value or {})}
         return options_class(**args)
@@ -207,6 +421,41 @@ class BorgAPIBase:
 class BorgAPI(BorgAPIBase):
     """Automate borg in code."""
 
+    CMDS = [
+        "set_environ",
+        "unset_environ",
+        "init",
+        "create",
+        "extract",
+        "check",
+        "rename",
+        "list",
+        "diff",
+        "delete",
+        "prune",
+        "compact",
+        "info",
+        "mount",
+        "umount",
+        "key_change_passphrase",
+        "key_export",
+        "key_import",
+        "upgrade",
+        "recreate",
+        "import_tar",
+        "export_tar",
+        "serve",
+        "config",
+        "with_lock",
+        "break_lock",
+        "benchmark_crud",
+    ]
+
+    # parsed items `iter_list` and `iter_diff` hold before borg has to wait
+    STREAM_BUFFER = 1024
+    # content chunks `iter_extract` holds before borg has to wait
+    RAW_STREAM_BUFFER = 16
+
     def __init__(
         self,
         defaults: dict = None,
@@ -214,6 +463,11 @@ class BorgAPI(BorgAPIBase):
         log_level: str = LOG_LVL,
         log_json: bool = False,
         environ: dict = None,
+        executor: str = "inprocess",
+        workers: int = 2,
+        timeout: Optional[float] = None,
+        capture_limits: Optional[CaptureLimits] = None,
+        session_idle_timeout: float = 0,
     ):
         """Set the options to be used across the different command call.
 
@@ -225,8 +479,365 @@ class BorgAPI(BorgAPIBase):
         :type log_level: str, optional
         :param log_json: if the output should be in json or string format, defaults to False
         :type log_json: bool, optional
+        :param executor: where commands run, "inprocess" or "pool", defaults to "inprocess"
+        :type executor: str, optional
+        :param workers: number of threads or worker processes for the executor, defaults to 2
+        :type workers: int, optional
+        :param timeout: default seconds a submitted command may run, defaults to None
+        :type timeout: Optional[float], optional
+        :param capture_limits: how much of each output stream a command holds in memory
+            before spilling or dropping the oldest lines, defaults to None for no limit
+        :type capture_limits: Optional[CaptureLimits], optional
+        :param session_idle_timeout: seconds a repository session stays open unused,
+            holding the repository lock, defaults to 0 to close it when its block ends
+        :type session_idle_timeout: float, optional
+        """
+        super().__init__(
+            defaults,
+            options,
+            log_level,
+            log_json,
+            environ,
+            executor,
+            workers,
+            timeout,
+            capture_limits,
+            session_idle_timeout,
+        )
+
+        if executor != "inprocess":
+            for cmd in self.CMDS:
+                if cmd not in LOCAL_COMMANDS:
+                    setattr(self, cmd, self._dispatch(cmd))
+
+    def _dispatch(self, command: str) -> Callable:
+        """Route `command` through the executor, keeping the synchronous signature."""
+
+        @functools.wraps(getattr(type(self), command))
+        def wrapper(*args, **options):
+            # sessions live in this process, so their commands cannot go to a worker
+            if _active_session.get() is not None:
+                return getattr(type(self), command)(self, *args, **options)
+            if args:
+                self._evict_session_for(args[0])
+            return self.executor.run(command, args, options)
+
+        return wrapper
+
+    def submit(
+        self,
+        command: str,
+        *args: Union[str, int],
+        on_output: Optional[Callable[[str, str], None]] = None,
+        timeout: Optional[float] = None,
+        cwd: Optional[str] = None,
+        isolated: bool = False,
+        **options: Options,
+    ) -> BorgJob:
+        """Start a command without waiting for it.
+
+        :param command: name of the method to run, eg "create"
+        :type command: str
+        :param *args: positional arguments of the method
+        :type *args: Union[str, int]
+        :param on_output: called with (stream, text) while the command runs, defaults to None
+        :type on_output: Optional[Callable[[str, str], None]], optional
+        :param timeout: seconds the command may run, defaults to the executor timeout
+        :type timeout: Optional[float], optional
+        :param cwd: working directory of the command, such as where `extract` writes,
+            defaults to None; it is set inside a worker process and never in the caller
+        :type cwd: Optional[str], optional
+        :param isolated: run the command in a worker process even with the in-process
+            executor, so it can be cancelled or timed out while it runs, defaults to False
+        :type isolated: bool, optional
+        :param **options: keyword arguments of the method
+        :type **options: Options
+        :return: job handle to wait on, cancel or read the result from
+        :rtype: BorgJob
+        """
+        if command not in self.CMDS or command in LOCAL_COMMANDS:
+            raise ValueError(f"Command `{command}` cannot be submitted")
+        if args:
+            self._evict_session_for(args[0])
+        return self.executor.submit(
+            command, args, options, on_output=on_output, timeout=timeout, cwd=cwd, isolated=isolated
+        )
+
+    def _stream_command(
+        self, command: str, args: tuple, options: dict, maxsize: int, route: Callable
+    ) -> Iterator:
+        """Run `command` on a background thread and yield what its output is turned into.
+
+        `route(put)` returns a context manager that, while the command runs on
+        that thread, sends its output to `put` one item at a time. At most
+        `maxsize` items are held at once: when the consumer falls behind, borg
+        blocks on its next write. Closing the generator early stops borg at its
+        next write.
+        """
+        items = queue.Queue(maxsize=maxsize)
+        stopped = threading.Event()
+        failure = []
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    items.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+            raise _StreamClosed()
+
+        def run():
+            try:
+                with route(put):
+                    # call the class method so the command runs here, not in the executor
+                    getattr(BorgAPI, command)(self, *args, **options)
+            except _StreamClosed:
+                pass
+            except BaseException as e:
+                failure.append(e)
+            finally:
+                try:
+                    put(_STREAM_END)
+                except _StreamClosed:
+                    pass
+
+        threading.Thread(target=run, name=f"borgapi-stream-{command}", daemon=True).start()
+
+        try:
+            while True:
+                item = items.get()
+                if item is _STREAM_END:
+                    break
+                yield item
+        finally:
+            stopped.set()
+
+        if failure:
+            raise failure[0]
+
+    def _iter_json_lines(self, command: str, args: tuple, options: dict) -> Iterator[Json]:
+        """Run `command` on a background thread and yield each json line of stdout.
+
+        At most `STREAM_BUFFER` parsed items are held at once.
+        """
+
+        @contextmanager
+        def route(put):
+            pending = []
+
+            def listener(stream: str, text: str):
+                if stream != "stdout":
+                    return
+                if "\n" not in text:
+                    pending.append(text)
+                    return
+                *lines, rest = ("".join(pending) + text).split("\n")
+                pending[:] = [rest] if rest else []
+                for line in lines:
+                    if line.strip():
+                        put(loads(line))
+
+            listener_token = set_output_listener(listener)
+            discard_token = discard_streams("stdout")
+            try:
+                yield
+                if "".join(pending).strip():
+                    put(loads("".join(pending)))
+            finally:
+                reset_discarded_streams(discard_token)
+                reset_output_listener(listener_token)
+
+        return self._stream_command(command, args, options, self.STREAM_BUFFER, route)
+
+    def _iter_raw(self, command: str, args: tuple, options: dict, chunk_size: int) -> Iterator[bytes]:
+        """Run `command` on a background thread and yield its raw stdout in `chunk_size` pieces.
+
+        At most `RAW_STREAM_BUFFER` pieces are held at once.
+        """
+
+        @contextmanager
+        def route(put):
+            token = set_raw_sink(_ChunkWriter(put, chunk_size))
+            try:
+                yield
+            finally:
+                reset_raw_sink(token)
+
+        return self._stream_command(command, args, options, self.RAW_STREAM_BUFFER, route)
+
+    def iter_list(
+        self,
+        repository_or_archive: str,
+        *paths: Optional[str],
+        **options: Options,
+    ) -> Iterator[Json]:
+        """Yield the contents of a repository or an archive as borg lists them.
+
+        Same arguments as :meth:`list`; `json_lines` is always set. Items are
+        parsed one by one as borg writes them, so the first one is available
+        right away and memory stays bounded however large the archive is.
+
+        :param repository_or_archive: repository or archive to list contents of
+        :type repository_or_archive: str
+        :param *paths: paths to list; patterns are supported
+        :type *paths: Optional[str]
+        :param **options: optional arguments of :meth:`list`; defaults to {}
+        :type **options: Options
+        :return: generator of archive items, or archives when listing a repository
+        :rtype: Iterator[Json]
+        """
+        options = {**options, "json_lines": True}
+        options.pop("json", None)
+        return self._iter_json_lines("list", (repository_or_archive, *paths), options)
+
+    def iter_diff(
+        self,
+        repo_archive_1: str,
+        archive_2: str,
+        *paths: Optional[str],
+        **options: Options,
+    ) -> Iterator[Json]:
+        """Yield the differences between two archives as borg finds them.
+
+        Same arguments as :meth:`diff`; `json_lines` is always set.
+
+        :param repo_archive_1: repository location and ARCHIVE1 name
+        :type repo_archive_1: str
+        :param archive_2: ARCHIVE2 name (no repository location allowed)
+        :type archive_2: str
+        :param *paths: paths of items inside the archives to compare; patterns are supported
+        :type *paths: Optional[str]
+        :param **options: optional arguments of :meth:`diff`; defaults to {}
+        :type **options: Options
+        :return: generator of changed items
+        :rtype: Iterator[Json]
+        """
+        options = {**options, "json_lines": True}
+        return self._iter_json_lines("diff", (repo_archive_1, archive_2, *paths), options)
+
+    def extract_to(
+        self,
+        archive: str,
+        fileobj: BinaryIO,
+        *paths: Optional[str],
+        **options: Options,
+    ) -> Output:
+        """Extract archive content to `fileobj` as borg reads it, without holding it in memory.
+
+        Same arguments as :meth:`extract`; `stdout` is always set. Runs in the
+        calling thread, whatever the executor, since `fileobj` cannot be sent
+        to another process.
+
+        :param archive: archive to extract
+        :type archive: str
+        :param fileobj: binary file object the content is written to
+        :type fileobj: BinaryIO
+        :param *paths: paths to extract; patterns are supported
+        :type *paths: Optional[str]
+        :param **options: optional arguments of :meth:`extract`; defaults to {}
+        :type **options: Options
+        :return: what :meth:`extract` returns besides the content
+        :rtype: Output
+        """
+        token = set_raw_sink(fileobj)
+        try:
+            return BorgAPI.extract(self, archive, *paths, **{**options, "stdout": True})
+        finally:
+            reset_raw_sink(token)
+
+    def iter_extract(
+        self,
+        archive: str,
+        *paths: Optional[str],
+        chunk_size: int = 64 * 1024,
+        **options: Options,
+    ) -> Iterator[bytes]:
+        """Yield archive content in chunks as borg extracts it.
+
+        Same arguments as :meth:`extract`; `stdout` is always set. Borg runs on
+        a background thread and blocks once `RAW_STREAM_BUFFER` chunks wait to
+        be consumed, so memory stays bounded however large the files are.
+
+        :param archive: archive to extract
+        :type archive: str
+        :param *paths: paths to extract; patterns are supported
+        :type *paths: Optional[str]
+        :param chunk_size: largest piece yielded, in bytes, defaults to 64 KiB
+        :type chunk_size: int, optional
+        :param **options: optional arguments of :meth:`extract`; defaults to {}
+        :type **options: Options
+        :return: generator of content chunks
+        :rtype: Iterator[bytes]
+        """
+        options = {**options, "stdout": True}
+        return self._iter_raw("extract", (archive, *paths), options, chunk_size)
+
+    def iter_export_tar(
+        self,
+        archive: str,
+        *paths: Optional[str],
+        chunk_size: int = 64 * 1024,
+        **options: Options,
+    ) -> Iterator[bytes]:
+        """Yield a tarball of the archive in chunks as borg writes it.
+
+        Same arguments as :meth:`export_tar`, with the tarball always written
+        to stdout. `tar_filter` cannot be used, since the filter program needs
+        a real stdout to write to; compress the chunks instead. Memory stays
+        bounded like with :meth:`iter_extract`.
+
+        :param archive: archive to export
+        :type archive: str
+        :param *paths: paths of items inside the archive to export; patterns are supported
+        :type *paths: Optional[str]
+        :param chunk_size: largest piece yielded, in bytes, defaults to 64 KiB
+        :type chunk_size: int, optional
+        :param **options: optional arguments of :meth:`export_tar`; defaults to {}
+        :type **options: Options
+        :raises ValueError: `tar_filter` was given
+        :return: generator of tarball chunks
+        :rtype: Iterator[bytes]
         """
-        super().__init__(defaults, options, log_level, log_json, environ)
+        if options.get("tar_filter"):
+            raise ValueError("tar_filter needs a real stdout, compress the chunks instead")
+        return self._iter_raw("export_tar", (archive, "-", *paths), options, chunk_size)
+
+    def iter_items(self, archive: str, lock_wait: int = 1) -> Iterator[Json]:
+        """Yield every item of `archive` with a digest of its chunk ids.
+
+        Unlike :meth:`iter_list`, this reads the archive metadata directly on a
+        read session of its own, so the chunk ids borg keeps per file are
+        available: items with equal `chunk_digest` have equal content. No
+        file data is read.
+
+        The whole item list is spooled to a temporary file in one pass and the
+        repository lock is released before the first item is yielded, so a
+        slow consumer never keeps other commands, such as a create, from the
+        repository. Items are then read back one at a time, so memory stays
+        flat however many the archive holds.
+
+        :param archive: archive to read, as `repository::archive`
+        :type archive: str
+        :param lock_wait: seconds to wait for the repository lock, defaults to 1
+        :type lock_wait: int, optional
+        :return: generator of dicts with path, type, mode, size, mtime and chunk_digest
+        :rtype: Iterator[Json]
+        """
+        location = Location(archive)
+        if not location.archive:
+            raise ValueError(f"{archive} does not name an archive")
+        self._evict_session_for(archive)
+        with tempfile.TemporaryFile("w+", encoding="utf-8") as spool:
+            session = RepositorySession(archive, lock_wait=lock_wait)
+            try:
+                for item in session.iter_items(location.archive):
+                    spool.write(dumps(item) + "\n")
+            finally:
+                session.close()
+            spool.seek(0)
+            for line in spool:
+                yield loads(line)
 
     def set_environ(
         self,
@@ -245,6 +856,9 @@ class BorgAPI(BorgAPIBase):
         :param **kwargs: Environment variables and their values as named args
         :type **kwargs: Options
         """
+        # only needed here, so importing borgapi does not pay for it
+        from dotenv import dotenv_values, load_dotenv
+
         variables = {}
         if filename:
             self._logger.debug("Loading environment variables from %s", filename)
@@ -419,7 +1033,7 @@ class BorgAPI(BorgAPIBase):
         )
 
         result_list = self._get_basic_results(output, opts)
-        if opts.raw_bytes:
+        if opts.raw_bytes and output["stdout"] is not None:
             result_list.append(("extract", output["stdout"]))
 
         return self._build_result(*result_list, log_json=opts.log_json)
@@ -1124,7 +1738,7 @@ class BorgAPI(BorgAPIBase):
         )
 
         result_list = self._get_basic_results(output, opts)
-        if opts.raw_bytes:
+        if opts.raw_bytes and output["stdout"] is not None:
             result_list.append(("tar", output["stdout"]))
 
         return self._build_result(*result_list, log_json=opts.log_json)
@@ -1327,39 +1941,17 @@ class BorgAPI(BorgAPIBase):
         return self._build_result(*result_list, log_json=opts.log_json)
 
 
+# Wrapped on the class so executors and pool workers, which call the class
+# methods, honour `discard` too. Streams are any of "stdout", "stderr",
+# "list", "stats" and "repo"; a discarded stream still reaches output listeners.
+for _cmd in BorgAPI.CMDS:
+    if _cmd not in LOCAL_COMMANDS:
+        setattr(BorgAPI, _cmd, _with_discard(getattr(BorgAPI, _cmd)))
+
+
 class BorgAPIAsync(BorgAPI):
     """Async version of the :class:`BorgAPI`."""
 
-    CMDS = [
-        "set_environ",
-        "unset_environ",
-        "init",
-        "create",
-        "extract",
-        "check",
-        "rename",
-        "list",
-        "diff",
-        "delete",
-        "prune",
-        "compact",
-        "info",
-        "mount",
-        "umount",
-        "key_change_passphrase",
-        "key_export",
-        "key_import",
-        "upgrade",
-        "recreate",
-        "import_tar",
-        "export_tar",
-        "serve",
-        "config",
-        "with_lock",
-        "break_lock",
-        "benchmark_crud",
-    ]
-
     def __init__(self, *args, **kwargs):
         """Turn the commands in `:class:`BorgAPI` into async methods.
 
@@ -1368,7 +1960,8 @@ class BorgAPIAsync(BorgAPI):
         super().__init__(*args, **kwargs)
 
         for cmd in self.CMDS:
-            synced = getattr(super(), cmd)
+            # instance attribute first, so commands routed to an executor stay routed
+            synced = getattr(self, cmd)
             wrapped = self._force_async(synced)
             setattr(self, cmd, wrapped)
 
@@ -1379,7 +1972,8 @@ class BorgAPIAsync(BorgAPI):
 
         @functools.wraps(fn)
         def wrapper(*args, **kwargs):
-            future = self.pool.submit(fn, *args, **kwargs)
+            # run in the caller's context so an active session follows the command
+            future = self.pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
             return wrap_future(future)  # make it awaitable
 
         return wrapper
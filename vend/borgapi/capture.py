@@ -1,11 +1,17 @@
 """Save Borg output to review after command call."""
 
+import json
 import logging
 import sys
+import tempfile
+import threading
+from array import array
+from collections import deque
+from contextvars import ContextVar
 from dataclasses import dataclass
 from io import BytesIO, StringIO, TextIOWrapper
 from types import TracebackType
-from typing import Optional, Union
+from typing import BinaryIO, Callable, Iterator, Optional, Union
 
 try:
     from typing import Self
@@ -19,10 +25,154 @@ from borg.logger import JsonFormatter
 
 from .helpers import Json
 
-__all__ = ["OutputOptions", "ListStringIO", "PersistantHandler", "BorgLogCapture", "OutputCapture"]
+__all__ = [
+    "OutputOptions",
+    "CaptureLimits",
+    "LineBuffer",
+    "ListStringIO",
+    "PersistantHandler",
+    "BorgLogCapture",
+    "OutputCapture",
+]
 
 LOG_LVL = "warning"
 
+# Capture active in the current thread or task, None when output should go
+# to the real streams. Each thread starts with its own empty context, so
+# concurrent commands never see each other's capture.
+_active_capture: ContextVar[Optional["OutputCapture"]] = ContextVar(
+    "borgapi_active_capture", default=None
+)
+_proxy_lock = threading.Lock()
+
+# Callback receiving (stream, text) as output is captured, used by executors
+# to stream output out of a running command.
+_output_listener: ContextVar[Optional[Callable[[str, str], None]]] = ContextVar(
+    "borgapi_output_listener", default=None
+)
+
+
+def set_output_listener(listener: Optional[Callable[[str, str], None]]):
+    """Send output captured in the current context to `listener` as it is written.
+
+    :param listener: called with the stream name and the text written
+    :type listener: Optional[Callable[[str, str], None]]
+    :return: token to pass to :func:`reset_output_listener`
+    """
+    return _output_listener.set(listener)
+
+
+def reset_output_listener(token):
+    """Restore the listener that was active before :func:`set_output_listener`."""
+    _output_listener.reset(token)
+
+
+# Streams ("stdout", "stderr") whose text only goes to the listener and is
+# not kept for the command's return value.
+_discarded_streams: ContextVar[frozenset] = ContextVar(
+    "borgapi_discarded_streams", default=frozenset()
+)
+
+
+def discard_streams(*streams: str):
+    """Stop keeping the text of `streams` for commands run in the current context.
+
+    The output listener still sees it, which lets a consumer process output
+    as it is written without the capture holding all of it in memory.
+
+    :param *streams: names of the streams to drop, any of "stdout", "stderr",
+        "list", "stats" and "repo"; added to the ones already dropped
+    :type *streams: str
+    :return: token to pass to :func:`reset_discarded_streams`
+    """
+    return _discarded_streams.set(_discarded_streams.get() | frozenset(streams))
+
+
+def reset_discarded_streams(token):
+    """Restore the streams kept before :func:`discard_streams`."""
+    _discarded_streams.reset(token)
+
+
+# Binary file object that raw stdout (`extract --stdout`, `export-tar -`) is
+# written to as borg produces it, instead of being collected in memory.
+_raw_sink: ContextVar[Optional[BinaryIO]] = ContextVar("borgapi_raw_sink", default=None)
+
+
+def set_raw_sink(fileobj: Optional[BinaryIO]):
+    """Send raw stdout of commands run in the current context to `fileobj`.
+
+    :param fileobj: binary file object with a `write` method
+    :type fileobj: Optional[BinaryIO]
+    :return: token to pass to :func:`reset_raw_sink`
+    """
+    return _raw_sink.set(fileobj)
+
+
+def reset_raw_sink(token):
+    """Restore the raw stdout target that was active before :func:`set_raw_sink`."""
+    _raw_sink.reset(token)
+
+
+class _RawStdout:
+    """Stdout stand-in whose `buffer` is a caller's binary file object."""
+
+    def __init__(self, sink: BinaryIO):
+        self.buffer = sink
+
+    def write(self, s: str) -> int:
+        self.buffer.write(s.encode())
+        return len(s)
+
+    def flush(self):
+        flush = getattr(self.buffer, "flush", None)
+        if flush is not None:
+            flush()
+
+
+class _StreamProxy:
+    """Stand-in for `sys.stdout`/`sys.stderr` that writes to the calling context's capture."""
+
+    def __init__(self, name: str, original):
+        """Wrap the real stream.
+
+        :param name: which stream this replaces, "stdout" or "stderr"
+        :type name: str
+        :param original: stream to write to when no capture is active
+        :type original: TextIO
+        """
+        self._name = name
+        self._original = original
+
+    def _target(self):
+        capture = _active_capture.get()
+        if capture is None:
+            return self._original
+        return capture._stdout if self._name == "stdout" else capture._stderr
+
+    def write(self, s):
+        """Write to the active capture's stream, or the real one."""
+        return self._target().write(s)
+
+    def flush(self):
+        """Flush the active capture's stream, or the real one."""
+        return self._target().flush()
+
+    def __getattr__(self, name):
+        """Forward everything else (buffer, isatty, encoding...) to the current target."""
+        return getattr(self._target(), name)
+
+
+def install_stream_proxies():
+    """Replace `sys.stdout` and `sys.stderr` with context aware proxies, once per process.
+
+    Output written outside of a capture still reaches the original streams.
+    """
+    with _proxy_lock:
+        if not isinstance(sys.stdout, _StreamProxy):
+            sys.stdout = _StreamProxy("stdout", sys.stdout)
+        if not isinstance(sys.stderr, _StreamProxy):
+            sys.stderr = _StreamProxy("stderr", sys.stderr)
+
 
 @dataclass
 class OutputOptions:
@@ -41,20 +191,149 @@ class OutputOptions:
     prog_json: bool = False
 
 
+@dataclass
+class CaptureLimits:
+    """How much of each captured stream is held in memory.
+
+    :param max_lines: lines kept in memory per stream, None for no limit
+    :type max_lines: Optional[int]
+    :param max_bytes: characters kept in memory per stream, None for no limit
+    :type max_bytes: Optional[int]
+    :param overflow: what happens to the oldest lines past a limit, "spill" to
+        write them to a temporary file or "ring" to drop them
+    :type overflow: str
+    """
+
+    max_lines: Optional[int] = None
+    max_bytes: Optional[int] = None
+    overflow: str = "spill"
+
+    def __post_init__(self):
+        """Reject unknown overflow modes."""
+        if self.overflow not in ("spill", "ring"):
+            raise ValueError(f'Unknown overflow `{self.overflow}`, expected "spill" or "ring"')
+
+
+class LineBuffer:
+    """Append-only sequence of captured lines with bounded memory.
+
+    Appends are O(1). Once the in-memory lines pass the limits, the oldest
+    ones are spilled to a temporary file or dropped, depending on the
+    overflow mode. The newest line always stays in memory.
+    """
+
+    def __init__(self, limits: Optional[CaptureLimits] = None):
+        """Create an empty buffer.
+
+        :param limits: memory limits, defaults to None for unlimited
+        :type limits: Optional[CaptureLimits], optional
+        """
+        self.limits = limits or CaptureLimits()
+        self.lines = deque()
+        self.size = 0
+        # index of self.lines[0]; lines before it were spilled or dropped
+        self.offset = 0
+        self.dropped = 0
+        self._file = None
+        self._positions = array("Q")
+
+    def __len__(self) -> int:
+        """Count every line appended, including spilled and dropped ones."""
+        return self.offset + len(self.lines)
+
+    @property
+    def first(self) -> int:
+        """Index of the oldest line still available."""
+        return self.dropped
+
+    def _over(self) -> bool:
+        limits = self.limits
+        return (limits.max_lines is not None and len(self.lines) > limits.max_lines) or (
+            limits.max_bytes is not None and self.size > limits.max_bytes
+        )
+
+    def append(self, line: str):
+        """Add a line at the end.
+
+        :param line: line to add
+        :type line: str
+        """
+        self.lines.append(line)
+        self.size += len(line)
+        while len(self.lines) > 1 and self._over():
+            old = self.lines.popleft()
+            self.size -= len(old)
+            self.offset += 1
+            if self.limits.overflow == "spill":
+                self._spill(old)
+            else:
+                self.dropped += 1
+
+    def _spill(self, line: str):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        self._file.seek(0, 2)
+        self._positions.append(self._file.tell())
+        self._file.write(json.dumps(line).encode() + b"\n")
+
+    def __getitem__(self, index: int) -> str:
+        """Get the line at `index`, reading it back from disk if it was spilled.
+
+        :raises IndexError: the line was dropped or does not exist
+        """
+        if index < self.first or index >= len(self):
+            raise IndexError(index)
+        if index >= self.offset:
+            return self.lines[index - self.offset]
+        self._file.seek(self._positions[index])
+        return json.loads(self._file.readline())
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over every available line, oldest first."""
+        if self._file is not None and self.offset > self.dropped:
+            self._file.seek(0)
+            for _ in range(self.offset - self.dropped):
+                yield json.loads(self._file.readline())
+        yield from list(self.lines)
+
+    def close(self):
+        """Delete the spill file, if any."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
 class ListStringIO(StringIO):
     """Save TextIO to a list of single lines."""
 
-    def __init__(self, initial_value="", newline="\n"):
+    def __init__(
+        self,
+        initial_value="",
+        newline="\n",
+        listener: Callable[[str], None] = None,
+        keep: bool = True,
+        limits: Optional[CaptureLimits] = None,
+    ):
         r"""Wrap StringIO to gobble written data and save to a list.
 
         :param initial_value: Initial value of buffer, passed to StringIO, defaults to ''
         :type initial_value: str, optional
         :param newline: What character to use for newlines, passed to StringIO, defaults to '\\n'
         :type newline: str, optional
+        :param listener: called with every chunk written, defaults to None
+        :type listener: Callable[[str], None], optional
+        :param keep: save written data, False to only pass it to `listener`, defaults to True
+        :type keep: bool, optional
+        :param limits: how many lines to hold in memory, defaults to None for no limit
+        :type limits: Optional[CaptureLimits], optional
         """
         super().__init__(initial_value=initial_value, newline=newline)
-        self.values = list()
+        self.values = LineBuffer(limits)
         self.idx = 0
+        self.listener = listener
+        self.keep = keep
+        # fragments of the last line, until its newline is written
+        self._partial = []
 
     def write(self, s: str, /):
         """Gobble written data and save it to a list right away.
@@ -62,32 +341,34 @@ class ListStringIO(StringIO):
         :param s: data to write to output
         :type s: str
         """
-        super().write(s)
-        self.flush()
-        val = self.getvalue()
-        self.seek(0)
-        self.truncate()
-        dvals = val.replace("\r", "\n").splitlines(keepends=True)
-        vals = []
-        for v in dvals:
-            nv = v.rstrip()
+        if self.listener is not None:
+            self.listener(s)
+        if not self.keep:
+            return len(s)
+        for v in s.replace("\r", "\n").splitlines(keepends=True):
             if v[-1] == "\n":
-                nv = f"{nv}\n"
-            if nv:
-                vals.append(nv)
-        if vals and self.values and self.values[-1][-1] != "\n":
-            self.values[-1] = self.values[-1] + vals[0]
-            self.values.extend(vals[1:])
-        else:
-            self.values.extend(vals)
+                self._partial.append(v.rstrip())
+                self.values.append("".join(self._partial) + "\n")
+                self._partial = []
+            else:
+                nv = v.rstrip()
+                if nv:
+                    self._partial.append(nv)
+        return len(s)
+
+    def _flush_partial(self):
+        if self._partial:
+            self.values.append("".join(self._partial))
+            self._partial = []
 
     def get(self) -> str:
         """Get next line of output data.
 
         :return: Next line of output, None if end of list
-            and no new lines
+            and no new lines; lines dropped by a ring buffer are skipped
         :rtype: str
         """
+        self.idx = max(self.idx, self.values.first)
         if self.idx >= len(self.values):
             return None
         rec = self.values[self.idx]
@@ -100,21 +381,51 @@ class ListStringIO(StringIO):
         :return: all lines written to output split on newlines
         :rtype: list[str]
         """
-        return self.values
+        lines = list(self.values)
+        if self._partial:
+            lines.append("".join(self._partial))
+        return lines
+
+    def close(self):
+        """Keep the unterminated last line and release the spill file."""
+        self._flush_partial()
+        self.values.close()
+        super().close()
 
 
 class PersistantHandler(logging.Handler):
     """Save logged information into a list of records."""
 
-    def __init__(self, json: bool = False):
+    def __init__(
+        self,
+        json: bool = False,
+        owner: Optional["OutputCapture"] = None,
+        listener: Callable[[str], None] = None,
+        keep: bool = True,
+        limits: Optional[CaptureLimits] = None,
+    ):
         """Prep handler to be attached to a :class:`logging.Logger`.
 
         :param json: if the output should be saved as a json value
             instead of a string, defaults to False
         :type json: bool, optional
+        :param owner: only keep records logged while this capture is active in the
+            logging thread, defaults to None to keep every record
+        :type owner: Optional[OutputCapture], optional
+        :param listener: called with every formatted record, defaults to None
+        :type listener: Callable[[str], None], optional
+        :param keep: save records, False to only pass them to `listener`, defaults to True
+        :type keep: bool, optional
+        :param limits: how many records to hold in memory, defaults to None for no limit
+        :type limits: Optional[CaptureLimits], optional
         """
         super().__init__()
-        self.records = list()
+        self.owner = owner
+        self.listener = listener
+        self.keep = keep
+        if owner is not None:
+            self.addFilter(self._owned)
+        self.records = LineBuffer(limits)
         self.idx = 0
         self.closed = False
 
@@ -125,6 +436,9 @@ class PersistantHandler(logging.Handler):
         self.setFormatter(formatter)
         self.setLevel("INFO")
 
+    def _owned(self, record: logging.LogRecord) -> bool:
+        return _active_capture.get() is self.owner
+
     def emit(self, record: logging.LogRecord):
         """Log the record to the handlers internal list.
 
@@ -138,7 +452,10 @@ class PersistantHandler(logging.Handler):
             if not self.json:
                 formatted = formatted.rstrip()
             if formatted:
-                self.records.append(formatted)
+                if self.keep:
+                    self.records.append(formatted)
+                if self.listener is not None:
+                    self.listener(formatted)
         except Exception:
             self.handleError(record)
 
@@ -148,6 +465,7 @@ class PersistantHandler(logging.Handler):
         :return: Next item in the list if there is one available, otherwise `None`
         :rtype: Union[str, Json, None]
         """
+        self.idx = max(self.idx, self.records.first)
         if self.idx >= len(self.records):
             return None
         rec = self.records[self.idx]
@@ -157,10 +475,10 @@ class PersistantHandler(logging.Handler):
     def get_all(self) -> list[Union[str, Json]]:
         """Retrieve full list of records.
 
-        :return: _description_
+        :return: every record still available
         :rtype: list[Union[str, Json]]
         """
-        return self.records
+        return list(self.records)
 
     def get_rest(self) -> list[Union[str, Json]]:
         """Retrieve remaining records starting at current index.
@@ -168,9 +486,8 @@ class PersistantHandler(logging.Handler):
         :return: Unretrieved records in the list
         :rtype: list[Union[str, Json]]
         """
-        if self.idx < len(self.records):
-            return self.records[self.idx :]
-        return []
+        start = max(self.idx, self.records.first)
+        return [self.records[i] for i in range(start, len(self.records))]
 
     def __str__(self):
         """Join every record saved with newlines.
@@ -178,7 +495,7 @@ class PersistantHandler(logging.Handler):
         :return: String of the records saved.
         :rtype: str
         """
-        return "\n".join([str(r) for r in self.records])
+        return "\n".join(str(r) for r in self.records)
 
     def value(self):
         """Return the records based on the output type (json or string).
@@ -187,7 +504,7 @@ class PersistantHandler(logging.Handler):
         :rtype: Union[str, list[Json]]
         """
         if self.json:
-            return self.records
+            return list(self.records)
         return str(self)
 
     def close(self):
@@ -197,6 +514,7 @@ class PersistantHandler(logging.Handler):
         to the logger.
         """
         self.closed = True
+        self.records.close()
 
     def seek(self, idx: int = 0):
         """Set the index for getting the next record.
@@ -212,16 +530,32 @@ class PersistantHandler(logging.Handler):
 class BorgLogCapture:
     """Capture Borgs output to review after a command call."""
 
-    def __init__(self, logger: str, log_json: bool = False):
+    def __init__(
+        self,
+        logger: str,
+        log_json: bool = False,
+        owner: Optional["OutputCapture"] = None,
+        listener: Callable[[str], None] = None,
+        keep: bool = True,
+        limits: Optional[CaptureLimits] = None,
+    ):
         """Attach handler to specified logger to gather output data.
 
         :param logger: Logger to get information from.
         :type logger: str
         :param log_json: save data as a json instead of a string, defaults to False
         :type log_json: bool, optional
+        :param owner: capture whose context records must come from, defaults to None
+        :type owner: Optional[OutputCapture], optional
+        :param listener: called with every formatted record, defaults to None
+        :type listener: Callable[[str], None], optional
+        :param keep: save records, False to only pass them to `listener`, defaults to True
+        :type keep: bool, optional
+        :param limits: how many records to hold in memory, defaults to None for no limit
+        :type limits: Optional[CaptureLimits], optional
         """
         self.logger = logging.getLogger(logger)
-        self.handler = PersistantHandler(log_json)
+        self.handler = PersistantHandler(log_json, owner, listener, keep, limits)
         self.logger.addHandler(self.handler)
 
     def get(self) -> Optional[Union[str, Json]]:
@@ -266,13 +600,24 @@ class BorgLogCapture:
 class OutputCapture:
     """Capture stdout and stderr by redirecting to inmemory streams.
 
+    Redirection is scoped to the calling thread or task: `sys.stdout` and
+    `sys.stderr` are replaced once by proxies that look up the active capture
+    in a context variable, and log handlers drop records from other contexts.
+    Use a separate instance per command when running commands concurrently.
+
     :param raw: Expecting raw bytes from stdout and stderr
     :type raw: bool
     """
 
-    def __init__(self):
-        """Create object to log Borg output."""
+    def __init__(self, limits: Optional[CaptureLimits] = None):
+        """Create object to log Borg output.
+
+        :param limits: how much of each stream to hold in memory, defaults to None for no limit
+        :type limits: Optional[CaptureLimits], optional
+        """
         self.ready = False
+        self._token = None
+        self.limits = limits
 
     def __call__(self, opts: OutputOptions) -> Self:
         """Create handlers to use by a context manager.
@@ -288,34 +633,62 @@ class OutputCapture:
         self.ready = False
         self.opts = opts
         self.raw = self.opts.raw_bytes
+        self.listener = _output_listener.get()
+        self.discarded = _discarded_streams.get()
         self._init_stdout(self.raw)
         self._init_stderr()
 
         self.list_capture = None
         if self.opts.list_show:
-            self.list_capture = BorgLogCapture("borg.output.list", self.opts.list_json)
+            self.list_capture = self._log_capture("borg.output.list", self.opts.list_json, "list")
 
         self.stats_capture = None
         if self.opts.stats_show:
-            self.stats_capture = BorgLogCapture("borg.output.stats", self.opts.stats_json)
+            self.stats_capture = self._log_capture("borg.output.stats", self.opts.stats_json, "stats")
 
         self.repo_capture = None
         if self.opts.repo_show:
-            self.repo_capture = BorgLogCapture("borg.repository", self.opts.repo_json)
+            self.repo_capture = self._log_capture("borg.repository", self.opts.repo_json, "repo")
 
+        install_stream_proxies()
+        self._token = _active_capture.set(self)
         self.ready = True
 
         return self
 
+    def _log_capture(self, logger: str, log_json: bool, stream: str) -> BorgLogCapture:
+        return BorgLogCapture(
+            logger,
+            log_json,
+            self,
+            self._listener_for(stream),
+            stream not in self.discarded,
+            self.limits,
+        )
+
+    def _listener_for(self, stream: str) -> Optional[Callable[[str], None]]:
+        if self.listener is None:
+            return None
+        return lambda text: self.listener(stream, text)
+
     def _init_stdout(self, raw: bool):
-        self._stdout = TextIOWrapper(BytesIO()) if raw else ListStringIO()
-        self.stdout_original = sys.stdout
-        sys.stdout = self._stdout
+        sink = _raw_sink.get() if raw else None
+        if sink is not None:
+            self._stdout = _RawStdout(sink)
+        elif raw:
+            self._stdout = TextIOWrapper(BytesIO())
+        else:
+            self._stdout = self._stream_capture("stdout")
 
     def _init_stderr(self):
-        self._stderr = ListStringIO()
-        self.stderr_original = sys.stderr
-        sys.stderr = self._stderr
+        self._stderr = self._stream_capture("stderr")
+
+    def _stream_capture(self, stream: str) -> ListStringIO:
+        return ListStringIO(
+            listener=self._listener_for(stream),
+            keep=stream not in self.discarded,
+            limits=self.limits,
+        )
 
     def getvalues(self) -> Union[str, bytes]:
         """Get the captured values from the redirected stdout and stderr.
@@ -325,7 +698,10 @@ class OutputCapture:
         """
         output = {}
 
-        if self.raw:
+        if isinstance(self._stdout, _RawStdout):
+            # already handed to the sink
+            stdout_value = None
+        elif self.raw:
             stdout_value = self._stdout.buffer.getvalue()
         else:
             stdout_value = "".join(self._stdout.get_all())
@@ -354,8 +730,9 @@ class OutputCapture:
             if self.repo_capture:
                 self.repo_capture.close()
         finally:
-            sys.stdout = self.stdout_original
-            sys.stderr = self.stderr_original
+            if self._token is not None:
+                _active_capture.reset(self._token)
+                self._token = None
             self.ready = False
 
     def __enter__(self) -> Self:
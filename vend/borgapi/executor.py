@@ -0,0 +1,433 @@
+"""Execution backends that decide where Borg commands run."""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from .capture import reset_output_listener, set_output_listener
+from .helpers import Output
+
+__all__ = [
+    "BorgJob",
+    "JobCancelled",
+    "JobTimeout",
+    "WorkerCrashed",
+    "InProcessExecutor",
+    "ProcessExecutor",
+    "EXECUTORS",
+]
+
+# Commands that must stay in the calling process: `mount` forks a FUSE daemon
+# of its own and the environment helpers only touch the local process.
+LOCAL_COMMANDS = {"mount", "umount", "serve", "set_environ", "unset_environ"}
+
+OutputListener = Callable[[str, str], None]
+
+
+class JobCancelled(Exception):
+    """The job was cancelled before it finished."""
+
+
+class JobTimeout(TimeoutError):
+    """The job ran longer than its timeout and was stopped."""
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process running the job exited unexpectedly."""
+
+
+class BorgJob:
+    """Handle to a Borg command submitted to an executor."""
+
+    def __init__(self, command: str, on_output: Optional[OutputListener] = None):
+        """Create a pending job.
+
+        :param command: name of the `BorgAPI` method being run
+        :type command: str
+        :param on_output: called with (stream, text) as output is captured, defaults to None
+        :type on_output: Optional[Callable[[str, str], None]], optional
+        """
+        self.command = command
+        self.on_output = on_output
+        self.started = False
+        self._done = threading.Event()
+        self._cancel = threading.Event()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def _emit(self, stream: str, text: str):
+        if self.on_output is not None:
+            try:
+                self.on_output(stream, text)
+            except Exception:
+                pass
+
+    def _finish(self, result: Output = None, error: BaseException = None):
+        self._result = result
+        self._error = error
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._call(fn)
+
+    def _call(self, fn: Callable[["BorgJob"], None]):
+        try:
+            fn(self)
+        except Exception:
+            pass
+
+    def add_done_callback(self, fn: Callable[["BorgJob"], None]):
+        """Call `fn` with the job once it finishes, fails or is cancelled.
+
+        Runs right away in the calling thread if the job is already done,
+        otherwise in the thread that finishes it.
+
+        :param fn: callback taking the job
+        :type fn: Callable[[BorgJob], None]
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def cancel(self) -> bool:
+        """Request cancellation.
+
+        :return: False if the job already finished, True otherwise
+        :rtype: bool
+        """
+        if self._done.is_set():
+            return False
+        self._cancel.set()
+        return True
+
+    @property
+    def cancelled(self) -> bool:
+        """If cancellation was requested."""
+        return self._cancel.is_set()
+
+    def done(self) -> bool:
+        """If the job has finished, failed or been cancelled."""
+        return self._done.is_set()
+
+    def result(self, timeout: Optional[float] = None) -> Output:
+        """Wait for the job and return what the `BorgAPI` method returned.
+
+        :param timeout: seconds to wait, defaults to None to wait forever
+        :type timeout: Optional[float], optional
+        :raises TimeoutError: the job did not finish within `timeout`
+        :return: command output
+        :rtype: Output
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.command} did not finish within {timeout} seconds")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class InProcessExecutor:
+    """Run submitted commands on threads of the current process.
+
+    A job can be cancelled only before it starts, and a timeout only stops
+    waiting for it; use :class:`ProcessExecutor` to stop running jobs. Jobs
+    that need their own working directory, or are submitted as `isolated` so
+    they can be stopped, are handed to a single worker process, since
+    `os.chdir` would move every thread of this one.
+    """
+
+    def __init__(self, api, size: int = 4, timeout: Optional[float] = None):
+        """Bind the executor to the api it runs commands on.
+
+        :param api: api instance whose methods are called
+        :type api: BorgAPI
+        :param size: number of threads, defaults to 4
+        :type size: int, optional
+        :param timeout: default seconds a job may run, defaults to None
+        :type timeout: Optional[float], optional
+        """
+        self.api = api
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=size, thread_name_prefix="borgapi")
+        self.isolated = None
+        self.lock = threading.Lock()
+
+    def _isolated(self) -> "ProcessExecutor":
+        with self.lock:
+            if self.isolated is None:
+                self.isolated = ProcessExecutor(self.api, 1, self.timeout)
+            return self.isolated
+
+    def submit(
+        self,
+        command: str,
+        args: tuple,
+        kwargs: dict,
+        on_output: Optional[OutputListener] = None,
+        timeout: Optional[float] = None,
+        cwd: Optional[str] = None,
+        isolated: bool = False,
+    ) -> BorgJob:
+        """Queue `command` and return its job handle."""
+        if cwd is not None or isolated:
+            return self._isolated().submit(command, args, kwargs, on_output, timeout, cwd)
+
+        job = BorgJob(command, on_output)
+        method = getattr(type(self.api), command)
+
+        def run():
+            if job.cancelled:
+                job._finish(error=JobCancelled(command))
+                return
+            job.started = True
+            token = set_output_listener(job._emit)
+            try:
+                job._finish(result=method(self.api, *args, **kwargs))
+            except BaseException as e:
+                job._finish(error=e)
+            finally:
+                reset_output_listener(token)
+
+        self.pool.submit(run)
+        return job
+
+    def run(self, command: str, args: tuple, kwargs: dict) -> Output:
+        """Run `command` directly in the calling thread."""
+        return getattr(type(self.api), command)(self.api, *args, **kwargs)
+
+    def shutdown(self):
+        """Stop accepting jobs and wait for the running ones."""
+        self.pool.shutdown(wait=True)
+        if self.isolated is not None:
+            self.isolated.shutdown()
+
+
+def _worker_main(conn, api_kwargs: dict):
+    """Loop of a pool worker: build a local api once, then run jobs as they arrive."""
+    # imported here because borgapi.borgapi imports this module
+    from .borgapi import BorgAPI
+
+    api = BorgAPI(**api_kwargs)
+    home = os.getcwd()
+
+    def listener(stream, text):
+        conn.send(("output", stream, text))
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        command, args, kwargs, environ, cwd = message
+        os.environ.update(environ)
+        token = set_output_listener(listener)
+        try:
+            # safe here: a worker runs one job at a time and owns its cwd
+            os.chdir(cwd or home)
+            result = getattr(api, command)(*args, **kwargs)
+            conn.send(("result", result))
+        except BaseException as e:
+            try:
+                conn.send(("error", e))
+            except Exception:
+                conn.send(("error", RuntimeError(f"{type(e).__name__}: {e}")))
+        finally:
+            reset_output_listener(token)
+            os.chdir(home)
+
+
+class _Worker:
+    def __init__(self, context, api_kwargs: dict):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, api_kwargs),
+            name="borgapi-worker",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.kill()
+
+
+class ProcessExecutor:
+    """Run submitted commands in a bounded pool of warm worker processes.
+
+    Each worker builds its own `BorgAPI` once and then serves jobs, so borg's
+    chunking, hashing and compression never hold the web worker's GIL and a
+    crash only takes one worker down. Cancelling or timing out a running job
+    terminates its worker, which is replaced by a fresh one.
+    """
+
+    POLL_INTERVAL = 0.1
+
+    def __init__(
+        self,
+        api,
+        size: int = 2,
+        timeout: Optional[float] = None,
+        start_method: str = "spawn",
+    ):
+        """Prepare a pool of `size` workers, started on the first submitted job.
+
+        Starting lazily matters with "spawn": workers re-import the parent's main
+        module, which may build its own api with a pool executor at import time.
+
+        :param api: api whose init arguments are replayed in every worker
+        :type api: BorgAPI
+        :param size: number of worker processes, defaults to 2
+        :type size: int, optional
+        :param timeout: default seconds a job may run, defaults to None
+        :type timeout: Optional[float], optional
+        :param start_method: multiprocessing start method, defaults to "spawn"
+            because forking a threaded web server is unsafe
+        :type start_method: str, optional
+        """
+        self.api_kwargs = {**api.init_kwargs, "executor": "inprocess"}
+        self.size = size
+        self.timeout = timeout
+        self.context = multiprocessing.get_context(start_method)
+        self.idle = queue.Queue()
+        self.workers = []
+        self.started = False
+        self.lock = threading.Lock()
+
+    def _start(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        for _ in range(self.size):
+            self._spawn()
+
+    def _spawn(self):
+        worker = _Worker(self.context, self.api_kwargs)
+        with self.lock:
+            self.workers.append(worker)
+        self.idle.put(worker)
+
+    def _replace(self, worker: _Worker):
+        worker.kill()
+        with self.lock:
+            if worker in self.workers:
+                self.workers.remove(worker)
+        self._spawn()
+
+    @staticmethod
+    def _environ() -> dict:
+        # workers are started once, so send the borg settings current at submit time
+        return {k: v for k, v in os.environ.items() if k.startswith("BORG_")}
+
+    def submit(
+        self,
+        command: str,
+        args: tuple,
+        kwargs: dict,
+        on_output: Optional[OutputListener] = None,
+        timeout: Optional[float] = None,
+        cwd: Optional[str] = None,
+        isolated: bool = False,
+    ) -> BorgJob:
+        """Queue `command` and return its job handle; every job here is isolated."""
+        self._start()
+        job = BorgJob(command, on_output)
+        timeout = self.timeout if timeout is None else timeout
+        message = (command, args, kwargs, self._environ(), cwd)
+        threading.Thread(
+            target=self._dispatch,
+            args=(job, message, timeout),
+            name=f"borgapi-{command}",
+            daemon=True,
+        ).start()
+        return job
+
+    def _acquire(self, job: BorgJob) -> Optional[_Worker]:
+        while not job.cancelled:
+            try:
+                return self.idle.get(timeout=self.POLL_INTERVAL)
+            except queue.Empty:
+                continue
+        return None
+
+    def _dispatch(self, job: BorgJob, message: tuple, timeout: Optional[float]):
+        worker = self._acquire(job)
+        if worker is None:
+            job._finish(error=JobCancelled(job.command))
+            return
+
+        job.started = True
+        deadline = time.monotonic() + timeout if timeout else None
+        try:
+            worker.conn.send(message)
+            while True:
+                if job.cancelled:
+                    self._replace(worker)
+                    job._finish(error=JobCancelled(job.command))
+                    return
+                if deadline is not None and time.monotonic() > deadline:
+                    self._replace(worker)
+                    job._finish(error=JobTimeout(f"{job.command} exceeded {timeout} seconds"))
+                    return
+                if not worker.conn.poll(self.POLL_INTERVAL):
+                    continue
+
+                kind, *payload = worker.conn.recv()
+                if kind == "output":
+                    job._emit(*payload)
+                elif kind == "result":
+                    job._finish(result=payload[0])
+                    break
+                else:
+                    job._finish(error=payload[0])
+                    break
+        except (EOFError, OSError):
+            self._replace(worker)
+            job._finish(error=WorkerCrashed(f"worker exited while running {job.command}"))
+            return
+
+        self.idle.put(worker)
+
+    def run(self, command: str, args: tuple, kwargs: dict) -> Output:
+        """Run `command` in a worker and block until it returns."""
+        return self.submit(command, args, kwargs).result()
+
+    def shutdown(self):
+        """Stop every worker process."""
+        with self.lock:
+            workers, self.workers = self.workers, []
+            self.started = False
+        for worker in workers:
+            worker.stop()
+
+
+EXECUTORS = {
+    "inprocess": InProcessExecutor,
+    "pool": ProcessExecutor,
+}
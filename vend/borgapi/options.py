@@ -1,9 +1,10 @@
 """Option Dataclasses."""
 
+import functools
 import logging
 import re
 from dataclasses import dataclass
-from typing import List, Optional, Set, Union
+from typing import List, Optional, Set, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
@@ -68,11 +69,9 @@ class OptionsBase:
                 logger.warning("[DEPRECATED] %s, not being replaced", old_field)
 
     @classmethod
+    @functools.lru_cache(maxsize=None)
     def _defaults(cls) -> Set[str]:
-        defaults = set()
-        for field in cls.__dataclass_fields__.values():
-            defaults.add(field.name)
-        return defaults
+        return frozenset(cls.__dataclass_fields__)
 
     @staticmethod
     def _is_list(type_):
@@ -81,6 +80,29 @@ class OptionsBase:
         except TypeError:
             return issubclass(type_.__origin__, list)
 
+    @classmethod
+    @functools.lru_cache(maxsize=None)
+    def _argument_specs(cls) -> Tuple[Tuple[str, object, str, Optional[str]], ...]:
+        """Work out once per class how each field turns into flags.
+
+        :return: (name, default, flag, kind) per field, kind being "bool", "value",
+            "list" or None for types that cannot be turned into flags
+        :rtype: Tuple[Tuple[str, object, str, Optional[str]], ...]
+        """
+        specs = []
+        for key, value in cls.__dataclass_fields__.items():
+            if value.type is bool:
+                kind = "bool"
+            elif value.type is str or value.type is int:
+                kind = "value"
+            else:
+                try:
+                    kind = "list" if cls._is_list(value.type) else None
+                except (TypeError, AttributeError):
+                    kind = None
+            specs.append((key, value.default, cls.convert_name(key), kind))
+        return tuple(specs)
+
     def parse(self) -> List[Optional[Union[str, int]]]:
         """Turn options into list for argv.
 
@@ -89,20 +111,21 @@ class OptionsBase:
         """
         args = []
 
-        for key, value in self.__dataclass_fields__.items():
+        for key, default, flag, kind in self._argument_specs():
             attr = getattr(self, key)
-            if attr is not None and value.default != attr:
-                flag = self.convert_name(key)
-                if value.type is bool:
-                    if attr is not value.default:
-                        args.append(flag)
-                elif value.type is str or value.type is int:
-                    args.extend([flag, attr])
-                elif self._is_list(value.type):
-                    for val in attr:
-                        args.extend([flag, val])
-                else:
-                    raise TypeError(f'Unrecognized flag type for "{key}": {value.type}')
+            if attr is None or default == attr:
+                continue
+            if kind == "bool":
+                if attr is not default:
+                    args.append(flag)
+            elif kind == "value":
+                args.extend([flag, attr])
+            elif kind == "list":
+                for val in attr:
+                    args.extend([flag, val])
+            else:
+                field_type = self.__dataclass_fields__[key].type
+                raise TypeError(f'Unrecognized flag type for "{key}": {field_type}')
         return args
 
 
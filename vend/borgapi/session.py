@@ -0,0 +1,292 @@
+"""Repositories kept open across several Borg commands."""
+
+import hashlib
+import inspect
+import stat
+import threading
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Callable, Iterator, Optional
+
+from borg.archive import Archive
+from borg.archiver import get_repository
+from borg.cache import Cache, assert_secure
+from borg.helpers import Location, Manifest
+
+__all__ = ["RepositorySession", "SessionPool", "SessionError"]
+
+# Borg functions that need the repository lock to themselves.
+WRITE_COMMANDS = {
+    "do_create",
+    "do_delete",
+    "do_prune",
+    "do_compact",
+    "do_rename",
+    "do_recreate",
+    "do_import_tar",
+    "do_key_change_passphrase",
+}
+
+# what `with_repository` hands the decorated borg functions
+_INJECTED = ("repository", "manifest", "key", "cache")
+
+# Session commands of the current thread or task run against.
+_active_session: ContextVar[Optional["RepositorySession"]] = ContextVar(
+    "borgapi_active_session", default=None
+)
+
+
+class SessionError(RuntimeError):
+    """A command cannot run in the active session."""
+
+
+class RepositorySession:
+    """One repository opened, locked and authenticated for several commands.
+
+    Opening a repository costs a lock, deriving the key from the passphrase,
+    loading the manifest and, for some commands, syncing the chunks cache.
+    A session pays for that once: commands run while it is active get the
+    open repository, manifest, key and cache handed to them directly.
+
+    A shared session only runs read commands. An exclusive session holds the
+    write lock, so a batch of writes runs without other processes in between.
+    """
+
+    def __init__(self, repository: str, exclusive: bool = False, lock_wait: int = 1):
+        """Open the repository.
+
+        :param repository: repository location, as given to the commands
+        :type repository: str
+        :param exclusive: take the write lock so write commands can run, defaults to False
+        :type exclusive: bool, optional
+        :param lock_wait: seconds to wait for the repository lock, defaults to 1
+        :type lock_wait: int, optional
+        """
+        self.location = Location(repository)
+        self.exclusive = exclusive
+        self.lock_wait = lock_wait
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+        self.closed = False
+        self._cache = None
+
+        self.repository = get_repository(
+            self.location,
+            create=False,
+            exclusive=exclusive,
+            lock_wait=lock_wait,
+            lock=True,
+            append_only=False,
+            make_parent_dirs=False,
+            storage_quota=None,
+            args=None,
+        )
+        self.repository.__enter__()
+        try:
+            operation = Manifest.Operation.WRITE if exclusive else Manifest.Operation.READ
+            self.manifest, self.key = Manifest.load(self.repository, (operation,))
+            assert_secure(self.repository, self.manifest, lock_wait)
+        except BaseException:
+            self.repository.__exit__(None, None, None)
+            raise
+
+    def matches(self, location) -> bool:
+        """If `location` is this session's repository or an archive in it."""
+        return location.canonical_path() == self.location.canonical_path()
+
+    def _get_cache(self) -> Cache:
+        if self._cache is None:
+            self._cache = Cache(self.repository, self.key, self.manifest, lock_wait=self.lock_wait)
+            self._cache.__enter__()
+        return self._cache
+
+    def _drop_cache(self):
+        # write commands open the cache themselves and may change the chunks in it
+        if self._cache is not None:
+            self._cache.__exit__(None, None, None)
+            self._cache = None
+
+    def bind(self, archiver, func: Callable) -> Callable:
+        """Turn the archiver's `func` into a call that uses the open repository.
+
+        :param archiver: archiver the command runs on
+        :type archiver: borg.archiver.Archiver
+        :param func: bound `do_*` function of the archiver
+        :type func: Callable
+        :raises SessionError: the command cannot use this session
+        :return: function taking the parsed args
+        :rtype: Callable
+        """
+        name = func.__name__
+        decorated = getattr(type(archiver), name)
+        method = getattr(decorated, "__wrapped__", None)
+        if method is None:
+            raise SessionError(f"`{name}` does not open a repository")
+        if name in WRITE_COMMANDS and not self.exclusive:
+            raise SessionError(f"`{name}` needs an exclusive session")
+
+        wanted = inspect.signature(inspect.unwrap(decorated)).parameters
+
+        def call(args):
+            with self.lock:
+                if self.closed:
+                    raise SessionError("session is closed")
+                if name in WRITE_COMMANDS:
+                    self._drop_cache()
+                kwargs = {}
+                for injected in _INJECTED:
+                    if injected in wanted:
+                        kwargs[injected] = (
+                            self._get_cache() if injected == "cache" else getattr(self, injected)
+                        )
+                try:
+                    return method(archiver, args, **kwargs)
+                finally:
+                    self.last_used = time.monotonic()
+
+        call.__name__ = name
+        return call
+
+    def iter_items(self, archive: str) -> Iterator[dict]:
+        """Yield the items of `archive` with a digest of the chunk ids making up each file.
+
+        Only archive metadata is read: two items with the same digest have the
+        same content, without any file data being fetched or decrypted. The
+        session lock is held until the generator is exhausted or closed.
+
+        :param archive: archive name
+        :type archive: str
+        :return: generator of dicts with path, type, mode, size, mtime (UTC) and chunk_digest;
+            chunk_digest is None for items without content
+        :rtype: Iterator[dict]
+        """
+        with self.lock:
+            if self.closed:
+                raise SessionError("session is closed")
+            for item in Archive(self.repository, self.key, self.manifest, archive).iter_items():
+                chunks = item.get("chunks") or []
+                digest = None
+                if chunks:
+                    digest = hashlib.blake2b(b"".join(c.id for c in chunks), digest_size=16)
+                    digest = digest.hexdigest()
+                mtime = datetime.fromtimestamp(item.mtime / 1e9, timezone.utc)
+                yield {
+                    "path": item.path,
+                    "type": stat.filemode(item.mode)[0],
+                    "mode": item.mode,
+                    "size": item.size if "size" in item else sum(c.size for c in chunks),
+                    "mtime": mtime.replace(tzinfo=None).isoformat(),
+                    "chunk_digest": digest,
+                }
+
+    def close(self):
+        """Release the cache, the lock and the repository."""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self._drop_cache()
+            finally:
+                self.repository.__exit__(None, None, None)
+
+
+class SessionPool:
+    """Open sessions of one api, closed after sitting idle for `idle_timeout` seconds."""
+
+    def __init__(self, idle_timeout: float = 30):
+        """Create an empty pool.
+
+        :param idle_timeout: seconds an unused session stays open, defaults to 30
+        :type idle_timeout: float, optional
+        """
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.in_use = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def acquire(self, repository: str, exclusive: bool, lock_wait: int) -> RepositorySession:
+        """Get the open session for `repository`, opening one if needed."""
+        key = Location(repository).canonical_path()
+        with self.lock:
+            session = self.sessions.get(key)
+            stale = None
+            if session is not None and (session.closed or session.exclusive != exclusive):
+                if self.in_use.get(key) and not session.closed:
+                    raise SessionError(f"{repository} is in use by a session with another lock")
+                stale = self.sessions.pop(key)
+            elif session is not None:
+                self.in_use[key] = self.in_use.get(key, 0) + 1
+                return session
+
+        if stale is not None:
+            stale.close()
+
+        session = RepositorySession(repository, exclusive, lock_wait)
+        with self.lock:
+            other = self.sessions.get(key)
+            if other is None or other.closed or other.exclusive != exclusive:
+                self.sessions[key] = session
+                other = None
+            self.in_use[key] = self.in_use.get(key, 0) + 1
+        if other is not None:
+            # another thread opened it meanwhile
+            session.close()
+            return other
+        self._start_reaper()
+        return session
+
+    def release(self, session: RepositorySession):
+        """Hand a session back; it stays open until idle for `idle_timeout`."""
+        key = session.location.canonical_path()
+        with self.lock:
+            self.in_use[key] = max(0, self.in_use.get(key, 0) - 1)
+        session.last_used = time.monotonic()
+        if self.idle_timeout <= 0:
+            self.evict(key)
+
+    def evict(self, key: str):
+        """Close the session for repository path `key` unless a caller is using it.
+
+        Commands run outside a session call this first, so an idle session
+        never keeps them from getting the repository lock.
+        """
+        with self.lock:
+            if self.in_use.get(key):
+                return
+            session = self.sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def _start_reaper(self):
+        with self.lock:
+            if self.reaper is not None and self.reaper.is_alive():
+                return
+            self.reaper = threading.Thread(target=self._reap, name="borgapi-sessions", daemon=True)
+            self.reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(max(0.5, self.idle_timeout / 4))
+            now = time.monotonic()
+            with self.lock:
+                idle = [
+                    key
+                    for key, session in self.sessions.items()
+                    if not self.in_use.get(key) and now - session.last_used > self.idle_timeout
+                ]
+                if not self.sessions:
+                    self.reaper = None
+                    return
+            for key in idle:
+                self.evict(key)
+
+    def close(self):
+        """Close every session."""
+        with self.lock:
+            sessions, self.sessions = list(self.sessions.values()), {}
+            self.in_use = {}
+        for session in sessions:
+            session.close()